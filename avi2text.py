@@ -3,19 +3,88 @@
 import os
 import sys
 import argparse
-import moviepy.editor as mp
-import torch
-import whisperx
-from whisperx.diarize import DiarizationPipeline
 import json
 import pickle
 from dotenv import load_dotenv
 import logging
-import language_tool_python
-import difflib
 from datetime import timedelta
-import base64
 import webbrowser
+import glob
+import time
+import mmap
+import struct
+import wave
+import subprocess
+import hashlib
+import shutil
+import tempfile
+import re
+import bisect
+import queue
+import sqlite3
+import threading
+import platform
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+ROZSZERZENIA_WIDEO = (".avi", ".mp4", ".mkv", ".mov", ".wmv", ".flv", ".webm", ".mpg", ".mpeg", ".m4v")
+ROZSZERZENIA_MANIFESTU = (".txt", ".lst", ".list")
+# Tryby odtwarzania w HTML: osobne klipy albo jedna wspólna ścieżka audio przewijana do segmentu
+TRYBY_AUDIO_HTML = ("klipy", "wav", "opus", "mp3")
+KODEKI_AUDIO_HTML = {
+    "opus": ["-c:a", "libopus", "-b:a", "32k"],
+    "mp3": ["-c:a", "libmp3lame", "-b:a", "64k"],
+}
+# Segmenty w formacie 'js' trafiają do kilku skryptów; pierwszy jest mały, żeby strona szybko pokazała początek
+ROZMIAR_PIERWSZEJ_CZESCI_DANYCH = 200
+ROZMIAR_CZESCI_DANYCH = 5000
+FORMATY_DANYCH_HTML = ("js", "ndjson", "ndjson.gz")
+
+# Cache wyników etapów adresowany skrótem pliku wejściowego i parametrami etapu
+DOMYSLNY_FOLDER_CACHE = os.environ.get("AVI2TEXT_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "avi2text"))
+# Zmiana sposobu ekstrakcji audio musi unieważnić wpisy cache, więc trafia do klucza etapu
+WERSJA_EKSTRAKCJI = "ffmpeg-16k-mono-pcm_s16le"
+PLIK_KLUCZY_ROBOCZYCH = "klucze_cache.json"
+# Modele whisperx pracują na audio mono 16 kHz
+CZESTOTLIWOSC_MODELI = 16000
+# Parametry energetycznego VAD; trafiają do kluczy cache ASR i diarization
+PARAMETRY_VAD = {"okno_s": 0.03, "prog_db": 12.0, "min_mowa_s": 0.3, "min_cisza_s": 1.0, "margines_s": 0.25}
+
+# Rejestr modeli współdzielony przez wszystkie pliki przetwarzane w tym procesie
+_REJESTR_MODELI = {}
+# Osobna blokada dla każdego klucza: równoległe zadania demona ładują dany model tylko raz
+_BLOKADA_REJESTRU = threading.Lock()
+_BLOKADY_MODELI = {}
+# Transkrypcja, wyrównanie i diarization korzystają ze wspólnych modeli, które nie są bezpieczne wątkowo
+_BLOKADA_ETAPOW_ML = threading.Lock()
+# Diarization w tle i etapy w wątku głównym mogą jednocześnie dopisywać pomiary
+_BLOKADA_METRYK = threading.Lock()
+PLIK_METRYK = "metryki.json"
+# Etapy wykonywane w całości w jednym wątku Pythona mierzą CPU tego wątku; pozostałe (torch, CTranslate2, pule wątków)
+# liczą CPU całego procesu, więc obejmuje ono też równoległe etapy i zadania demona
+ETAPY_CPU_WATKU = ("ekstrakcja", "agregacja", "klipy", "wspolna_sciezka", "html")
+# Pliki współdzielone przez wątki demona i procesy wsadowe (np. skroty.json) są zmieniane pod blokadą
+_BLOKADA_PLIKOW = threading.Lock()
+_BLOKADY_PLIKOW = {}
+
+# Indeks pełnotekstowy wyników z wielu folderów roboczych (słowa z czasami, mówcą i plikiem źródłowym)
+DOMYSLNY_PLIK_INDEKSU = os.path.join(DOMYSLNY_FOLDER_CACHE, "indeks.sqlite")
+WZORZEC_TOKENU = re.compile(r"\w+")
+
+# Ustawienia ASR bez profilu sprzętowego (--autotune zapisuje lepsze dla danego hosta i modelu)
+DOMYSLNE_USTAWIENIA_ASR = {"batch_size": 16, "cpu_threads": os.cpu_count(), "compute_type": "auto", "beam_size": 5}
+PLIK_PROFILU_SPRZETU = "profil_sprzetu.json"
+# Minimalna zgodność słów z transkrypcją referencyjną, żeby szybsze ustawienie mogło trafić do profilu
+MIN_ZGODNOSC_AUTOTUNE = 0.97
+
+# Baza głosów znanych mówców (embeddingi z diarization) i próg podobieństwa kosinusowego do ich rozpoznania
+PLIK_BAZY_GLOSOW = "baza_glosow.json"
+PROG_PODOBIENSTWA_GLOSU = 0.6
+
+# Korekta LanguageTool: zdania są sprawdzane paczkami, a wyniki zapamiętywane po skrócie zdania
+PLIK_CACHE_KOREKTY = "korekta.sqlite"
+ROZMIAR_PACZKI_KOREKTY = 50
+PODZIAL_ZDAN = re.compile(r"(?<=[.!?…])(\s+)")
 
 def format_timestamp(seconds):
     """Formats seconds into HH:MM:SS format."""
@@ -26,16 +95,1218 @@ def format_timestamp(seconds):
     seconds_val = total_seconds % 60
     return f"{hours:02}:{minutes:02}:{seconds_val:02}"
 
-def generate_html_output(transcription_data, audio_clips_relative_paths, original_filename, output_html_path):
+def szczyt_rss_procesu_mb():
+    """Returns the process-wide peak resident set size since process start in MB, or None where the platform does not report it."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    szczyt = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux podaje ru_maxrss w KB, macOS w bajtach
+    return round(szczyt / (1024 ** 2 if sys.platform == "darwin" else 1024), 1)
+
+@contextmanager
+def mierz_etap(metryki, etap):
+    """
+    Adds the wall time and CPU time of the enclosed block to metryki[etap], plus the process peak RSS at its end.
+    CPU time is per-thread for the stages in ETAPY_CPU_WATKU and process-wide otherwise.
+    Repeated stages (e.g. one per chunk) accumulate; a None dict disables measuring.
+    """
+    if metryki is None:
+        yield
+        return
+    zegar_cpu = time.thread_time if etap in ETAPY_CPU_WATKU else time.process_time
+    start, start_cpu = time.perf_counter(), zegar_cpu()
+    try:
+        yield
+    finally:
+        dodaj_pomiar(metryki, etap, time.perf_counter() - start, zegar_cpu() - start_cpu)
+
+def dodaj_pomiar(metryki, etap, czas, czas_cpu):
+    """Accumulates one measurement of a stage and records the process peak RSS at this point."""
+    with _BLOKADA_METRYK:
+        wpis = metryki.setdefault(etap, {"czas_s": 0.0, "cpu_s": 0.0, "wywolania": 0})
+        wpis["czas_s"] += czas
+        wpis["cpu_s"] += czas_cpu
+        wpis["wywolania"] += 1
+        wpis["szczyt_rss_procesu_mb"] = szczyt_rss_procesu_mb()
+
+def pobierz_model(klucz, fabryka, metryki=None):
+    """Returns the model registered under the key, loading it with the factory on first use (timed as 'ladowanie_modeli')."""
+    if klucz not in _REJESTR_MODELI:
+        with _BLOKADA_REJESTRU:
+            blokada = _BLOKADY_MODELI.setdefault(klucz, threading.Lock())
+        with blokada:
+            if klucz not in _REJESTR_MODELI:
+                print(f"Ładowanie modelu: {klucz[0]}...")
+                with mierz_etap(metryki, "ladowanie_modeli"):
+                    _REJESTR_MODELI[klucz] = fabryka()
+    return _REJESTR_MODELI[klucz]
+
+def raport_metryk(metryki, sciezka_pliku_wideo, audio_s, parametry):
+    """Builds the machine-readable metrics report of one run: per-stage times, CPU, process peak RSS and realtime factors."""
+    etapy = {}
+    for etap, wpis in metryki.items():
+        etapy[etap] = {
+            "czas_s": round(wpis["czas_s"], 3),
+            "cpu_s": round(wpis["cpu_s"], 3),
+            "cpu_zakres": "watek" if etap in ETAPY_CPU_WATKU else "proces",
+            # Szczyt RSS całego procesu od jego startu (także z wcześniejszych zadań demona), odczytany na końcu etapu
+            "szczyt_rss_procesu_mb": wpis.get("szczyt_rss_procesu_mb"),
+            "wywolania": wpis["wywolania"],
+            # RTF < 1 oznacza przetwarzanie szybsze niż czas trwania nagrania
+            "rtf": round(wpis["czas_s"] / audio_s, 4) if audio_s else None,
+        }
+    return {
+        "plik": os.path.basename(sciezka_pliku_wideo),
+        "host": platform.node(),
+        "znacznik_czasu": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "audio_s": round(audio_s, 3) if audio_s else None,
+        "parametry": parametry,
+        "etapy": etapy,
+    }
+
+def zapisz_metryki_prometheus(raporty, sciezka):
+    """Writes metrics reports as a Prometheus textfile (node_exporter textfile collector format), replacing it atomically."""
+    def etykieta(wartosc):
+        return str(wartosc).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    metryki = (
+        ("avi2text_etap_czas_sekundy", "czas_s", 1, "Czas ścienny etapu."),
+        ("avi2text_etap_cpu_sekundy", "cpu_s", 1, "Czas CPU etapu: wątku dla etapów jednowątkowych, całego procesu dla pozostałych."),
+        ("avi2text_proces_szczyt_rss_bajty", "szczyt_rss_procesu_mb", 1024 ** 2,
+         "Szczytowe RSS całego procesu od jego startu (nie samego etapu), odczytane na końcu etapu."),
+        ("avi2text_etap_rtf", "rtf", 1, "Czas etapu podzielony przez długość audio."),
+    )
+    linie = [
+        "# HELP avi2text_audio_sekundy Długość przetworzonego audio.",
+        "# TYPE avi2text_audio_sekundy gauge",
+    ]
+    for raport in raporty:
+        if raport["audio_s"] is not None:
+            linie.append(f'avi2text_audio_sekundy{{plik="{etykieta(raport["plik"])}"}} {raport["audio_s"]}')
+    for nazwa, pole, mnoznik, opis in metryki:
+        linie += [f"# HELP {nazwa} {opis}", f"# TYPE {nazwa} gauge"]
+        for raport in raporty:
+            model = raport["parametry"].get("model", "")
+            for etap, wpis in raport["etapy"].items():
+                if wpis.get(pole) is not None:
+                    linie.append(
+                        f'{nazwa}{{plik="{etykieta(raport["plik"])}",model="{etykieta(model)}",etap="{etap}"}} {wpis[pole] * mnoznik:g}'
+                    )
+    _zapisz_atomowo(sciezka, ("\n".join(linie) + "\n").encode('utf-8'))
+
+def skrot_pliku(sciezka, folder_cache):
+    """
+    Returns the SHA-256 of a file's contents.
+    Digests are memoized in the cache folder by path, size and mtime, so unchanged inputs are hashed only once.
+    """
+    sciezka_bezwzgledna = os.path.abspath(sciezka)
+    info = os.stat(sciezka_bezwzgledna)
+    identyfikator = [info.st_size, info.st_mtime_ns]
+    sciezka_pamieci = os.path.join(folder_cache, "skroty.json")
+    wpis = _wczytaj_json_lub_pusty(sciezka_pamieci).get(sciezka_bezwzgledna)
+    if wpis and wpis["id"] == identyfikator:
+        return wpis["sha256"]
+
+    skrot = hashlib.sha256()
+    with open(sciezka_bezwzgledna, 'rb') as f:
+        for blok in iter(lambda: f.read(1 << 20), b""):
+            skrot.update(blok)
+    # Plik jest czytany ponownie pod blokadą, żeby nie zgubić wpisów dodanych w międzyczasie przez inne zadania
+    with blokada_pliku(sciezka_pamieci):
+        pamiec = _wczytaj_json_lub_pusty(sciezka_pamieci)
+        pamiec[sciezka_bezwzgledna] = {"id": identyfikator, "sha256": skrot.hexdigest()}
+        _zapisz_atomowo(sciezka_pamieci, json.dumps(pamiec).encode('utf-8'))
+    return skrot.hexdigest()
+
+def klucz_etapu(etap, *skladniki):
+    """
+    Builds a cache key from the stage name and everything its result depends on,
+    so changing a parameter recomputes only the stages that depend on it.
+    """
+    return hashlib.sha256(json.dumps([etap, skladniki], sort_keys=True).encode('utf-8')).hexdigest()
+
+def sciezka_wpisu_cache(folder_cache, etap, klucz, rozszerzenie):
+    """Returns the path of a cache entry; each stage keeps its entries in a separate subfolder."""
+    return os.path.join(folder_cache, etap, f"{klucz}.{rozszerzenie}")
+
+def cache_odczytaj(folder_cache, etap, klucz, format_wpisu="json"):
+    """Reads a cached stage result (JSON or pickle) and marks it as recently used; returns None on a miss."""
+    sciezka = sciezka_wpisu_cache(folder_cache, etap, klucz, format_wpisu)
+    if not os.path.exists(sciezka):
+        return None
+    os.utime(sciezka)
+    with open(sciezka, 'rb') as f:
+        if format_wpisu == "pickle":
+            return pickle.load(f)
+        return json.loads(f.read().decode('utf-8'))
+
+def cache_zapisz(folder_cache, etap, klucz, wartosc, format_wpisu="json"):
+    """Stores a stage result in the cache."""
+    if format_wpisu == "pickle":
+        dane = pickle.dumps(wartosc, protocol=pickle.HIGHEST_PROTOCOL)
+    else:
+        dane = json.dumps(wartosc, ensure_ascii=False).encode('utf-8')
+    _zapisz_atomowo(sciezka_wpisu_cache(folder_cache, etap, klucz, format_wpisu), dane)
+
+def cache_przytnij(folder_cache, limit_bajtow):
+    """
+    Evicts least recently used cache entries until the cache fits in the size limit.
+    Pruning runs under a lock file; files still being written (.tmp, .part.wav) are left alone.
+    """
+    with blokada_pliku(os.path.join(folder_cache, "przycinanie")):
+        wpisy = []
+        for folder, _, nazwy in os.walk(folder_cache):
+            if folder == folder_cache:
+                continue
+            for nazwa in nazwy:
+                if nazwa.endswith((".tmp", ".part.wav")):
+                    continue
+                sciezka = os.path.join(folder, nazwa)
+                # Inne zadanie mogło w międzyczasie zastąpić albo usunąć plik
+                try:
+                    info = os.stat(sciezka)
+                except FileNotFoundError:
+                    continue
+                wpisy.append((info.st_mtime, info.st_size, sciezka))
+        rozmiar = sum(wpis[1] for wpis in wpisy)
+        for _, rozmiar_wpisu, sciezka in sorted(wpisy):
+            if rozmiar <= limit_bajtow:
+                break
+            try:
+                os.remove(sciezka)
+            except FileNotFoundError:
+                pass
+            rozmiar -= rozmiar_wpisu
+            print(f"Cache: usunięto najdawniej używany wpis {os.path.relpath(sciezka, folder_cache)}")
+
+def udostepnij_plik(zrodlo, cel):
+    """Places a cached file in the work folder as a hard link, falling back to a copy across filesystems."""
+    if os.path.exists(cel):
+        os.remove(cel)
+    try:
+        os.link(zrodlo, cel)
+    except OSError:
+        shutil.copyfile(zrodlo, cel)
+
+def _wczytaj_json_lub_pusty(sciezka):
+    if not os.path.exists(sciezka):
+        return {}
+    with open(sciezka, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _zapisz_atomowo(sciezka, dane):
+    folder = os.path.dirname(sciezka) or "."
+    os.makedirs(folder, exist_ok=True)
+    # Unikalny plik tymczasowy: wątki jednego procesu mogą jednocześnie zapisywać ten sam plik
+    deskryptor, sciezka_tymczasowa = tempfile.mkstemp(dir=folder, prefix=f".{os.path.basename(sciezka)}.", suffix=".tmp")
+    try:
+        with os.fdopen(deskryptor, 'wb') as f:
+            f.write(dane)
+        os.replace(sciezka_tymczasowa, sciezka)
+    except BaseException:
+        if os.path.exists(sciezka_tymczasowa):
+            os.remove(sciezka_tymczasowa)
+        raise
+
+@contextmanager
+def blokada_pliku(sciezka):
+    """
+    Serializes read-modify-write of a shared file: a lock per path for threads of this process
+    and an exclusive flock on <path>.lock for other processes (where fcntl is available).
+    """
+    sciezka = os.path.abspath(sciezka)
+    with _BLOKADA_PLIKOW:
+        blokada = _BLOKADY_PLIKOW.setdefault(sciezka, threading.Lock())
+    with blokada:
+        os.makedirs(os.path.dirname(sciezka), exist_ok=True)
+        with open(f"{sciezka}.lock", 'a') as plik_blokady:
+            try:
+                import fcntl
+                fcntl.flock(plik_blokady, fcntl.LOCK_EX)
+            except ImportError:
+                pass
+            yield
+
+def przygotuj_urzadzenie(compute_type, watki_cpu=None):
+    """
+    Imports torch only when a model is about to run, picks the device, resolves compute_type 'auto'
+    and applies the CPU thread count.
+    """
+    import torch
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    if compute_type == "auto":
+        compute_type = "float16" if device == "cuda" else "int8"
+    print(f"Krok 2/5: Używane urządzenie: {device} ({compute_type})")
+    if device == "cpu" and watki_cpu:
+        print(f"Ustawiam liczbę wątków CPU na: {watki_cpu}")
+        torch.set_num_threads(watki_cpu)
+    return device, compute_type
+
+def wymagany_token_hf():
+    """Returns the Hugging Face token needed by the diarization pipeline or exits when it is missing."""
+    hf_token = os.environ.get("HUGGING_FACE_TOKEN")
+    if not hf_token:
+        sys.exit("BŁĄD KRYTYCZNY: Brak tokena HUGGING_FACE_TOKEN w zmiennych środowiskowych.")
+    return hf_token
+
+def folder_roboczy_pliku(sciezka_pliku_wideo):
+    """Returns the work folder of a video: <name without extension>_work in the current directory."""
+    return f"{os.path.splitext(os.path.basename(sciezka_pliku_wideo))[0]}_work"
+
+def zbierz_pliki_wejsciowe(sciezka):
+    """
+    Expands a video path, directory, glob pattern or manifest file into a list of video files.
+    Exits when two files would share a <name>_work folder (same name without extension, e.g. in different subfolders).
+    """
+    if os.path.isdir(sciezka):
+        pliki = sorted(
+            os.path.join(sciezka, nazwa) for nazwa in os.listdir(sciezka)
+            if nazwa.lower().endswith(ROZSZERZENIA_WIDEO) and os.path.isfile(os.path.join(sciezka, nazwa))
+        )
+    elif any(znak in sciezka for znak in "*?["):
+        pliki = sorted(p for p in glob.glob(sciezka, recursive=True) if os.path.isfile(p))
+    elif sciezka.lower().endswith(ROZSZERZENIA_MANIFESTU):
+        folder_manifestu = os.path.dirname(os.path.abspath(sciezka))
+        with open(sciezka, 'r', encoding='utf-8') as f:
+            linie = [linia.strip() for linia in f]
+        pliki = [os.path.join(folder_manifestu, linia) for linia in linie if linia and not linia.startswith("#")]
+    else:
+        return [sciezka]
+
+    pliki_folderow = {}
+    for plik in pliki:
+        pliki_folderow.setdefault(folder_roboczy_pliku(plik), []).append(plik)
+    kolizje = [f"{folder}: " + ", ".join(lista) for folder, lista in sorted(pliki_folderow.items()) if len(lista) > 1]
+    if kolizje:
+        sys.exit(
+            "BŁĄD: Pliki o tej samej nazwie współdzieliłyby folder roboczy (zmień nazwy albo przetwórz je osobno):\n  "
+            + "\n  ".join(kolizje)
+        )
+    return pliki
+
+def _znajdz_dane_wav(mapa):
+    """Parses a RIFF/WAVE header and returns (channels, sample_rate, sample_width, data_offset, data_size)."""
+    if mapa[0:4] != b"RIFF" or mapa[8:12] != b"WAVE":
+        raise ValueError("plik nie jest poprawnym plikiem WAV")
+    pozycja = 12
+    format_audio = None
+    while pozycja + 8 <= len(mapa):
+        identyfikator = mapa[pozycja:pozycja + 4]
+        rozmiar = struct.unpack("<I", mapa[pozycja + 4:pozycja + 8])[0]
+        if identyfikator == b"fmt ":
+            kod, kanaly, czestotliwosc, _, _, bity = struct.unpack("<HHIIHH", mapa[pozycja + 8:pozycja + 24])
+            if kod not in (1, 0xFFFE):
+                raise ValueError(f"nieobsługiwany format WAV: {kod}")
+            format_audio = (kanaly, czestotliwosc, bity // 8)
+        elif identyfikator == b"data":
+            if format_audio is None:
+                raise ValueError("brak nagłówka 'fmt ' przed danymi")
+            rozmiar = min(rozmiar, len(mapa) - pozycja - 8)
+            return format_audio + (pozycja + 8, rozmiar)
+        pozycja += 8 + rozmiar + (rozmiar % 2)
+    raise ValueError("brak danych audio w pliku WAV")
+
+def nazwa_klipu(segment):
+    """Names a clip after its segment boundaries, so a clip stays valid for as long as its segment is unchanged."""
+    return f"clip_{round(segment['start'] * 1000):09d}_{round(segment['end'] * 1000):09d}.wav"
+
+def wytnij_klipy_audio(sciezka_pliku_audio, segmenty, folder_klipow_audio):
+    """
+    Cuts one WAV clip per segment by copying PCM frame ranges out of the memory-mapped source file.
+    Frame ranges follow moviepy's subclip arithmetic: the first frame is rounded and a clip running past
+    the end of the audio is padded with silence, as the former moviepy export did.
+    """
+    sciezki = []
+    if not segmenty:
+        return sciezki
+    with open(sciezka_pliku_audio, 'rb') as plik, mmap.mmap(plik.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+        kanaly, czestotliwosc, szerokosc_probki, poczatek_danych, rozmiar_danych = _znajdz_dane_wav(mapa)
+        rozmiar_ramki = kanaly * szerokosc_probki
+        liczba_ramek = rozmiar_danych // rozmiar_ramki
+        for segment in segmenty:
+            pierwsza_ramka = max(0, round(czestotliwosc * segment["start"]))
+            liczba_ramek_klipu = int(czestotliwosc * (segment["end"] - segment["start"]))
+            dostepne_ramki = min(liczba_ramek_klipu, liczba_ramek - pierwsza_ramka)
+            if liczba_ramek_klipu <= 0 or dostepne_ramki <= 0:
+                print(f"Ostrzeżenie: Nie udało się wyciąć klipu dla segmentu {segment['start']}-{segment['end']}: pusty zakres audio")
+                sciezki.append(None)
+                continue
+
+            sciezka_klipu = os.path.join(folder_klipow_audio, nazwa_klipu(segment))
+            od = poczatek_danych + pierwsza_ramka * rozmiar_ramki
+            try:
+                with wave.open(sciezka_klipu, 'wb') as klip:
+                    klip.setnchannels(kanaly)
+                    klip.setsampwidth(szerokosc_probki)
+                    klip.setframerate(czestotliwosc)
+                    klip.writeframes(mapa[od:od + dostepne_ramki * rozmiar_ramki])
+                    klip.writeframes(bytes((liczba_ramek_klipu - dostepne_ramki) * rozmiar_ramki))
+                sciezki.append(sciezka_klipu)
+            except Exception as e:
+                print(f"Ostrzeżenie: Nie udało się wyciąć klipu dla segmentu {segment['start']}-{segment['end']}: {e}")
+                sciezki.append(None)
+    return sciezki
+
+def aktualizuj_klipy_audio(sciezka_pliku_audio, segmenty, folder_klipow_audio, zrodlo):
+    """
+    Brings audio_clips/ in line with the segments using manifest.json, which records the boundaries of every clip.
+    Unchanged clips are reused, new or changed segments are cut, and clips no longer referenced are deleted.
+    A different source (extraction cache key) invalidates every clip.
+    """
+    sciezka_manifestu = os.path.join(folder_klipow_audio, "manifest.json")
+    manifest = _wczytaj_json_lub_pusty(sciezka_manifestu)
+    poprzednie_klipy = manifest.get("klipy", {}) if manifest.get("zrodlo") == zrodlo else {}
+
+    sciezki = [None] * len(segmenty)
+    do_wyciecia = []
+    for indeks, segment in enumerate(segmenty):
+        nazwa = nazwa_klipu(segment)
+        sciezka_klipu = os.path.join(folder_klipow_audio, nazwa)
+        if poprzednie_klipy.get(nazwa) == [segment["start"], segment["end"]] and os.path.exists(sciezka_klipu):
+            sciezki[indeks] = sciezka_klipu
+        else:
+            do_wyciecia.append(indeks)
+
+    for indeks, sciezka_klipu in zip(do_wyciecia, wytnij_klipy_audio(sciezka_pliku_audio, [segmenty[i] for i in do_wyciecia], folder_klipow_audio)):
+        sciezki[indeks] = sciezka_klipu
+
+    aktualne_klipy = {
+        os.path.basename(sciezka_klipu): [segment["start"], segment["end"]]
+        for segment, sciezka_klipu in zip(segmenty, sciezki) if sciezka_klipu
+    }
+    osierocone = [
+        nazwa for nazwa in os.listdir(folder_klipow_audio)
+        if nazwa.startswith("clip_") and nazwa.endswith(".wav") and nazwa not in aktualne_klipy
+    ]
+    for nazwa in osierocone:
+        os.remove(os.path.join(folder_klipow_audio, nazwa))
+    _zapisz_atomowo(sciezka_manifestu, json.dumps({"zrodlo": zrodlo, "klipy": aktualne_klipy}).encode('utf-8'))
+
+    print(f"  - Klipy: {len(segmenty) - len(do_wyciecia)} bez zmian, {len(do_wyciecia)} wyciętych, {len(osierocone)} usuniętych.")
+    return sciezki
+
+def wyodrebnij_audio(sciezka_pliku_wideo, sciezka_pliku_audio, start=None, koniec=None):
+    """
+    Extracts the first audio stream straight to mono 16 kHz PCM, the format the models consume.
+    ffmpeg demuxes only the audio stream and seeks to the start before decoding, so the video is never decoded.
+    With start/koniec only that part is extracted, so all later times are relative to start.
+    Falls back to moviepy when ffmpeg is not available on PATH.
+    """
+    opcje_zakresu = []
+    if start:
+        opcje_zakresu += ["-ss", f"{start:.3f}"]
+    if koniec is not None:
+        opcje_zakresu += ["-t", f"{koniec - (start or 0):.3f}"]
+    polecenie = [
+        "ffmpeg", "-nostdin", "-y", "-loglevel", "error", *opcje_zakresu, "-i", sciezka_pliku_wideo,
+        "-map", "0:a:0", "-vn", "-ac", "1", "-ar", str(CZESTOTLIWOSC_MODELI), "-c:a", "pcm_s16le", sciezka_pliku_audio
+    ]
+    try:
+        subprocess.run(polecenie, capture_output=True, check=True)
+    except FileNotFoundError:
+        print("Ostrzeżenie: Nie znaleziono ffmpeg w PATH, używam moviepy.")
+        import moviepy.editor as mp
+        wideo = mp.VideoFileClip(sciezka_pliku_wideo)
+        if wideo.audio is None:
+            sys.exit(f"BŁĄD: Plik wideo '{sciezka_pliku_wideo}' nie zawiera ścieżki audio.")
+        wideo.audio.subclip(start or 0, koniec).write_audiofile(
+            sciezka_pliku_audio, fps=CZESTOTLIWOSC_MODELI, codec='pcm_s16le', ffmpeg_params=["-ac", "1"], logger=None
+        )
+    except subprocess.CalledProcessError as e:
+        komunikat = e.stderr.decode('utf-8', errors='replace')
+        if "matches no streams" in komunikat:
+            sys.exit(f"BŁĄD: Plik wideo '{sciezka_pliku_wideo}' nie zawiera ścieżki audio.")
+        raise RuntimeError(komunikat.strip()) from e
+
+def czas_trwania_wav(sciezka_pliku_audio):
+    """Returns the duration of a PCM WAV file in seconds, reading only its header."""
+    with open(sciezka_pliku_audio, 'rb') as plik, mmap.mmap(plik.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+        kanaly, czestotliwosc, szerokosc_probki, _, rozmiar_danych = _znajdz_dane_wav(mapa)
+    return rozmiar_danych / (kanaly * szerokosc_probki * czestotliwosc)
+
+def dopisz_wav(sciezka_pliku_audio, sciezka_dopisywana):
+    """
+    Appends the samples of one PCM WAV file to another with the same format and patches the RIFF/data sizes,
+    so a growing recording is extended without rewriting what was already extracted. The appended file is consumed.
+    """
+    if not os.path.exists(sciezka_pliku_audio):
+        os.replace(sciezka_dopisywana, sciezka_pliku_audio)
+        return
+    with open(sciezka_dopisywana, 'rb') as plik:
+        naglowek_i_dane = plik.read()
+    *format_dopisywany, offset_danych, rozmiar_danych = _znajdz_dane_wav(naglowek_i_dane)
+    with open(sciezka_pliku_audio, 'r+b') as plik:
+        with mmap.mmap(plik.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+            *format_docelowy, offset_celu, rozmiar_celu = _znajdz_dane_wav(mapa)
+            rozmiar_pliku = len(mapa)
+        if format_docelowy != format_dopisywany or offset_celu + rozmiar_celu != rozmiar_pliku:
+            raise ValueError("nie można dopisać audio: inny format albo dane nie są ostatnim blokiem pliku WAV")
+        plik.seek(0, os.SEEK_END)
+        plik.write(naglowek_i_dane[offset_danych:offset_danych + rozmiar_danych])
+        plik.seek(4)
+        plik.write(struct.pack("<I", rozmiar_pliku + rozmiar_danych - 8))
+        plik.seek(offset_celu - 4)
+        plik.write(struct.pack("<I", rozmiar_celu + rozmiar_danych))
+    os.remove(sciezka_dopisywana)
+
+def wczytaj_fragment_audio(sciezka_pliku_audio, start, dlugosc):
+    """Decodes a time window of an audio file to mono 16 kHz float32, like whisperx.load_audio does for the whole file."""
+    import numpy as np
+    polecenie = [
+        "ffmpeg", "-nostdin", "-loglevel", "error", "-ss", f"{start:.3f}", "-t", f"{dlugosc:.3f}",
+        "-i", sciezka_pliku_audio, "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(CZESTOTLIWOSC_MODELI), "-"
+    ]
+    wynik = subprocess.run(polecenie, capture_output=True, check=True).stdout
+    return np.frombuffer(wynik, np.int16).astype(np.float32) / 32768.0
+
+def wykryj_mowe(sciezka_pliku_audio, okno_s=0.03, prog_db=12.0, min_mowa_s=0.3, min_cisza_s=1.0, margines_s=0.25):
+    """
+    Energy-based VAD over a 16-bit PCM WAV, read through mmap in blocks.
+    A frame is speech when it is louder than the noise floor (10th percentile of frame energy) by prog_db,
+    and never below -50 dBFS. Pauses shorter than min_cisza_s are bridged, regions shorter than min_mowa_s dropped,
+    and the rest padded by margines_s. Returns [[start, end], ...] in seconds.
+    """
+    import numpy as np
+    with open(sciezka_pliku_audio, 'rb') as plik, mmap.mmap(plik.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+        kanaly, czestotliwosc, szerokosc_probki, poczatek_danych, rozmiar_danych = _znajdz_dane_wav(mapa)
+        czas_trwania = rozmiar_danych / (kanaly * szerokosc_probki * czestotliwosc)
+        if kanaly != 1 or szerokosc_probki != 2:
+            return [[0.0, czas_trwania]]
+        probki = np.frombuffer(mapa, dtype='<i2', count=rozmiar_danych // 2, offset=poczatek_danych)
+        dlugosc_okna = int(okno_s * czestotliwosc)
+        liczba_okien = len(probki) // dlugosc_okna
+        energia = np.empty(liczba_okien, dtype=np.float32)
+        # Bloki po ~1 minucie: pamięć tymczasowa nie zależy od długości nagrania
+        okien_w_bloku = max(1, int(60 / okno_s))
+        for od in range(0, liczba_okien, okien_w_bloku):
+            do = min(liczba_okien, od + okien_w_bloku)
+            blok = probki[od * dlugosc_okna:do * dlugosc_okna].astype(np.float32).reshape(-1, dlugosc_okna) / 32768.0
+            energia[od:do] = np.mean(blok * blok, axis=1)
+        del probki
+    if not liczba_okien:
+        return []
+
+    poziom_db = 10 * np.log10(energia + 1e-10)
+    prog = max(np.percentile(poziom_db, 10) + prog_db, -50.0)
+    mowa = np.concatenate(([False], poziom_db > prog, [False]))
+    zmiany = np.flatnonzero(np.diff(mowa.astype(np.int8)))
+    starty, konce = zmiany[0::2] * okno_s, zmiany[1::2] * okno_s
+    if not len(starty):
+        return []
+
+    ciagle = np.concatenate(([True], starty[1:] - konce[:-1] >= min_cisza_s))
+    starty, konce = starty[ciagle], np.append(konce[np.flatnonzero(ciagle)[1:] - 1], konce[-1])
+    dlugie = konce - starty >= min_mowa_s
+    starty = np.maximum(starty[dlugie] - margines_s, 0.0)
+    konce = np.minimum(konce[dlugie] + margines_s, czas_trwania)
+    return [[round(float(s), 3), round(float(k), 3)] for s, k in zip(starty, konce)]
+
+def mapa_mowy(regiony, czestotliwosc=CZESTOTLIWOSC_MODELI):
+    """Returns [(frame in recording, frame in condensed audio, frame count)] for speech regions placed back to back."""
+    mapa = []
+    pozycja = 0
+    for start, koniec in regiony:
+        pierwsza, ostatnia = round(start * czestotliwosc), round(koniec * czestotliwosc)
+        mapa.append((pierwsza, pozycja, ostatnia - pierwsza))
+        pozycja += ostatnia - pierwsza
+    return mapa
+
+def zloz_mowe(sciezka_pliku_audio, regiony, sciezka_wyjsciowa):
+    """Writes a WAV holding only the speech regions, back to back, by copying PCM frames from the memory-mapped source."""
+    with open(sciezka_pliku_audio, 'rb') as plik, mmap.mmap(plik.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+        kanaly, czestotliwosc, szerokosc_probki, poczatek_danych, rozmiar_danych = _znajdz_dane_wav(mapa)
+        rozmiar_ramki = kanaly * szerokosc_probki
+        deskryptor, sciezka_tymczasowa = tempfile.mkstemp(
+            dir=os.path.dirname(sciezka_wyjsciowa) or ".", prefix=f".{os.path.basename(sciezka_wyjsciowa)}.", suffix=".tmp")
+        try:
+            with os.fdopen(deskryptor, 'wb') as plik_wyjsciowy, wave.open(plik_wyjsciowy, 'wb') as wyjscie:
+                wyjscie.setnchannels(kanaly)
+                wyjscie.setsampwidth(szerokosc_probki)
+                wyjscie.setframerate(czestotliwosc)
+                for pierwsza, _, liczba in mapa_mowy(regiony, czestotliwosc):
+                    od = poczatek_danych + pierwsza * rozmiar_ramki
+                    wyjscie.writeframes(mapa[od:min(od + liczba * rozmiar_ramki, poczatek_danych + rozmiar_danych)])
+            os.replace(sciezka_tymczasowa, sciezka_wyjsciowa)
+        except BaseException:
+            if os.path.exists(sciezka_tymczasowa):
+                os.remove(sciezka_tymczasowa)
+            raise
+
+def przelicz_czasy_mowy(wynik, regiony, czestotliwosc=CZESTOTLIWOSC_MODELI):
+    """
+    Maps segment and word times of a result computed on condensed speech audio back to the original timeline.
+    A time at a join counts as the end of the earlier region for 'end' and as the start of the later one for 'start'.
+    """
+    import numpy as np
+    mapa = np.array(mapa_mowy(regiony, czestotliwosc), dtype=np.float64).reshape(-1, 3) / czestotliwosc
+    elementy = [(e, pole) for segment in wynik["segments"] for e in [segment] + segment.get("words", [])
+                for pole in ("start", "end") if e.get(pole) is not None]
+    for pole in ("start", "end"):
+        wybrane = [e for e, p in elementy if p == pole]
+        czasy = np.array([e[pole] for e in wybrane], dtype=np.float64)
+        region = np.searchsorted(mapa[:, 1], czasy, side="right" if pole == "start" else "left") - 1
+        region = np.clip(region, 0, len(mapa) - 1)
+        czasy = mapa[region, 0] + np.minimum(czasy - mapa[region, 1], mapa[region, 2])
+        for e, czas in zip(wybrane, czasy.tolist()):
+            e[pole] = round(czas, 3)
+    return wynik
+
+def okna_fragmentow(czas_trwania, dlugosc_fragmentu, zakladka):
+    """Yields (index, start, end, is_last) for overlapping windows covering the recording."""
+    krok = dlugosc_fragmentu - zakladka
+    if krok <= 0:
+        raise ValueError("długość fragmentu musi być większa niż zakładka")
+    indeks = 0
+    while True:
+        start = indeks * krok
+        koniec = min(start + dlugosc_fragmentu, czas_trwania)
+        ostatni = koniec >= czas_trwania
+        yield indeks, start, koniec, ostatni
+        if ostatni:
+            return
+        indeks += 1
+
+def _dopasuj_mowcow(poprzednia_diaryzacja, diaryzacja, od, do):
+    """Maps local speaker labels of a chunk to global labels by the longest shared speaking time in the overlap."""
+    nakladanie = {}
+    poprzednie = [t for t in poprzednia_diaryzacja if t["end"] > od and t["start"] < do]
+    biezace = [t for t in diaryzacja if t["end"] > od and t["start"] < do]
+    for a in poprzednie:
+        for b in biezace:
+            wspolne = min(a["end"], b["end"], do) - max(a["start"], b["start"], od)
+            if wspolne > 0:
+                para = (a["speaker"], b["speaker"])
+                nakladanie[para] = nakladanie.get(para, 0.0) + wspolne
+
+    mapa = {}
+    for (globalny, lokalny), _ in sorted(nakladanie.items(), key=lambda x: -x[1]):
+        if lokalny not in mapa and globalny not in mapa.values():
+            mapa[lokalny] = globalny
+    return mapa
+
+class LaczenieFragmentow:
+    """
+    Incremental form of polacz_fragmenty: chunks are added one at a time and only the new chunk is processed,
+    so the stitched transcript can be extended as a recording grows. The newest chunk can also be previewed
+    as the last one (owning everything after its start) without adding it.
+    """
+
+    def __init__(self, zakladka):
+        self.zakladka = zakladka
+        self.segmenty = []
+        self.jezyk = None
+        self.mowcy_globalni = set()
+        self.poprzednia_diaryzacja = []
+        self.poprzedni_koniec = None
+        self.liczba_fragmentow = 0
+        # Suma znormalizowanych embeddingów i ich liczba dla każdej globalnej etykiety
+        self.sumy_embeddingow = {}
+
+    def _mapa_mowcow(self, start, wynik):
+        mapa = _dopasuj_mowcow(self.poprzednia_diaryzacja, wynik["diaryzacja"], start, self.poprzedni_koniec) if self.liczba_fragmentow else {}
+        mowcy = set(self.mowcy_globalni)
+        for lokalny in sorted({t["speaker"] for t in wynik["diaryzacja"]}):
+            if lokalny not in mapa:
+                mapa[lokalny] = f"SPEAKER_{len(mowcy):02d}"
+            mowcy.add(mapa[lokalny])
+        return mapa, mowcy
+
+    def _segmenty_fragmentu(self, start, koniec, ostatni, wynik, mapa):
+        # Etykiety mówców są zmieniane w miejscu
+        od = start + self.zakladka / 2 if self.liczba_fragmentow else float("-inf")
+        do = koniec - self.zakladka / 2 if not ostatni else float("inf")
+        segmenty = []
+        for segment in wynik["segments"]:
+            if not od <= (segment["start"] + segment["end"]) / 2 < do:
+                continue
+            if "speaker" in segment:
+                segment["speaker"] = mapa.get(segment["speaker"], segment["speaker"])
+            for slowo in segment.get("words", []):
+                if "speaker" in slowo:
+                    slowo["speaker"] = mapa.get(slowo["speaker"], slowo["speaker"])
+            segmenty.append(segment)
+        return segmenty
+
+    def _sumy_embeddingow(self, wynik, mapa, sumy):
+        import numpy as np
+        for lokalny, wektor in wynik.get("embeddingi", {}).items():
+            wektor = np.asarray(wektor, dtype=np.float64)
+            if np.all(np.isfinite(wektor)) and wektor.any():
+                globalny = mapa.get(lokalny, lokalny)
+                suma, liczba = sumy.get(globalny, (0.0, 0))
+                sumy[globalny] = (suma + wektor / np.linalg.norm(wektor), liczba + 1)
+        return sumy
+
+    def dodaj(self, start, koniec, ostatni, wynik):
+        """Adds a chunk (relabelling its speakers in place) and returns the segments it contributed."""
+        self.jezyk = self.jezyk or wynik.get("language")
+        mapa, self.mowcy_globalni = self._mapa_mowcow(start, wynik)
+        segmenty = self._segmenty_fragmentu(start, koniec, ostatni, wynik, mapa)
+        self.segmenty.extend(segmenty)
+        self._sumy_embeddingow(wynik, mapa, self.sumy_embeddingow)
+        self.poprzednia_diaryzacja = [dict(t, speaker=mapa[t["speaker"]]) for t in wynik["diaryzacja"]]
+        self.poprzedni_koniec = koniec
+        self.liczba_fragmentow += 1
+        return segmenty
+
+    def wynik(self, start=None, koniec=None, ostatni_wynik=None):
+        """
+        Returns the stitched result with averaged speaker embeddings in "embeddingi". With ostatni_wynik the chunk
+        is appended as the last one without being added; the caller passes a copy, since its labels are changed.
+        """
+        segmenty, sumy = self.segmenty, self.sumy_embeddingow
+        jezyk = self.jezyk
+        if ostatni_wynik is not None:
+            jezyk = jezyk or ostatni_wynik.get("language")
+            mapa, _ = self._mapa_mowcow(start, ostatni_wynik)
+            segmenty = segmenty + self._segmenty_fragmentu(start, koniec, True, ostatni_wynik, mapa)
+            sumy = self._sumy_embeddingow(ostatni_wynik, mapa, dict(sumy))
+        embeddingi_mowcow = {mowca: (suma / liczba).tolist() for mowca, (suma, liczba) in sumy.items()}
+        return {"segments": segmenty, "language": jezyk, "embeddingi": embeddingi_mowcow}
+
+
+def polacz_fragmenty(fragmenty, zakladka):
+    """
+    Stitches per-chunk results into one transcript.
+    Each segment is kept by the chunk that owns its midpoint (chunk borders lie in the middle of the overlaps),
+    and speaker labels are carried across chunks by matching diarization turns inside the overlap.
+    The speaker embeddings of the chunks are averaged per global label into "embeddingi".
+    """
+    laczenie = LaczenieFragmentow(zakladka)
+    for _, start, koniec, ostatni, wynik in fragmenty:
+        laczenie.dodaj(start, koniec, ostatni, wynik)
+    return laczenie.wynik()
+
+def embeddingi_jako_listy(embeddingi):
+    """Converts the per-speaker embeddings returned by the diarization pipeline into JSON-serializable lists."""
+    return {mowca: [float(x) for x in wektor] for mowca, wektor in (embeddingi or {}).items()}
+
+def wczytaj_baze_glosow(folder_cache):
+    """Returns the enrolled voices: {name: [embedding, ...]}, one embedding per enrollment sample."""
+    return _wczytaj_json_lub_pusty(os.path.join(folder_cache, PLIK_BAZY_GLOSOW))
+
+def nazwij_mowcow(wynik, embeddingi, baza_glosow, prog=PROG_PODOBIENSTWA_GLOSU):
+    """
+    Renames diarization labels of a result (segments and words, in place) to enrolled names.
+    Each label is compared with every sample of every enrolled voice by cosine similarity; pairs are assigned
+    greedily from the most similar, one name per label, and only above the threshold. Returns {label: name}.
+    The embeddings are cached with the result and names are applied last, so changing enrolled voices
+    never repeats transcription or diarization.
+    """
+    import numpy as np
+    pary = []
+    for etykieta, wektor in embeddingi.items():
+        wektor = np.asarray(wektor, dtype=np.float64)
+        if not np.all(np.isfinite(wektor)) or not wektor.any():
+            continue
+        wektor /= np.linalg.norm(wektor)
+        for nazwa, probki in baza_glosow.items():
+            probki = np.asarray(probki, dtype=np.float64)
+            if probki.ndim != 2 or probki.shape[1] != len(wektor):
+                continue
+            probki = probki / np.linalg.norm(probki, axis=1, keepdims=True)
+            pary.append((float((probki @ wektor).max()), etykieta, nazwa))
+
+    mapa = {}
+    for podobienstwo, etykieta, nazwa in sorted(pary, reverse=True):
+        if podobienstwo < prog:
+            break
+        if etykieta not in mapa and nazwa not in mapa.values():
+            mapa[etykieta] = nazwa
+    for segment in wynik["segments"]:
+        for element in [segment] + segment.get("words", []):
+            if element.get("speaker") in mapa:
+                element["speaker"] = mapa[element["speaker"]]
+    if mapa:
+        print("  - Rozpoznani mówcy: " + ", ".join(f"{etykieta} = {nazwa}" for etykieta, nazwa in sorted(mapa.items())))
+    return mapa
+
+def zapisz_glos(nazwa, sciezka_probki, folder_cache):
+    """
+    Enrolls a voice sample: a recording (audio or video) in which only this person speaks.
+    The embedding comes from the diarization pipeline; further samples of the same person are appended.
+    """
+    import math
+    import torch
+    from whisperx.diarize import DiarizationPipeline
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    sciezka_audio = os.path.join(folder_cache, "glosy", f"{hashlib.sha256(nazwa.encode('utf-8')).hexdigest()[:16]}.wav")
+    os.makedirs(os.path.dirname(sciezka_audio), exist_ok=True)
+    wyodrebnij_audio(sciezka_probki, sciezka_audio)
+    hf_token = wymagany_token_hf()
+    diarize_model = pobierz_model(("diarization", device), lambda: DiarizationPipeline(use_auth_token=hf_token, device=device))
+    _, embeddingi = diarize_model(sciezka_audio, min_speakers=1, max_speakers=1, return_embeddings=True)
+    os.remove(sciezka_audio)
+    wektory = [wektor for wektor in embeddingi_jako_listy(embeddingi).values() if all(map(math.isfinite, wektor))]
+    if not wektory:
+        sys.exit(f"BŁĄD: Nie wykryto mowy w próbce '{sciezka_probki}'.")
+
+    sciezka_bazy = os.path.join(folder_cache, PLIK_BAZY_GLOSOW)
+    baza_glosow = wczytaj_baze_glosow(folder_cache)
+    baza_glosow.setdefault(nazwa, []).append(wektory[0])
+    _zapisz_atomowo(sciezka_bazy, json.dumps(baza_glosow, ensure_ascii=False).encode('utf-8'))
+    print(f"Zapisano głos '{nazwa}' ({len(baza_glosow[nazwa])} próbek) w {sciezka_bazy}.")
+    print("Znane głosy: " + ", ".join(sorted(baza_glosow)))
+
+def przesun_czasy_fragmentu(wynik, przesuniecie):
+    """Shifts segment, word and diarization times of a window result from window time to recording time (in place)."""
+    for segment in wynik["segments"]:
+        segment["start"] += przesuniecie
+        segment["end"] += przesuniecie
+        for slowo in segment.get("words", []):
+            if "start" in slowo:
+                slowo["start"] += przesuniecie
+                slowo["end"] += przesuniecie
+    for tura in wynik["diaryzacja"]:
+        tura["start"] += przesuniecie
+        tura["end"] += przesuniecie
+    return wynik
+
+def przetwarzanie_fragmentu(model_whisper, jezyk, batch_size, compute_type, asr_options, liczba_mowcow, device, watki_asr=None, metryki=None, zglos=None):
+    """
+    Returns przetworz_fragment(audio) for transkrybuj_fragmentami: transcription, word alignment and diarization
+    of one window with models from the process registry, with times relative to the window.
+    """
+    import whisperx
+    from whisperx.diarize import DiarizationPipeline
+    hf_token = wymagany_token_hf()
+    opcje_modelu = {} if watki_asr is None else {"threads": watki_asr}
+
+    def przetworz_fragment(audio):
+        if zglos is not None:
+            zglos(3, "transkrypcja fragmentu")
+        model = pobierz_model(
+            ("whisper", model_whisper, device, compute_type, json.dumps(asr_options, sort_keys=True), watki_asr),
+            lambda: whisperx.load_model(model_whisper, device, compute_type=compute_type, asr_options=asr_options, **opcje_modelu),
+            metryki
+        )
+        with mierz_etap(metryki, "asr"):
+            wynik_transkrypcji = model.transcribe(audio, batch_size=batch_size, language=jezyk)
+        model_a, metadata = pobierz_model(
+            ("align", wynik_transkrypcji["language"], device),
+            lambda: whisperx.load_align_model(language_code=wynik_transkrypcji["language"], device=device),
+            metryki
+        )
+        with mierz_etap(metryki, "wyrownanie"):
+            wynik_aligned = whisperx.align(wynik_transkrypcji["segments"], model_a, metadata, audio, device, return_char_alignments=False)
+        diarize_model = pobierz_model(
+            ("diarization", device),
+            lambda: DiarizationPipeline(use_auth_token=hf_token, device=device),
+            metryki
+        )
+        with mierz_etap(metryki, "diaryzacja"):
+            # Nie każdy fragment zawiera wszystkich mówców, więc liczba mówców jest tylko górnym limitem
+            diarize_segments, embeddingi = diarize_model(audio, max_speakers=liczba_mowcow, return_embeddings=True)
+        wynik = whisperx.assign_word_speakers(diarize_segments, wynik_aligned)
+        return {
+            "segments": wynik["segments"],
+            "diaryzacja": diarize_segments[["start", "end", "speaker"]].to_dict("records") if len(diarize_segments) else [],
+            "embeddingi": embeddingi_jako_listy(embeddingi),
+            "language": wynik_transkrypcji["language"]
+        }
+
+    return przetworz_fragment
+
+def transkrybuj_fragmentami(sciezka_pliku_audio, folder_punktow_kontrolnych, przetworz_fragment, dlugosc_fragmentu, zakladka):
+    """
+    Transcribes a long recording in overlapping windows with memory bounded by the window length.
+    Every finished window is checkpointed, so an interrupted run resumes from the first missing one.
+    przetworz_fragment(audio) must return {"segments", "diaryzacja", "language"} with times relative to the window.
+    """
+    os.makedirs(folder_punktow_kontrolnych, exist_ok=True)
+    czas_trwania = czas_trwania_wav(sciezka_pliku_audio)
+    liczba_fragmentow = len(list(okna_fragmentow(czas_trwania, dlugosc_fragmentu, zakladka)))
+
+    def przetworzone_fragmenty():
+        for indeks, start, koniec, ostatni in okna_fragmentow(czas_trwania, dlugosc_fragmentu, zakladka):
+            sciezka_punktu = os.path.join(folder_punktow_kontrolnych, f"fragment_{indeks:04d}.json")
+            if os.path.exists(sciezka_punktu):
+                with open(sciezka_punktu, 'r', encoding='utf-8') as f:
+                    wynik = json.load(f)
+                print(f"  - Fragment {indeks + 1}/{liczba_fragmentow}: pobrany z punktu kontrolnego.")
+            else:
+                print(f"  - Fragment {indeks + 1}/{liczba_fragmentow}: {format_timestamp(start)}-{format_timestamp(koniec)}...")
+                wynik = przesun_czasy_fragmentu(przetworz_fragment(wczytaj_fragment_audio(sciezka_pliku_audio, start, koniec - start)), start)
+                _zapisz_atomowo(sciezka_punktu, json.dumps(wynik, ensure_ascii=False).encode('utf-8'))
+            yield indeks, start, koniec, ostatni, wynik
+
+    return polacz_fragmenty(przetworzone_fragmenty(), zakladka)
+
+def tabela_wyniku(wynik):
+    """
+    Converts a transcription result into columns: one array per numeric field of segments and words,
+    speakers interned into a table and texts concatenated into UTF-8 blobs addressed by offsets.
+    The dict has the same shape as the one returned by wczytaj_wynik_kolumnowy.
+    """
+    import numpy as np
+    segmenty = wynik.get("segments", [])
+    slowa = [slowo for segment in segmenty for slowo in segment.get("words", [])]
+    mowcy = sorted({e["speaker"] for e in segmenty + slowa if "speaker" in e})
+    indeks_mowcy = {mowca: i for i, mowca in enumerate(mowcy)}
+
+    def liczby(elementy, pole):
+        return np.array([e.get(pole, np.nan) for e in elementy], dtype=np.float64)
+
+    def mowcy_elementow(elementy):
+        return np.array([indeks_mowcy.get(e.get("speaker"), -1) for e in elementy], dtype=np.int32)
+
+    def teksty(elementy, pole):
+        zakodowane = [e.get(pole, "").encode('utf-8') for e in elementy]
+        przesuniecia = np.zeros(len(zakodowane) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in zakodowane], out=przesuniecia[1:])
+        return przesuniecia, b"".join(zakodowane)
+
+    seg_tekst_od, seg_tekst = teksty(segmenty, "text")
+    slowa_tekst_od, slowa_tekst = teksty(slowa, "word")
+    seg_slowa_od = np.zeros(len(segmenty) + 1, dtype=np.int64)
+    np.cumsum([len(segment.get("words", [])) for segment in segmenty], out=seg_slowa_od[1:])
+    return {
+        "wersja": 1, "language": wynik.get("language"), "mowcy": mowcy,
+        "seg_start": liczby(segmenty, "start"), "seg_end": liczby(segmenty, "end"),
+        "seg_mowca": mowcy_elementow(segmenty), "seg_tekst_od": seg_tekst_od, "seg_slowa_od": seg_slowa_od,
+        "slowa_start": liczby(slowa, "start"), "slowa_end": liczby(slowa, "end"), "slowa_score": liczby(slowa, "score"),
+        "slowa_mowca": mowcy_elementow(slowa), "slowa_tekst_od": slowa_tekst_od,
+        "seg_tekst": seg_tekst, "slowa_tekst": slowa_tekst,
+    }
+
+def zapisz_wynik_kolumnowy(wynik, folder_wyniku, tabela=None):
+    """
+    Saves a transcription result as a columnar directory: .npy arrays, .bin text blobs and meta.json.
+    A table already built from the result with tabela_wyniku can be passed instead of building it again.
+    """
+    import numpy as np
+    if tabela is None:
+        tabela = tabela_wyniku(wynik)
+    folder_tymczasowy = tempfile.mkdtemp(
+        dir=os.path.dirname(folder_wyniku) or ".", prefix=f".{os.path.basename(folder_wyniku)}.", suffix=".tmp")
+    try:
+        meta = {}
+        for nazwa, wartosc in tabela.items():
+            if isinstance(wartosc, np.ndarray):
+                np.save(os.path.join(folder_tymczasowy, f"{nazwa}.npy"), wartosc)
+            elif isinstance(wartosc, bytes):
+                with open(os.path.join(folder_tymczasowy, f"{nazwa}.bin"), 'wb') as f:
+                    f.write(wartosc)
+            else:
+                meta[nazwa] = wartosc
+        with open(os.path.join(folder_tymczasowy, "meta.json"), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        if os.path.exists(folder_wyniku):
+            shutil.rmtree(folder_wyniku)
+        os.replace(folder_tymczasowy, folder_wyniku)
+    except BaseException:
+        shutil.rmtree(folder_tymczasowy, ignore_errors=True)
+        raise
+
+def wczytaj_wynik_kolumnowy(folder_wyniku):
+    """Opens a columnar result with every array and text blob memory-mapped; nothing is decoded until it is read."""
+    import numpy as np
+    with open(os.path.join(folder_wyniku, "meta.json"), 'r', encoding='utf-8') as f:
+        tabela = json.load(f)
+    for nazwa in os.listdir(folder_wyniku):
+        sciezka = os.path.join(folder_wyniku, nazwa)
+        if nazwa.endswith(".npy"):
+            tabela[nazwa[:-4]] = np.load(sciezka, mmap_mode='r')
+        elif nazwa.endswith(".bin"):
+            with open(sciezka, 'rb') as f:
+                tabela[nazwa[:-4]] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(sciezka) else b""
+    return tabela
+
+def iteruj_segmenty(tabela, ze_slowami=False):
+    """Yields segments of a columnar result as dicts in the original JSON shape; words are decoded only on request."""
+    import math
+    mowcy = tabela["mowcy"]
+    seg_tekst, seg_tekst_od = tabela["seg_tekst"], tabela["seg_tekst_od"]
+    seg_slowa_od = tabela["seg_slowa_od"]
+
+    def uzupelnij(element, pole, wartosc):
+        if not math.isnan(wartosc):
+            element[pole] = float(wartosc)
+
+    for i in range(len(tabela["seg_start"])):
+        segment = {"start": float(tabela["seg_start"][i]), "end": float(tabela["seg_end"][i])}
+        segment["text"] = bytes(seg_tekst[seg_tekst_od[i]:seg_tekst_od[i + 1]]).decode('utf-8')
+        if ze_slowami:
+            segment["words"] = []
+            for w in range(seg_slowa_od[i], seg_slowa_od[i + 1]):
+                od, do = tabela["slowa_tekst_od"][w], tabela["slowa_tekst_od"][w + 1]
+                slowo = {"word": bytes(tabela["slowa_tekst"][od:do]).decode('utf-8')}
+                uzupelnij(slowo, "start", tabela["slowa_start"][w])
+                uzupelnij(slowo, "end", tabela["slowa_end"][w])
+                uzupelnij(slowo, "score", tabela["slowa_score"][w])
+                if tabela["slowa_mowca"][w] >= 0:
+                    slowo["speaker"] = mowcy[tabela["slowa_mowca"][w]]
+                segment["words"].append(slowo)
+        if tabela["seg_mowca"][i] >= 0:
+            segment["speaker"] = mowcy[tabela["seg_mowca"][i]]
+        yield segment
+
+def wynik_kolumnowy_do_json(tabela):
+    """Rebuilds the full result dict (segments with words) from a columnar result, e.g. for the JSON export."""
+    return {"segments": list(iteruj_segmenty(tabela, ze_slowami=True)), "language": tabela.get("language")}
+
+def _wypelnij_w_przod(wartosci):
+    """Replaces each NaN with the last non-NaN value before it (leading NaNs stay)."""
+    import numpy as np
+    indeksy = np.where(np.isnan(wartosci), -1, np.arange(len(wartosci)))
+    np.maximum.accumulate(indeksy, out=indeksy)
+    return np.where(indeksy >= 0, wartosci[np.maximum(indeksy, 0)], np.nan)
+
+def _teksty_jednostek(blob, przesuniecia, indeksy):
+    """Decodes the UTF-8 blob once and slices out the (stripped) texts of the selected units by character offsets."""
+    import numpy as np
+    bajty = np.frombuffer(blob, dtype=np.uint8) if len(blob) else np.zeros(0, dtype=np.uint8)
+    # Offsety bajtowe na znakowe: liczba bajtów początkowych UTF-8 (nie 10xxxxxx) przed danym offsetem
+    offsety_znakow = np.concatenate(([0], np.cumsum((bajty & 0xC0) != 0x80)))[np.asarray(przesuniecia)]
+    tekst = bytes(blob).decode('utf-8')
+    return [tekst[offsety_znakow[i]:offsety_znakow[i + 1]].strip() for i in indeksy]
+
+def czasy_i_mowcy_slow(tabela):
+    """
+    Returns word start, end and speaker arrays with gaps filled: a missing start becomes the previous word's end
+    (not earlier than its segment start), a missing end the next word's start (not later than its segment end),
+    and a missing speaker the speaker of the word's segment.
+    """
+    import numpy as np
+    segment_slowa = np.repeat(np.arange(len(tabela["seg_start"])), np.diff(tabela["seg_slowa_od"]))
+    start, koniec = np.array(tabela["slowa_start"]), np.array(tabela["slowa_end"])
+    poprzedni_koniec = np.concatenate(([np.nan], _wypelnij_w_przod(koniec)[:-1]))
+    nastepny_start = np.concatenate((_wypelnij_w_przod(start[::-1])[::-1][1:], [np.nan]))
+    start = np.where(np.isnan(start), np.fmax(poprzedni_koniec, tabela["seg_start"][segment_slowa]), start)
+    koniec = np.where(np.isnan(koniec), np.fmin(nastepny_start, tabela["seg_end"][segment_slowa]), koniec)
+    mowca = np.array(tabela["slowa_mowca"])
+    mowca = np.where(mowca < 0, tabela["seg_mowca"][segment_slowa], mowca)
+    return start, koniec, mowca
+
+def agreguj_wypowiedzi(tabela, podzial_na_slowa=False, max_przerwa=None, max_dlugosc=None):
+    """
+    Builds speaker turns from a columnar result with array operations instead of per-segment string appends.
+    Units are segments, or words with podzial_na_slowa (so a turn also ends where the speaker changes inside a segment).
+    A new turn starts at every speaker change, after a pause longer than max_przerwa seconds and every max_dlugosc
+    seconds of a turn; units without a speaker or text are skipped. With words a turn never starts before the previous
+    one ends; segment turns keep the segment times, as the former per-segment loop did.
+    Speaker labels are returned in display form ("Mówca 00"). Runs on the cached result, so changing
+    the turn parameters needs no new transcription.
+    """
+    import numpy as np
+    slowa = podzial_na_slowa and len(tabela["slowa_start"]) > 0
+    if slowa:
+        start, koniec, mowca = czasy_i_mowcy_slow(tabela)
+        blob, przesuniecia = tabela["slowa_tekst"], tabela["slowa_tekst_od"]
+    else:
+        start, koniec, mowca = np.asarray(tabela["seg_start"]), np.asarray(tabela["seg_end"]), np.asarray(tabela["seg_mowca"])
+        blob, przesuniecia = tabela["seg_tekst"], tabela["seg_tekst_od"]
+
+    indeksy = np.flatnonzero((mowca >= 0) & ~np.isnan(start) & ~np.isnan(koniec))
+    teksty = _teksty_jednostek(blob, przesuniecia, indeksy)
+    niepuste = np.fromiter((bool(t) for t in teksty), dtype=bool, count=len(teksty))
+    indeksy = indeksy[niepuste]
+    teksty = [t for t, zachowaj in zip(teksty, niepuste) if zachowaj]
+    if not len(indeksy):
+        return []
+    start, koniec, mowca = start[indeksy], koniec[indeksy], mowca[indeksy]
+
+    nowa = np.ones(len(indeksy), dtype=bool)
+    nowa[1:] = mowca[1:] != mowca[:-1]
+    if max_przerwa is not None:
+        nowa[1:] |= (start[1:] - koniec[:-1]) > max_przerwa
+    if max_dlugosc:
+        grupa = np.cumsum(nowa) - 1
+        czesc = np.floor((start - start[nowa][grupa]) / max_dlugosc)
+        nowa[1:] |= (grupa[1:] == grupa[:-1]) & (czesc[1:] != czesc[:-1])
+
+    poczatki = np.flatnonzero(nowa)
+    konce = np.append(poczatki[1:], len(indeksy))
+    starty_wypowiedzi = start[poczatki]
+    konce_wypowiedzi = koniec[konce - 1]
+    if slowa:
+        # Podział słów na granicy mówców tworzy nakładające się wypowiedzi, więc każda zaczyna się po końcu poprzedniej;
+        # wypowiedzi z segmentów zachowują czasy segmentów
+        starty_wypowiedzi[1:] = np.maximum(starty_wypowiedzi[1:], konce_wypowiedzi[:-1])
+        konce_wypowiedzi = np.maximum(konce_wypowiedzi, starty_wypowiedzi)
+
+    etykiety = [m.replace("SPEAKER_", "Mówca ") for m in tabela["mowcy"]]
+    return [
+        {"speaker": etykiety[m], "text": " ".join(teksty[od:do]), "start": float(s), "end": float(k)}
+        for m, od, do, s, k in zip(mowca[poczatki].tolist(), poczatki.tolist(), konce.tolist(), starty_wypowiedzi, konce_wypowiedzi)
+    ]
+
+def _popraw_paczke(narzedzie, zdania):
+    """
+    Checks a batch of sentences with a single LanguageTool request (sentences joined as paragraphs) and returns
+    them with the first suggestion of every match applied; overlapping matches keep only the later one.
+    """
+    separator = "\n\n"
+    poczatki = []
+    pozycja = 0
+    for zdanie in zdania:
+        poczatki.append(pozycja)
+        pozycja += len(zdanie) + len(separator)
+    poprawki = [[] for _ in zdania]
+    for dopasowanie in narzedzie.check(separator.join(zdania)):
+        if not dopasowanie.replacements:
+            continue
+        i = bisect.bisect_right(poczatki, dopasowanie.offset) - 1
+        offset = dopasowanie.offset - poczatki[i]
+        if offset + dopasowanie.errorLength <= len(zdania[i]):
+            poprawki[i].append((offset, dopasowanie.errorLength, dopasowanie.replacements[0]))
+
+    poprawione = []
+    for zdanie, lista in zip(zdania, poprawki):
+        granica = len(zdanie)
+        for offset, dlugosc, zamiana in sorted(lista, reverse=True):
+            if offset + dlugosc <= granica:
+                zdanie = zdanie[:offset] + zamiana + zdanie[offset + dlugosc:]
+                granica = offset
+        poprawione.append(zdanie)
+    return poprawione
+
+def koryguj_wypowiedzi(segmenty, jezyk, folder_cache, liczba_serwerow=2, metryki=None):
+    """
+    Corrects grammar and spelling of speaker turns in place with local LanguageTool servers.
+    Texts are split into sentences; sentences checked before come from a persistent cache (korekta.sqlite
+    in folder_cache, keyed by a hash of language and sentence), the rest go in batches to a pool of
+    liczba_serwerow servers from the model registry. Changed turns keep their text in 'original_text'.
+    """
+    podzielone = [PODZIAL_ZDAN.split(segment["text"]) for segment in segmenty]
+
+    def skrot(zdanie):
+        return hashlib.sha256(f"{jezyk}\n{zdanie}".encode('utf-8')).hexdigest()
+
+    # Nieparzyste elementy podziału to odstępy między zdaniami
+    zdania = {skrot(zdanie): zdanie for czesci in podzielone for zdanie in czesci[::2] if zdanie.strip()}
+    os.makedirs(folder_cache, exist_ok=True)
+    polaczenie = sqlite3.connect(os.path.join(folder_cache, PLIK_CACHE_KOREKTY), timeout=60)
+    polaczenie.execute("CREATE TABLE IF NOT EXISTS poprawki (skrot TEXT PRIMARY KEY, tekst TEXT)")
+    poprawione = {}
+    klucze = list(zdania)
+    for i in range(0, len(klucze), 500):
+        fragment = klucze[i:i + 500]
+        poprawione.update(polaczenie.execute(
+            f"SELECT skrot, tekst FROM poprawki WHERE skrot IN ({','.join('?' * len(fragment))})", fragment
+        ))
+    brakujace = [(klucz, zdanie) for klucz, zdanie in zdania.items() if klucz not in poprawione]
+    print(f"  - Korekta: {len(zdania)} zdań, {len(zdania) - len(brakujace)} z cache, {len(brakujace)} do sprawdzenia.")
+
+    if brakujace:
+        try:
+            import language_tool_python
+            wolne = queue.Queue()
+            for numer in range(max(1, liczba_serwerow)):
+                wolne.put(pobierz_model(("languagetool", jezyk, numer), lambda: language_tool_python.LanguageTool(jezyk), metryki))
+        except Exception as e:
+            print(f"Ostrzeżenie: Nie udało się uruchomić LanguageTool ({e}), pomijam korektę niesprawdzonych zdań.")
+            wolne = None
+
+        def sprawdz(paczka):
+            # Każda paczka zajmuje jeden serwer z puli na czas jednego żądania
+            narzedzie = wolne.get()
+            try:
+                return paczka, _popraw_paczke(narzedzie, [zdanie for _, zdanie in paczka])
+            except Exception as e:
+                # Korekta jest opcjonalna: awaria lub timeout serwera zostawia zdania paczki bez zmian (i poza cache)
+                print(f"Ostrzeżenie: LanguageTool nie sprawdził paczki {len(paczka)} zdań ({type(e).__name__}: {e}), zostają bez korekty.")
+                return paczka, None
+            finally:
+                wolne.put(narzedzie)
+
+        if wolne is not None:
+            paczki = [brakujace[i:i + ROZMIAR_PACZKI_KOREKTY] for i in range(0, len(brakujace), ROZMIAR_PACZKI_KOREKTY)]
+            with ThreadPoolExecutor(max_workers=wolne.qsize()) as wykonawca:
+                for paczka, wyniki in wykonawca.map(sprawdz, paczki):
+                    if wyniki is None:
+                        continue
+                    nowe = [(klucz, tekst) for (klucz, _), tekst in zip(paczka, wyniki)]
+                    poprawione.update(nowe)
+                    with polaczenie:
+                        polaczenie.executemany("INSERT OR REPLACE INTO poprawki VALUES (?, ?)", nowe)
+    polaczenie.close()
+
+    zmienione = 0
+    for segment, czesci in zip(segmenty, podzielone):
+        czesci[::2] = [poprawione.get(skrot(zdanie), zdanie) if zdanie.strip() else zdanie for zdanie in czesci[::2]]
+        tekst = "".join(czesci)
+        if tekst != segment["text"]:
+            segment["original_text"] = segment["text"]
+            segment["text"] = tekst
+            zmienione += 1
+    print(f"  - Korekta: poprawiono {zmienione} z {len(segmenty)} wypowiedzi.")
+
+def przygotuj_wspolna_sciezke_audio(sciezka_pliku_audio, format_audio):
+    """
+    Returns the single audio track played by the HTML editor.
+    Compressed formats are transcoded from audio.wav once and reused while they are newer than the source.
+    """
+    if format_audio == "wav":
+        return sciezka_pliku_audio
+    sciezka_docelowa = f"{os.path.splitext(sciezka_pliku_audio)[0]}.{format_audio}"
+    if os.path.exists(sciezka_docelowa) and os.path.getmtime(sciezka_docelowa) >= os.path.getmtime(sciezka_pliku_audio):
+        return sciezka_docelowa
+    try:
+        subprocess.run(
+            ["ffmpeg", "-y", "-loglevel", "error", "-i", sciezka_pliku_audio, "-vn"] + KODEKI_AUDIO_HTML[format_audio] + [sciezka_docelowa],
+            check=True
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Ostrzeżenie: Nie udało się skompresować audio do formatu {format_audio} ({e}), używam audio.wav.")
+        return sciezka_pliku_audio
+    return sciezka_docelowa
+
+def zapisz_dane_transkrypcji(transcription_data, audio_clips_relative_paths, output_html_path, format_danych="js"):
+    """
+    Streams the segment records (with their clip paths) to a data file next to the HTML page, one chunk at a time,
+    and returns the source description the page loads them from.
+    'js' writes numbered scripts in <page>_dane/ that work from file://; the first one is small so rendering starts early.
+    'ndjson' / 'ndjson.gz' write one JSON record per line, which the page reads as a stream over HTTP.
+    """
+    folder_html = os.path.dirname(output_html_path)
+    nazwa_bazowa = os.path.splitext(os.path.basename(output_html_path))[0]
+    sciezki_klipow = audio_clips_relative_paths or [None] * len(transcription_data)
+    rekordy = ({**segment, "clip": sciezka_klipu} for segment, sciezka_klipu in zip(transcription_data, sciezki_klipow))
+
+    if format_danych == "js":
+        folder_danych = os.path.join(folder_html, f"{nazwa_bazowa}_dane")
+        shutil.rmtree(folder_danych, ignore_errors=True)
+        os.makedirs(folder_danych)
+        czesci = []
+        rozmiar_czesci = ROZMIAR_PIERWSZEJ_CZESCI_DANYCH
+        while True:
+            czesc = [rekord for _, rekord in zip(range(rozmiar_czesci), rekordy)]
+            if not czesc:
+                break
+            nazwa = f"czesc_{len(czesci):04d}.js"
+            with open(os.path.join(folder_danych, nazwa), 'w', encoding='utf-8') as f:
+                f.write(f"appendSegments({json.dumps(czesc, ensure_ascii=False)});\n")
+            czesci.append(f"{nazwa_bazowa}_dane/{nazwa}")
+            rozmiar_czesci = ROZMIAR_CZESCI_DANYCH
+        return {"format": "js", "parts": czesci}
+
+    import gzip
+    kompresja = format_danych.endswith(".gz")
+    nazwa = f"{nazwa_bazowa}_dane.{format_danych}"
+    with (gzip.open if kompresja else open)(os.path.join(folder_html, nazwa), 'wt', encoding='utf-8') as f:
+        for rekord in rekordy:
+            f.write(json.dumps(rekord, ensure_ascii=False) + "\n")
+    return {"format": "ndjson", "path": nazwa, "gzip": kompresja}
+
+def generate_html_output(transcription_data, audio_clips_relative_paths, original_filename, output_html_path, otworz_w_przegladarce=True, shared_audio_relative_path=None, format_danych="js"):
     """
     Generates an HTML file with an interactive transcription editor using relative paths for audio.
+    With shared_audio_relative_path the player seeks within one track using segment start/end instead of per-segment clips.
+    Segments are not embedded in the page: they are streamed to a separate data file (see zapisz_dane_transkrypcji)
+    that the page loads and renders in portions.
     """
     print("Rozpoczynanie generowania pliku HTML...")
-    
-    # Krok 1: Wstrzyknij dane (w tym ścieżki do audio) do szablonu JavaScript
+
+    # Krok 1: Zapisz dane strumieniowo do osobnego pliku, a do szablonu wstaw tylko opis źródła danych
+    zrodlo_danych = zapisz_dane_transkrypcji(transcription_data, audio_clips_relative_paths, output_html_path, format_danych)
     injected_data_script = f"""
-        const transcriptionData = {json.dumps(transcription_data, ensure_ascii=False)};
-        const audioPaths = {json.dumps(audio_clips_relative_paths)};
+        const transcriptionData = [];
+        const audioPaths = [];
+        const dataSource = {json.dumps(zrodlo_danych, ensure_ascii=False)};
+        const sharedAudioPath = {json.dumps(shared_audio_relative_path)};
         const originalVideoFile = {{ name: {json.dumps(original_filename)} }};
     """
 
@@ -143,6 +1414,7 @@ def generate_html_output(transcription_data, audio_clips_relative_paths, origina
                 </div>
 
                 <div>
+                    <div id="loading-status" class="text-gray-500 p-3">Wczytywanie transkrypcji...</div>
                     <div id="transcription-container" class="bg-white p-6 rounded-lg shadow-md space-y-4"></div>
                 </div>
             </div>
@@ -167,108 +1439,264 @@ def generate_html_output(transcription_data, audio_clips_relative_paths, origina
         let speakerMap = {{}};
         let currentAudio = null;
         let currentlyPlayingSegment = null;
+        let sharedAudio = null;
+        let playingIndex = -1;
+        const HIGHLIGHT_DEBOUNCE_MS = 150;
+
+        // Wirtualizacja: każdy segment ma lekki kontener, a pełny edytor powstaje tylko w pobliżu okna przeglądarki
+        const originalTexts = [];
+        const segmentSlots = [];
+        const segmentHeights = [];
+        const materialized = new Set();
+        const speakerInputs = new Map();
+        const pendingRender = new Set();
+        const pendingRelease = new Set();
+        let frameRequested = false;
+        let segmentObserver = null;
+
+        // Pomiary i zmiany rozmiarów są grupowane: najpierw wszystkie zapisy, potem odczyty, potem zapisy
+        function fitHeights(elements) {{
+            elements.forEach(element => {{ element.style.height = 'auto'; }});
+            const heights = elements.map(element => element.scrollHeight);
+            elements.forEach((element, k) => {{ element.style.height = heights[k] + 'px'; }});
+        }}
+
+        function fitWidths(inputs) {{
+            const minWidth = 80;
+            inputs.forEach(input => {{ input.style.width = 'auto'; }});
+            const widths = inputs.map(input => input.scrollWidth);
+            inputs.forEach((input, k) => {{ input.style.width = `${{Math.max(widths[k], minWidth) + 2}}px`; }});
+        }}
+
+        function estimateHeight(text) {{
+            const charsPerLine = Math.max(20, Math.floor((transcriptionContainer.clientWidth - 120) / 8));
+            return 72 + Math.ceil(Math.max(text.length, 1) / charsPerLine) * 24;
+        }}
 
-        function autoResize(element) {{
-            element.style.height = 'auto';
-            // MODYFIKACJA: Usunięto dodatkowy odstęp, wysokość dopasowuje się do zawartości i paddingu
-            element.style.height = element.scrollHeight + 'px';
+        function createSegmentObserver() {{
+            segmentObserver = new IntersectionObserver(entries => {{
+                entries.forEach(entry => {{
+                    const index = parseInt(entry.target.dataset.index);
+                    if (entry.isIntersecting) {{
+                        pendingRender.add(index);
+                        pendingRelease.delete(index);
+                    }} else {{
+                        pendingRelease.add(index);
+                        pendingRender.delete(index);
+                    }}
+                }});
+                scheduleFrame();
+            }}, {{ rootMargin: '1000px 0px' }});
         }}
 
-        function displayTranscription(segments) {{
-            transcriptionContainer.innerHTML = '';
-            segments.forEach((segment, index) => {{
+        // Dołącza kolejną porcję wczytanych segmentów; pełne edytory powstają dopiero w pobliżu okna przeglądarki
+        function appendSegments(records) {{
+            const first = transcriptionData.length;
+            const fragment = document.createDocumentFragment();
+            records.forEach((record, k) => {{
+                const index = first + k;
+                const segment = {{ speaker: record.speaker, text: record.text, start: record.start, end: record.end }};
+                transcriptionData.push(segment);
+                audioPaths.push(record.clip || null);
+                originalTexts.push(record.original_text ?? segment.text);
+                if (!(segment.speaker in speakerMap)) {{
+                    speakerMap[segment.speaker] = segment.speaker;
+                }}
+
                 const segmentDiv = document.createElement('div');
                 segmentDiv.className = 'segment-wrapper flex items-start space-x-4 p-3 border-b border-gray-200 last:border-b-0 rounded-lg transition-colors duration-300 border-l-4 border-transparent';
                 segmentDiv.id = `segment-${{index}}`;
-                
-                const playButton = document.createElement('button');
-                playButton.className = 'play-pause-btn flex-shrink-0 w-10 h-10 bg-blue-100 text-blue-600 rounded-full flex items-center justify-center hover:bg-blue-200 transition-colors';
-                playButton.innerHTML = playIconSVG;
-                playButton.dataset.index = index;
-
-                if (!audioPaths[index]) {{
-                    playButton.disabled = true;
-                    playButton.classList.add('opacity-50', 'cursor-not-allowed');
+                segmentDiv.dataset.index = index;
+                segmentDiv.style.height = `${{estimateHeight(segment.text)}}px`;
+                segmentSlots[index] = segmentDiv;
+                fragment.appendChild(segmentDiv);
+            }});
+            transcriptionContainer.appendChild(fragment);
+            for (let index = first; index < transcriptionData.length; index++) {{
+                segmentObserver.observe(segmentSlots[index]);
+            }}
+        }}
+
+        function loadScript(path) {{
+            return new Promise((resolve, reject) => {{
+                const script = document.createElement('script');
+                script.src = path;
+                script.onload = () => {{ script.remove(); resolve(); }};
+                script.onerror = () => reject(new Error(`nie można wczytać ${{path}}`));
+                document.body.appendChild(script);
+            }});
+        }}
+
+        // NDJSON jest czytany strumieniowo i każda odebrana porcja linii jest od razu dołączana
+        async function loadNdjson(path, gzip) {{
+            const response = await fetch(path);
+            if (!response.ok) {{
+                throw new Error(`${{path}}: HTTP ${{response.status}}`);
+            }}
+            let stream = response.body;
+            if (gzip) {{
+                stream = stream.pipeThrough(new DecompressionStream('gzip'));
+            }}
+            const reader = stream.pipeThrough(new TextDecoderStream()).getReader();
+            let rest = '';
+            while (true) {{
+                const {{ value, done }} = await reader.read();
+                const lines = (rest + (value || '')).split('\\n');
+                rest = done ? '' : lines.pop();
+                const records = lines.filter(line => line.trim()).map(line => JSON.parse(line));
+                if (records.length) {{
+                    appendSegments(records);
+                }}
+                if (done) {{
+                    break;
                 }}
+            }}
+        }}
 
-                const contentDiv = document.createElement('div');
-                contentDiv.className = 'flex-grow';
-                const headerDiv = document.createElement('div');
-                headerDiv.className = 'flex items-center space-x-3 text-sm mb-1';
-
-                const speakerInput = document.createElement('input');
-                speakerInput.type = 'text';
-                speakerInput.className = 'speaker-input';
-                const originalSpeakerId = segment.speaker;
-                speakerInput.value = speakerMap[originalSpeakerId] || originalSpeakerId;
-                speakerInput.dataset.originalSpeaker = originalSpeakerId;
-
-                const setInputWidth = (input) => {{
-                    const minWidth = 80;
-                    input.style.width = 'auto';
-                    const scrollWidth = input.scrollWidth;
-                    input.style.width = `${{Math.max(scrollWidth, minWidth) + 2}}px`;
-                }};
-                
-                speakerInput.addEventListener('input', (e) => {{
-                    const newName = e.target.value;
-                    speakerMap[originalSpeakerId] = newName;
-                    
-                    document.querySelectorAll(`.speaker-input[data-original-speaker="${{originalSpeakerId}}"]`).forEach(input => {{
-                        if (input !== e.target) {{
-                            input.value = newName;
-                        }}
-                        setInputWidth(input);
-                    }});
-                }});
-                
-                const timeTag = document.createElement('span');
-                timeTag.className = 'text-gray-500';
-                timeTag.textContent = `[${{new Date(segment.start * 1000).toISOString().substr(14, 5)}}]`;
-                
-                // --- MODYFIKACJA: Zamieniono kolejność elementów ---
-                headerDiv.appendChild(timeTag);
-                headerDiv.appendChild(speakerInput);
-                // --- KONIEC MODYFIKACJI ---
+        async function loadTranscription() {{
+            const loadingStatus = document.getElementById('loading-status');
+            try {{
+                if (dataSource.format === 'js') {{
+                    // Skrypty działają także z file://, gdzie fetch jest blokowany
+                    for (const part of dataSource.parts) {{
+                        await loadScript(part);
+                    }}
+                }} else {{
+                    await loadNdjson(dataSource.path, dataSource.gzip);
+                }}
+                loadingStatus.remove();
+            }} catch (err) {{
+                console.error('Błąd wczytywania transkrypcji: ', err);
+                const hint = location.protocol === 'file:' && dataSource.format !== 'js' ? ' Format NDJSON wymaga serwera HTTP.' : '';
+                loadingStatus.textContent = `Błąd wczytywania transkrypcji: ${{err.message}}.${{hint}}`;
+            }}
+        }}
 
-                const textareaWrapper = document.createElement('div');
-                textareaWrapper.className = 'textarea-wrapper';
-                
-                const highlightDiv = document.createElement('div');
-                highlightDiv.className = 'highlight-div';
-                
-                const textInput = document.createElement('textarea');
-                textInput.className = 'w-full mt-1 p-2 border border-gray-300 rounded-md focus:ring-2 focus:ring-blue-500 focus:border-blue-500 transition';
-                textInput.value = segment.text;
-                textInput.rows = 1;
-                textInput.dataset.index = index;
-                textInput.dataset.originalText = segment.text;
-                
-                updateHighlight(textInput, highlightDiv);
+        function scheduleFrame() {{
+            if (!frameRequested) {{
+                frameRequested = true;
+                requestAnimationFrame(flushPending);
+            }}
+        }}
 
-                textInput.addEventListener('input', (e) => {{
-                    transcriptionData[e.target.dataset.index].text = e.target.value;
-                    autoResize(e.target);
-                    autoResize(highlightDiv);
-                    updateHighlight(e.target, highlightDiv);
-                }});
+        function flushPending() {{
+            frameRequested = false;
+            const releases = [...pendingRelease].filter(index => materialized.has(index) && !segmentSlots[index].contains(document.activeElement));
+            const renders = [...pendingRender].filter(index => !materialized.has(index));
+            pendingRelease.clear();
+            pendingRender.clear();
 
-                textareaWrapper.appendChild(highlightDiv);
-                textareaWrapper.appendChild(textInput);
-                contentDiv.appendChild(headerDiv);
-                contentDiv.appendChild(textareaWrapper);
-                segmentDiv.appendChild(playButton);
-                segmentDiv.appendChild(contentDiv);
-                transcriptionContainer.appendChild(segmentDiv);
-                
-                autoResize(textInput);
-                autoResize(highlightDiv);
-                setInputWidth(speakerInput);
+            const heights = releases.map(index => segmentSlots[index].offsetHeight);
+            releases.forEach((index, k) => releaseSegment(index, heights[k]));
+
+            const rendered = renders.map(renderSegment);
+            fitHeights(rendered.flatMap(parts => [parts.textInput, parts.highlightDiv]));
+            fitWidths(rendered.map(parts => parts.speakerInput));
+        }}
+
+        function releaseSegment(index, height) {{
+            const segmentDiv = segmentSlots[index];
+            const speakerInput = segmentDiv.querySelector('.speaker-input');
+            if (speakerInput) {{
+                speakerInputs.get(speakerInput.dataset.originalSpeaker).delete(speakerInput);
+            }}
+            segmentHeights[index] = height;
+            segmentDiv.style.height = `${{height}}px`;
+            segmentDiv.innerHTML = '';
+            materialized.delete(index);
+        }}
+
+        function renderSegment(index) {{
+            const segment = transcriptionData[index];
+            const segmentDiv = segmentSlots[index];
+            segmentDiv.style.height = '';
+            materialized.add(index);
+
+            const playButton = document.createElement('button');
+            playButton.className = 'play-pause-btn flex-shrink-0 w-10 h-10 bg-blue-100 text-blue-600 rounded-full flex items-center justify-center hover:bg-blue-200 transition-colors';
+            playButton.innerHTML = index === playingIndex ? pauseIconSVG : playIconSVG;
+            playButton.dataset.index = index;
+            playButton.addEventListener('click', handlePlayPause);
+
+            if (!sharedAudioPath && !audioPaths[index]) {{
+                playButton.disabled = true;
+                playButton.classList.add('opacity-50', 'cursor-not-allowed');
+            }}
+
+            const contentDiv = document.createElement('div');
+            contentDiv.className = 'flex-grow';
+            const headerDiv = document.createElement('div');
+            headerDiv.className = 'flex items-center space-x-3 text-sm mb-1';
+
+            const speakerInput = document.createElement('input');
+            speakerInput.type = 'text';
+            speakerInput.className = 'speaker-input';
+            const originalSpeakerId = segment.speaker;
+            speakerInput.value = speakerMap[originalSpeakerId] || originalSpeakerId;
+            speakerInput.dataset.originalSpeaker = originalSpeakerId;
+            if (!speakerInputs.has(originalSpeakerId)) {{
+                speakerInputs.set(originalSpeakerId, new Set());
+            }}
+            speakerInputs.get(originalSpeakerId).add(speakerInput);
+
+            speakerInput.addEventListener('input', (e) => {{
+                const newName = e.target.value;
+                speakerMap[originalSpeakerId] = newName;
+
+                // Zmieniane są tylko wyrenderowane pola; pozostałe odczytają speakerMap przy renderowaniu
+                const inputs = [...speakerInputs.get(originalSpeakerId)];
+                inputs.forEach(input => {{
+                    if (input !== e.target) {{
+                        input.value = newName;
+                    }}
+                }});
+                fitWidths(inputs);
             }});
-            
-            document.querySelectorAll('.play-pause-btn').forEach(button => {{
-                button.addEventListener('click', handlePlayPause);
+
+            const timeTag = document.createElement('span');
+            timeTag.className = 'text-gray-500';
+            timeTag.textContent = `[${{new Date(segment.start * 1000).toISOString().substr(14, 5)}}]`;
+
+            // --- MODYFIKACJA: Zamieniono kolejność elementów ---
+            headerDiv.appendChild(timeTag);
+            headerDiv.appendChild(speakerInput);
+            // --- KONIEC MODYFIKACJI ---
+
+            const textareaWrapper = document.createElement('div');
+            textareaWrapper.className = 'textarea-wrapper';
+
+            const highlightDiv = document.createElement('div');
+            highlightDiv.className = 'highlight-div';
+
+            const textInput = document.createElement('textarea');
+            textInput.className = 'w-full mt-1 p-2 border border-gray-300 rounded-md focus:ring-2 focus:ring-blue-500 focus:border-blue-500 transition';
+            textInput.value = segment.text;
+            textInput.rows = 1;
+            textInput.dataset.index = index;
+            textInput.dataset.originalText = originalTexts[index];
+
+            updateHighlight(textInput, highlightDiv);
+
+            // Podświetlanie zmian jest odświeżane dopiero po krótkiej przerwie w pisaniu
+            let highlightTimer = null;
+            textInput.addEventListener('input', (e) => {{
+                transcriptionData[e.target.dataset.index].text = e.target.value;
+                fitHeights([e.target]);
+                clearTimeout(highlightTimer);
+                highlightTimer = setTimeout(() => {{
+                    updateHighlight(textInput, highlightDiv);
+                    fitHeights([highlightDiv]);
+                }}, HIGHLIGHT_DEBOUNCE_MS);
             }});
+
+            textareaWrapper.appendChild(highlightDiv);
+            textareaWrapper.appendChild(textInput);
+            contentDiv.appendChild(headerDiv);
+            contentDiv.appendChild(textareaWrapper);
+            segmentDiv.appendChild(playButton);
+            segmentDiv.appendChild(contentDiv);
+
+            return {{ textInput, highlightDiv, speakerInput }};
         }}
 
         function updateHighlight(textarea, highlightDiv) {{
@@ -283,56 +1711,112 @@ def generate_html_output(transcription_data, audio_clips_relative_paths, origina
             }}
         }}
 
-        function diffWords(original, current) {{
-            const originalWords = original.split(/(\\s+)/);
-            const currentWords = current.split(/(\\s+)/);
-            if (original === current) return current.replace(/</g, "&lt;").replace(/>/g, "&gt;");
+        function escapeHtml(text) {{
+            return text.replace(/</g, "&lt;").replace(/>/g, "&gt;");
+        }}
 
-            const dp = Array(currentWords.length + 1).fill(null).map(() => Array(originalWords.length + 1).fill(0));
-            for (let i = 1; i <= currentWords.length; i++) {{
-                for (let j = 1; j <= originalWords.length; j++) {{
-                    if (currentWords[i - 1] === originalWords[j - 1]) {{
-                        dp[i][j] = 1 + dp[i - 1][j - 1];
-                    }} else {{
-                        dp[i][j] = Math.max(dp[i - 1][j], dp[i][j - 1]);
+        // Myers O(ND): trace[d][k + d] to najdalszy indeks w `current` osiągalny d edycjami na przekątnej k = i - j (-1: nieosiągalny)
+        function editTrace(currentWords, originalWords, n, m) {{
+            const trace = [];
+            let previous = null;
+            for (let d = 0; ; d++) {{
+                const row = new Int32Array(2 * d + 1);
+                for (let k = -d; k <= d; k += 2) {{
+                    let x = d === 0 ? 0 : -1;
+                    if (k > -d) {{
+                        const right = previous[k - 1 + d - 1];
+                        if (right >= 0 && right < n) {{
+                            x = right + 1;
+                        }}
+                    }}
+                    if (k < d) {{
+                        const down = previous[k + 1 + d - 1];
+                        if (down >= 0 && down - k <= m && down > x) {{
+                            x = down;
+                        }}
                     }}
+                    if (x >= 0) {{
+                        let y = x - k;
+                        while (x < n && y < m && currentWords[x] === originalWords[y]) {{
+                            x++; y++;
+                        }}
+                        if (x === n && y === m) {{
+                            row[k + d] = x;
+                            trace.push(row);
+                            return trace;
+                        }}
+                    }}
+                    row[k + d] = x;
                 }}
+                trace.push(row);
+                previous = row;
             }}
+        }}
 
-            let i = currentWords.length;
-            let j = originalWords.length;
+        function diffWords(original, current) {{
+            const originalWords = original.split(/(\\s+)/);
+            const currentWords = current.split(/(\\s+)/);
+            if (original === current) return escapeHtml(current);
+
+            // Wspólny koniec jest dopasowywany zachłannie, dokładnie jak w cofaniu po tablicy LCS
+            let n = currentWords.length;
+            let m = originalWords.length;
             const result = [];
+            while (n > 0 && m > 0 && currentWords[n - 1] === originalWords[m - 1]) {{
+                result.push(escapeHtml(currentWords[n - 1]));
+                n--; m--;
+            }}
+
+            const trace = editTrace(currentWords, originalWords, n, m);
+            const reachable = (d, x, y) => {{
+                const k = x - y;
+                return d >= 0 && Math.abs(k) <= d && (k + d) % 2 === 0 && trace[d][k + d] >= x;
+            }};
+
+            // Te same decyzje co przy cofaniu po pełnej tablicy: wstawienie wygrywa remis z usunięciem
+            let i = n;
+            let j = m;
+            let d = trace.length - 1;
             while (i > 0 || j > 0) {{
                 if (i > 0 && j > 0 && currentWords[i - 1] === originalWords[j - 1]) {{
-                    result.unshift(currentWords[i - 1].replace(/</g, "&lt;").replace(/>/g, "&gt;"));
+                    result.push(escapeHtml(currentWords[i - 1]));
                     i--; j--;
-                }} else if (i > 0 && (j === 0 || dp[i][j - 1] <= dp[i - 1][j])) {{
-                    result.unshift(`<mark class="edited-word">${{currentWords[i - 1].replace(/</g, "&lt;").replace(/>/g, "&gt;")}}</mark>`);
-                    i--;
-                }} else if (j > 0 && (i === 0 || dp[i][j - 1] > dp[i - 1][j])) {{
-                    j--;
+                }} else if (i > 0 && (j === 0 || reachable(d - 1, i - 1, j))) {{
+                    result.push(`<mark class="edited-word">${{escapeHtml(currentWords[i - 1])}}</mark>`);
+                    i--; d--;
                 }} else {{
-                    break;
+                    j--; d--;
                 }}
             }}
-            return result.join('');
+            return result.reverse().join('');
         }}
         
         function updateAllPlayIcons(state, activeIndex = -1) {{
-            const allButtons = document.querySelectorAll('.play-pause-btn');
-            allButtons.forEach((btn, index) => {{
-                if (index === activeIndex && state === 'playing') {{
-                    btn.innerHTML = pauseIconSVG;
-                }} else {{
-                    btn.innerHTML = playIconSVG;
-                }}
+            // W DOM istnieją tylko przyciski wyrenderowanych segmentów, pozostałe dostaną ikonę przy renderowaniu
+            playingIndex = state === 'playing' ? activeIndex : -1;
+            transcriptionContainer.querySelectorAll('.play-pause-btn').forEach(btn => {{
+                btn.innerHTML = parseInt(btn.dataset.index) === playingIndex ? pauseIconSVG : playIconSVG;
             }});
         }}
 
+        function createSegmentAudio(index) {{
+            if (!sharedAudioPath) {{
+                return new Audio(audioPaths[index]);
+            }}
+            if (!sharedAudio) {{
+                sharedAudio = new Audio(sharedAudioPath);
+                sharedAudio.preload = 'auto';
+            }}
+            sharedAudio.currentTime = transcriptionData[index].start;
+            return sharedAudio;
+        }}
+
         function handlePlayPause(event) {{
-            const button = event.currentTarget;
-            const index = parseInt(button.dataset.index);
-            const segmentDiv = document.getElementById(`segment-${{index}}`);
+            playSegment(parseInt(event.currentTarget.dataset.index));
+        }}
+
+        function playSegment(index) {{
+            const segmentDiv = segmentSlots[index];
 
             if (currentlyPlayingSegment === segmentDiv && currentAudio && !currentAudio.paused) {{
                 currentAudio.pause();
@@ -340,11 +1824,13 @@ def generate_html_output(transcription_data, audio_clips_relative_paths, origina
                 if (currentAudio) {{
                     currentAudio.pause();
                 }}
-                currentAudio = new Audio(audioPaths[index]);
+                currentAudio = createSegmentAudio(index);
                 currentAudio.playbackRate = parseFloat(playbackSpeed.value);
                 currentAudio.play();
                 
-                document.querySelectorAll('.segment-wrapper').forEach(el => el.classList.remove('playing'));
+                if (currentlyPlayingSegment) {{
+                    currentlyPlayingSegment.classList.remove('playing');
+                }}
                 segmentDiv.classList.add('playing');
                 currentlyPlayingSegment = segmentDiv;
                 
@@ -357,11 +1843,20 @@ def generate_html_output(transcription_data, audio_clips_relative_paths, origina
                     updateAllPlayIcons('paused');
                 }};
                 
+                // Wspólna ścieżka nie kończy się na końcu segmentu, więc koniec wykrywamy po czasie
+                currentAudio.ontimeupdate = sharedAudioPath ? () => {{
+                    if (currentAudio.currentTime >= transcriptionData[index].end) {{
+                        currentAudio.ontimeupdate = null;
+                        currentAudio.pause();
+                        currentAudio.onended();
+                    }}
+                }} : null;
+
                 currentAudio.onended = () => {{
                      if (autoplayCheckbox.checked) {{
-                        const nextButton = document.querySelector(`.play-pause-btn[data-index="${{index + 1}}"]`);
-                        if (nextButton) {{
-                            nextButton.click();
+                        const nextIndex = index + 1;
+                        if (nextIndex < transcriptionData.length && (sharedAudioPath || audioPaths[nextIndex])) {{
+                            playSegment(nextIndex);
                         }} else {{
                             segmentDiv.classList.remove('playing');
                             currentlyPlayingSegment = null;
@@ -397,13 +1892,8 @@ def generate_html_output(transcription_data, audio_clips_relative_paths, origina
 
         // Inicjalizacja
         document.addEventListener('DOMContentLoaded', () => {{
-            const uniqueSpeakers = [...new Set(transcriptionData.map(s => s.speaker))];
-            uniqueSpeakers.forEach(speaker => {{
-                speakerMap[speaker] = speaker;
-            }});
-
-            displayTranscription(transcriptionData);
-            updateAllPlayIcons('paused');
+            createSegmentObserver();
+            loadTranscription();
 
             playbackSpeed.addEventListener('input', (e) => {{
                 const speed = parseFloat(e.target.value);
@@ -420,13 +1910,14 @@ def generate_html_output(transcription_data, audio_clips_relative_paths, origina
 </html>
     """
 
-    # Krok 4: Zapisz string do pliku .html
+    # Krok 4: Zapisz szablon do pliku .html (bez danych ma stały rozmiar)
     try:
         with open(output_html_path, 'w', encoding='utf-8') as f:
             f.write(html_template)
         print(f"Pomyślnie wygenerowano plik: {output_html_path}")
         # Krok 5: Otwórz plik w przeglądarce
-        webbrowser.open(f"file://{os.path.realpath(output_html_path)}")
+        if otworz_w_przegladarce:
+            webbrowser.open(f"file://{os.path.realpath(output_html_path)}")
     except Exception as e:
         print(f"BŁĄD podczas zapisu lub otwierania pliku HTML: {e}")
 
@@ -438,11 +1929,41 @@ def transkrybuj_i_generuj_html(
     jezyk: str,
     batch_size: int,
     compute_type: str,
-    asr_options: dict
+    asr_options: dict,
+    otworz_w_przegladarce: bool = True,
+    tryb_audio: str = "klipy",
+    format_danych_html: str = "js",
+    folder_cache: str = DOMYSLNY_FOLDER_CACHE,
+    limit_cache_gb: float = 20.0,
+    eksport_json: bool = False,
+    podzial_na_slowa: bool = False,
+    max_przerwa: float = None,
+    max_dlugosc_wypowiedzi: float = None,
+    korekta: bool = False,
+    serwery_korekty: int = 2,
+    vad: bool = True,
+    prog_glosu: float = PROG_PODOBIENSTWA_GLOSU,
+    rownolegla_diaryzacja: bool = False,
+    watki_cpu: int = None,
+    watki_diaryzacji: int = None,
+    dlugosc_fragmentu: float = None,
+    zakladka_fragmentow: float = 30.0,
+    start_s: float = None,
+    koniec_s: float = None,
+    sciezka_prometheus: str = None,
+    postep=None
 ):
     """
     Pełny proces: od wideo do interaktywnego pliku HTML.
     """
+    # postep(krok, opis) jest wywoływany na początku każdego etapu; wyjątek z niego przerywa przetwarzanie
+    def zglos(krok, opis):
+        if postep is not None:
+            postep(krok, opis)
+
+    metryki = {}
+    start_calosci = time.perf_counter()
+    start_calosci_cpu = time.process_time()
     logging.getLogger('pytorch_lightning').setLevel(logging.ERROR)
     logging.getLogger('pyannote').setLevel(logging.ERROR)
     logging.getLogger('torch').setLevel(logging.ERROR)
@@ -451,157 +1972,1268 @@ def transkrybuj_i_generuj_html(
     print(f"--- Rozpoczynanie transkrypcji pliku: {sciezka_pliku_wideo} ---")
 
     nazwa_pliku_bazowa = os.path.splitext(os.path.basename(sciezka_pliku_wideo))[0]
-    folder_roboczy = f"{nazwa_pliku_bazowa}_work"
+    folder_roboczy = folder_roboczy_pliku(sciezka_pliku_wideo)
     os.makedirs(folder_roboczy, exist_ok=True)
     print(f"Używam folderu roboczego: {folder_roboczy}")
 
     folder_klipow_audio = os.path.join(folder_roboczy, "audio_clips")
-    os.makedirs(folder_klipow_audio, exist_ok=True)
 
     sciezka_pliku_audio = os.path.join(folder_roboczy, "audio.wav")
+    folder_wyniku = os.path.join(folder_roboczy, "wynik_kolumnowy")
     sciezka_wyniku_finalnego = os.path.join(folder_roboczy, "wynik_finalny.json")
     
     # ZMIANA: Definicja ścieżki wyjściowej HTML wewnątrz folderu roboczego
     output_html_path = os.path.join(folder_roboczy, f"{nazwa_pliku_bazowa}_transkrypcja.html")
 
-    if not os.path.exists(sciezka_pliku_audio):
-        print("Krok 1/5: Wyodrębnianie ścieżki audio...")
-        try:
-            wideo = mp.VideoFileClip(sciezka_pliku_wideo)
-            if wideo.audio is None:
-                sys.exit(f"BŁĄD: Plik wideo '{sciezka_pliku_wideo}' nie zawiera ścieżki audio.")
-            wideo.audio.write_audiofile(sciezka_pliku_audio, codec='pcm_s16le', logger=None)
-        except Exception as e:
-            sys.exit(f"BŁĄD podczas przetwarzania wideo: {e}")
+    sciezka_kluczy_roboczych = os.path.join(folder_roboczy, PLIK_KLUCZY_ROBOCZYCH)
+    klucze_robocze = _wczytaj_json_lub_pusty(sciezka_kluczy_roboczych)
+
+    klucz_wejscia = skrot_pliku(sciezka_pliku_wideo, folder_cache)
+    klucz_ekstrakcji = klucz_etapu("ekstrakcja", klucz_wejscia, WERSJA_EKSTRAKCJI, start_s, koniec_s)
+    # Modele widzą audio po VAD, więc ich wyniki zależą od ustawień VAD
+    klucz_audio_modeli = klucz_etapu("vad", klucz_ekstrakcji, PARAMETRY_VAD) if vad else klucz_ekstrakcji
+    klucz_asr = klucz_etapu("asr", klucz_audio_modeli, model_whisper, jezyk, compute_type, batch_size, asr_options)
+    klucz_wyrownania = klucz_etapu("wyrownanie", klucz_asr)
+    klucz_diaryzacji = klucz_etapu("diaryzacja", klucz_audio_modeli, liczba_mowcow)
+    if dlugosc_fragmentu:
+        klucz_wyniku = klucz_etapu("wynik_fragmentami", klucz_asr, liczba_mowcow, dlugosc_fragmentu, zakladka_fragmentow)
+    else:
+        klucz_wyniku = klucz_etapu("wynik", klucz_wyrownania, klucz_diaryzacji)
+    # Nazwy mówców są nadawane na końcu, na wyniku z cache, więc zmiana bazy głosów
+    # nie przelicza transkrypcji ani punktów kontrolnych, tylko wynik kolumnowy w folderze roboczym
+    baza_glosow = wczytaj_baze_glosow(folder_cache)
+    if baza_glosow:
+        klucz_wyniku_kolumnowego = klucz_etapu("glosy", klucz_wyniku, baza_glosow, prog_glosu)
     else:
+        klucz_wyniku_kolumnowego = klucz_wyniku
+
+    zglos(1, "ekstrakcja audio")
+    if klucze_robocze.get("audio.wav") == klucz_ekstrakcji and os.path.exists(sciezka_pliku_audio):
         print("Krok 1/5: Pomijanie ekstrakcji audio.")
+    else:
+        sciezka_audio_w_cache = sciezka_wpisu_cache(folder_cache, "ekstrakcja", klucz_ekstrakcji, "wav")
+        if os.path.exists(sciezka_audio_w_cache):
+            print("Krok 1/5: Ścieżka audio pobrana z cache.")
+            os.utime(sciezka_audio_w_cache)
+        else:
+            print("Krok 1/5: Wyodrębnianie ścieżki audio...")
+            os.makedirs(os.path.dirname(sciezka_audio_w_cache), exist_ok=True)
+            sciezka_tymczasowa = f"{os.path.splitext(sciezka_audio_w_cache)[0]}.{os.getpid()}.{threading.get_ident()}.part.wav"
+            try:
+                with mierz_etap(metryki, "ekstrakcja"):
+                    wyodrebnij_audio(sciezka_pliku_wideo, sciezka_tymczasowa, start_s, koniec_s)
+                os.replace(sciezka_tymczasowa, sciezka_audio_w_cache)
+            except Exception as e:
+                sys.exit(f"BŁĄD podczas przetwarzania wideo: {e}")
+        udostepnij_plik(sciezka_audio_w_cache, sciezka_pliku_audio)
+        klucze_robocze["audio.wav"] = klucz_ekstrakcji
+        _zapisz_atomowo(sciezka_kluczy_roboczych, json.dumps(klucze_robocze).encode('utf-8'))
+    audio_s = czas_trwania_wav(sciezka_pliku_audio)
 
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f"Krok 2/5: Używane urządzenie: {device}")
+    sciezka_audio_mowy = os.path.join(folder_roboczy, "audio_mowa.wav")
 
-    if not os.path.exists(sciezka_wyniku_finalnego):
-        print(f"Krok 3/5: Transkrypcja i diarization...")
-        model = whisperx.load_model(model_whisper, device, compute_type=compute_type, asr_options=asr_options)
-        audio = whisperx.load_audio(sciezka_pliku_audio)
-        wynik_transkrypcji = model.transcribe(audio, batch_size=batch_size, language=jezyk, print_progress=True)
-        
-        model_a, metadata = whisperx.load_align_model(language_code=wynik_transkrypcji["language"], device=device)
-        wynik_aligned = whisperx.align(wynik_transkrypcji["segments"], model_a, metadata, audio, device, return_char_alignments=False)
-        
-        hf_token = os.environ.get("HUGGING_FACE_TOKEN")
-        if not hf_token:
-            sys.exit("BŁĄD KRYTYCZNY: Brak tokena HUGGING_FACE_TOKEN w zmiennych środowiskowych.")
-        diarize_model = DiarizationPipeline(use_auth_token=hf_token, device=device)
-        diarize_segments = diarize_model(sciezka_pliku_audio, min_speakers=liczba_mowcow, max_speakers=liczba_mowcow)
-        
-        wynik_finalny = whisperx.assign_word_speakers(diarize_segments, wynik_aligned)
+    def przygotuj_audio_modeli():
+        # Zwraca audio dla modeli i regiony mowy (None, gdy modele dostają całe nagranie)
+        if not vad:
+            return sciezka_pliku_audio, None
+        regiony = cache_odczytaj(folder_cache, "vad", klucz_audio_modeli)
+        if regiony is None:
+            with mierz_etap(metryki, "vad"):
+                regiony = wykryj_mowe(sciezka_pliku_audio, **PARAMETRY_VAD)
+            cache_zapisz(folder_cache, "vad", klucz_audio_modeli, regiony)
+        if not regiony:
+            print("  - VAD: nie wykryto mowy, modele dostają całe nagranie.")
+            return sciezka_pliku_audio, None
+        if klucze_robocze.get("audio_mowa.wav") != klucz_audio_modeli or not os.path.exists(sciezka_audio_mowy):
+            zloz_mowe(sciezka_pliku_audio, regiony, sciezka_audio_mowy)
+            klucze_robocze["audio_mowa.wav"] = klucz_audio_modeli
+            _zapisz_atomowo(sciezka_kluczy_roboczych, json.dumps(klucze_robocze).encode('utf-8'))
+        mowa_s = sum(koniec - start for start, koniec in regiony)
+        print(f"  - VAD: {len(regiony)} fragmentów mowy, {mowa_s:.0f} s z {audio_s:.0f} s (pominięto {100 * (1 - mowa_s / audio_s):.0f}%).")
+        return sciezka_audio_mowy, regiony
+
+    zglos(3, "transkrypcja i diarization")
+    if klucze_robocze.get("wynik_kolumnowy") == klucz_wyniku_kolumnowego and os.path.exists(folder_wyniku):
+        print("Krok 2/5: Pomijanie wyboru urządzenia.")
+        print("Krok 3/5: Pomijanie transkrypcji (wynik aktualny dla tych parametrów).")
+    else:
+        wynik_finalny = cache_odczytaj(folder_cache, "wynik", klucz_wyniku)
+        embeddingi_mowcow = cache_odczytaj(folder_cache, "embeddingi", klucz_wyniku)
+        if wynik_finalny is not None and baza_glosow and embeddingi_mowcow is None:
+            # Wynik z cache sprzed zapisywania embeddingów: bez nich nie da się rozpoznać mówców
+            wynik_finalny = None
+        # Modele z rejestru i liczba wątków torch są wspólne dla procesu, więc równoległe zadania demona
+        # wykonują ten krok po kolei; pozostałe etapy (ekstrakcja, klipy, korekta, HTML) mogą się nakładać
+        with _BLOKADA_ETAPOW_ML if wynik_finalny is None else nullcontext():
+            if wynik_finalny is not None:
+                print("Krok 2/5: Pomijanie wyboru urządzenia.")
+                print("Krok 3/5: Wynik transkrypcji pobrany z cache.")
+            elif dlugosc_fragmentu:
+                device, compute_type = przygotuj_urzadzenie(compute_type, watki_cpu)
+                print(f"Krok 3/5: Transkrypcja i diarization fragmentami po {dlugosc_fragmentu:.0f} s...")
+                start_kroku = time.perf_counter()
+                start_kroku_cpu = time.process_time()
+                sciezka_audio_modeli, regiony_mowy = przygotuj_audio_modeli()
+                przetworz_fragment = przetwarzanie_fragmentu(
+                    model_whisper, jezyk, batch_size, compute_type, asr_options, liczba_mowcow,
+                    device, watki_cpu if device == "cpu" else None, metryki, zglos
+                )
+
+                folder_punktow_kontrolnych = os.path.join(folder_roboczy, "fragmenty", klucz_wyniku[:16])
+                wynik_finalny = transkrybuj_fragmentami(
+                    sciezka_audio_modeli, folder_punktow_kontrolnych, przetworz_fragment, dlugosc_fragmentu, zakladka_fragmentow
+                )
+                embeddingi_mowcow = wynik_finalny.pop("embeddingi", {})
+                if regiony_mowy:
+                    przelicz_czasy_mowy(wynik_finalny, regiony_mowy)
+                cache_zapisz(folder_cache, "wynik", klucz_wyniku, wynik_finalny)
+                cache_zapisz(folder_cache, "embeddingi", klucz_wyniku, embeddingi_mowcow)
+                dodaj_pomiar(metryki, "krok_3", time.perf_counter() - start_kroku, time.process_time() - start_kroku_cpu)
+            else:
+                import torch
+                import whisperx
+                from whisperx.diarize import DiarizationPipeline
+                device, compute_type = przygotuj_urzadzenie(compute_type, watki_cpu)
+                print(f"Krok 3/5: Transkrypcja i diarization...")
+                start_kroku = time.perf_counter()
+                start_kroku_cpu = time.process_time()
+                sciezka_audio_modeli, regiony_mowy = przygotuj_audio_modeli()
+                wynik_aligned = cache_odczytaj(folder_cache, "wyrownanie", klucz_wyrownania)
+                diarize_segments = cache_odczytaj(folder_cache, "diaryzacja", klucz_diaryzacji, "pickle")
+                embeddingi_mowcow = cache_odczytaj(folder_cache, "embeddingi", klucz_diaryzacji)
+                if diarize_segments is not None and embeddingi_mowcow is None and baza_glosow:
+                    # Diarization z cache sprzed zapisywania embeddingów: liczona ponownie, żeby rozpoznać mówców
+                    print("  - Brak embeddingów mówców dla diarization z cache, diarization zostanie powtórzona.")
+                    diarize_segments = None
+                # CTranslate2 nie korzysta z torch.set_num_threads, więc liczba wątków ASR trafia do modelu
+                watki_asr = watki_cpu if device == "cpu" else None
+
+                if diarize_segments is None:
+                    hf_token = wymagany_token_hf()
+
+                def diaryzuj():
+                    diarize_model = pobierz_model(
+                        ("diarization", device),
+                        lambda: DiarizationPipeline(use_auth_token=hf_token, device=device),
+                        metryki
+                    )
+                    with mierz_etap(metryki, "diaryzacja"):
+                        wynik, embeddingi = diarize_model(sciezka_audio_modeli, min_speakers=liczba_mowcow, max_speakers=liczba_mowcow, return_embeddings=True)
+                    embeddingi = embeddingi_jako_listy(embeddingi)
+                    cache_zapisz(folder_cache, "diaryzacja", klucz_diaryzacji, wynik, "pickle")
+                    cache_zapisz(folder_cache, "embeddingi", klucz_diaryzacji, embeddingi)
+                    return wynik, embeddingi
+
+                wykonawca = None
+                diaryzacja_w_tle = None
+                if rownolegla_diaryzacja and diarize_segments is None and wynik_aligned is None:
+                    if device == "cpu":
+                        # Wątki CPU dzielone są między CTranslate2 (ASR) i torch (wyrównanie, diarization)
+                        wszystkie_watki = watki_cpu or os.cpu_count()
+                        watki_torch = min(watki_diaryzacji or max(1, wszystkie_watki // 2), wszystkie_watki - 1) or 1
+                        watki_asr = max(1, wszystkie_watki - watki_torch)
+                        torch.set_num_threads(watki_torch)
+                        print(f"  - Diarization równolegle: {watki_asr} wątków dla ASR, {watki_torch} dla torch.")
+                    else:
+                        print("  - Diarization równolegle z transkrypcją i wyrównaniem.")
+                    wykonawca = ThreadPoolExecutor(max_workers=1)
+                    diaryzacja_w_tle = wykonawca.submit(diaryzuj)
+
+                try:
+                    if wynik_aligned is None:
+                        audio = whisperx.load_audio(sciezka_audio_modeli)
+                        wynik_transkrypcji = cache_odczytaj(folder_cache, "asr", klucz_asr)
+                        if wynik_transkrypcji is None:
+                            opcje_modelu = {} if watki_asr is None else {"threads": watki_asr}
+                            model = pobierz_model(
+                                ("whisper", model_whisper, device, compute_type, json.dumps(asr_options, sort_keys=True), watki_asr),
+                                lambda: whisperx.load_model(model_whisper, device, compute_type=compute_type, asr_options=asr_options, **opcje_modelu),
+                                metryki
+                            )
+                            with mierz_etap(metryki, "asr"):
+                                wynik_transkrypcji = model.transcribe(audio, batch_size=batch_size, language=jezyk, print_progress=True)
+                            cache_zapisz(folder_cache, "asr", klucz_asr, wynik_transkrypcji)
+                        else:
+                            print("  - Surowa transkrypcja pobrana z cache.")
+
+                        zglos(3, "wyrównanie słów")
+                        model_a, metadata = pobierz_model(
+                            ("align", wynik_transkrypcji["language"], device),
+                            lambda: whisperx.load_align_model(language_code=wynik_transkrypcji["language"], device=device),
+                            metryki
+                        )
+                        with mierz_etap(metryki, "wyrownanie"):
+                            wynik_aligned = whisperx.align(wynik_transkrypcji["segments"], model_a, metadata, audio, device, return_char_alignments=False)
+                        cache_zapisz(folder_cache, "wyrownanie", klucz_wyrownania, wynik_aligned)
+                        del audio
+                    else:
+                        print("  - Wyrównanie słów pobrane z cache.")
+
+                    zglos(3, "diarization")
+                    if diaryzacja_w_tle is not None:
+                        diarize_segments, embeddingi_mowcow = diaryzacja_w_tle.result()
+                    elif diarize_segments is None:
+                        diarize_segments, embeddingi_mowcow = diaryzuj()
+                    else:
+                        print("  - Diarization pobrana z cache.")
+                finally:
+                    if wykonawca is not None:
+                        wykonawca.shutdown()
+                        if device == "cpu":
+                            torch.set_num_threads(watki_cpu or os.cpu_count())
+
+                wynik_finalny = whisperx.assign_word_speakers(diarize_segments, wynik_aligned)
+                if regiony_mowy:
+                    przelicz_czasy_mowy(wynik_finalny, regiony_mowy)
+                embeddingi_mowcow = embeddingi_mowcow or {}
+                cache_zapisz(folder_cache, "wynik", klucz_wyniku, wynik_finalny)
+                cache_zapisz(folder_cache, "embeddingi", klucz_wyniku, embeddingi_mowcow)
+                dodaj_pomiar(metryki, "krok_3", time.perf_counter() - start_kroku, time.process_time() - start_kroku_cpu)
+
+        if baza_glosow:
+            nazwij_mowcow(wynik_finalny, embeddingi_mowcow, baza_glosow, prog_glosu)
+        zapisz_wynik_kolumnowy(wynik_finalny, folder_wyniku)
+        klucze_robocze["wynik_kolumnowy"] = klucz_wyniku_kolumnowego
+        _zapisz_atomowo(sciezka_kluczy_roboczych, json.dumps(klucze_robocze).encode('utf-8'))
+
+    # Kolumny są mapowane z dysku; agregacja czyta tylko te, których potrzebuje
+    tabela_wyniku_kolumnowego = wczytaj_wynik_kolumnowy(folder_wyniku)
+    if eksport_json:
         with open(sciezka_wyniku_finalnego, 'w', encoding='utf-8') as f:
-            json.dump(wynik_finalny, f, ensure_ascii=False, indent=4)
-        del model, model_a, diarize_model
+            json.dump(wynik_kolumnowy_do_json(tabela_wyniku_kolumnowego), f, ensure_ascii=False, indent=4)
+
+    cache_przytnij(folder_cache, limit_cache_gb * 1024 ** 3)
+
+    with mierz_etap(metryki, "agregacja"):
+        aggregated_segments = agreguj_wypowiedzi(tabela_wyniku_kolumnowego, podzial_na_slowa, max_przerwa, max_dlugosc_wypowiedzi)
+
+    if korekta:
+        zglos(4, "korekta tekstu")
+        print("Krok 4/5: Korekta tekstu (LanguageTool)...")
+        with mierz_etap(metryki, "korekta"):
+            koryguj_wypowiedzi(aggregated_segments, tabela_wyniku_kolumnowego.get("language") or jezyk, folder_cache, serwery_korekty, metryki)
+
+    zglos(4, "audio do odtwarzania")
+    if tryb_audio == "klipy":
+        print("Krok 4/5: Cięcie audio na klipy...")
+        os.makedirs(folder_klipow_audio, exist_ok=True)
+        # Cięcie tylko nowych lub zmienionych klipów (jeden odczyt pliku audio, bez ffmpeg dla każdego klipu)
+        with mierz_etap(metryki, "klipy"):
+            audio_clips_paths_abs = aktualizuj_klipy_audio(sciezka_pliku_audio, aggregated_segments, folder_klipow_audio, klucz_ekstrakcji)
+
+        # ZMIANA: Tworzenie ścieżek względnych dla pliku HTML
+        audio_clips_relative_paths = [os.path.join("audio_clips", os.path.basename(p)) if p else None for p in audio_clips_paths_abs]
+        shared_audio_relative_path = None
     else:
-        print("Krok 3/5: Pomijanie transkrypcji (plik już istnieje).")
-    
-    with open(sciezka_wyniku_finalnego, 'r', encoding='utf-8') as f:
-        wynik_finalny = json.load(f)
+        print(f"Krok 4/5: Pomijanie cięcia klipów, odtwarzanie ze wspólnej ścieżki audio ({tryb_audio})...")
+        audio_clips_relative_paths = None
+        with mierz_etap(metryki, "wspolna_sciezka"):
+            shared_audio_relative_path = os.path.basename(przygotuj_wspolna_sciezke_audio(sciezka_pliku_audio, tryb_audio))
 
-    print("Krok 4/5: Cięcie audio na klipy...")
-    glowny_klip_audio = mp.AudioFileClip(sciezka_pliku_audio)
-    audio_clips_paths_abs = []
-    clip_counter = 0
-    
-    # Agregacja segmentów per mówca
-    aggregated_segments = []
-    current_segment = None
+    zglos(5, "generowanie HTML")
+    print("Krok 5/5: Generowanie finalnego pliku HTML...")
+    # ZMIANA: Użycie ścieżek względnych i nowej ścieżki wyjściowej HTML
+    with mierz_etap(metryki, "html"):
+        generate_html_output(aggregated_segments, audio_clips_relative_paths, os.path.basename(sciezka_pliku_wideo), output_html_path, otworz_w_przegladarce, shared_audio_relative_path, format_danych_html)
 
-    for segment in wynik_finalny.get("segments", []):
-        if "speaker" not in segment or not segment.get("text", "").strip():
-            continue
-        
-        speaker = segment["speaker"]
-        text = segment["text"].strip()
-        start = segment["start"]
-        end = segment["end"]
-
-        if current_segment and current_segment["speaker"] == speaker:
-            current_segment["text"] += " " + text
-            current_segment["end"] = end
+    dodaj_pomiar(metryki, "calosc", time.perf_counter() - start_calosci, time.process_time() - start_calosci_cpu)
+    raport = raport_metryk(metryki, sciezka_pliku_wideo, audio_s, {
+        "model": model_whisper, "compute_type": compute_type, "batch_size": batch_size, "watki_cpu": watki_cpu,
+        "asr_options": asr_options, "rownolegla_diaryzacja": rownolegla_diaryzacja, "dlugosc_fragmentu": dlugosc_fragmentu
+    })
+    _zapisz_atomowo(os.path.join(folder_roboczy, PLIK_METRYK), json.dumps(raport, ensure_ascii=False, indent=4).encode('utf-8'))
+    if sciezka_prometheus:
+        zapisz_metryki_prometheus([raport], sciezka_prometheus)
+    print("Czasy etapów: " + ", ".join(f"{etap} {wpis['czas_s']:.1f} s" for etap, wpis in raport["etapy"].items()))
+    print(f"Metryki zapisane w: {os.path.join(folder_roboczy, PLIK_METRYK)}")
+    print("\n--- Zakończono pomyślnie! ---")
+    return {
+        "html": output_html_path,
+        "segmenty": len(aggregated_segments),
+        "czasy_s": {etap: round(wpis["czas_s"], 2) for etap, wpis in raport["etapy"].items()},
+        "metryki": raport
+    }
+
+
+def sledz_nagranie(
+    sciezka_pliku_wideo: str,
+    liczba_mowcow: int,
+    model_whisper: str,
+    jezyk: str,
+    batch_size: int,
+    compute_type: str,
+    asr_options: dict,
+    otworz_w_przegladarce: bool = True,
+    tryb_audio: str = "klipy",
+    format_danych_html: str = "js",
+    podzial_na_slowa: bool = False,
+    max_przerwa: float = None,
+    max_dlugosc_wypowiedzi: float = None,
+    watki_cpu: int = None,
+    zakladka_fragmentow: float = 30.0,
+    folder_cache: str = DOMYSLNY_FOLDER_CACHE,
+    prog_glosu: float = PROG_PODOBIENSTWA_GLOSU,
+    krok_s: float = 30.0,
+    interwal_s: float = 5.0,
+    koniec_po_s: float = 60.0,
+    **pozostale_parametry
+):
+    """
+    Tryb śledzenia nagrania, które wciąż rośnie (np. zapisywanego przez rejestrator podczas sesji).
+    Co interwal_s dopisuje do audio.wav tylko nowo nagrane audio; gdy przybędzie krok_s sekund, transkrybuje okno
+    od ostatniego punktu kontrolnego (z zakładką zakladka_fragmentow, jak w trybie fragmentów), zapisuje punkt
+    kontrolny i odświeża wynik kolumnowy, klipy oraz stronę HTML. Zaległe audio jest dzielone na kolejne okna po krok_s sekund.
+    Ostatnie okno jest wstępne: jego koniec zostaje poprawiony przez następne, a do sklejonego wyniku
+    (LaczenieFragmentow) dołącza dopiero wtedy. Wynik kolumnowy jest zapisywany po każdym oknie. Kończy pracę, gdy plik nie rośnie przez koniec_po_s sekund; przerwane
+    śledzenie wznawia się od ostatniego punktu kontrolnego.
+    Mówcy są nazywani według bazy głosów jak w pełnym procesie.
+    Parametry pełnego procesu, które tu nie mają zastosowania (cache etapów, VAD, fragmenty), są pomijane;
+    o włączonych opcjach, których śledzenie nie obsługuje (np. korekta), informuje ostrzeżenie.
+    """
+    import copy
+    # Granica między oknami leży w połowie zakładki, więc zakładka nie może być dłuższa niż krok
+    zakladka = min(zakladka_fragmentow, krok_s)
+    for nazwa in ("korekta", "eksport_json", "sciezka_prometheus", "start_s", "koniec_s", "dlugosc_fragmentu", "rownolegla_diaryzacja"):
+        if pozostale_parametry.get(nazwa) not in (None, False):
+            print(f"Ostrzeżenie: Tryb śledzenia nie obsługuje parametru '{nazwa}'; zostanie pominięty.")
+    print(f"--- Śledzenie nagrania: {sciezka_pliku_wideo} (okno co {krok_s:.0f} s) ---")
+    nazwa_pliku_bazowa = os.path.splitext(os.path.basename(sciezka_pliku_wideo))[0]
+    folder_roboczy = folder_roboczy_pliku(sciezka_pliku_wideo)
+    folder_sledzenia = os.path.join(folder_roboczy, "sledzenie")
+    folder_klipow_audio = os.path.join(folder_roboczy, "audio_clips")
+    folder_wyniku = os.path.join(folder_roboczy, "wynik_kolumnowy")
+    sciezka_pliku_audio = os.path.join(folder_roboczy, "audio.wav")
+    sciezka_nowego_audio = os.path.join(folder_sledzenia, "nowe_audio.wav")
+    output_html_path = os.path.join(folder_roboczy, f"{nazwa_pliku_bazowa}_transkrypcja.html")
+    os.makedirs(folder_sledzenia, exist_ok=True)
+
+    sciezka_kluczy_roboczych = os.path.join(folder_roboczy, PLIK_KLUCZY_ROBOCZYCH)
+    punkty_kontrolne = sorted(nazwa for nazwa in os.listdir(folder_sledzenia) if nazwa.startswith("fragment_") and nazwa.endswith(".json"))
+    # Wznawiać można tylko audio.wav zapisane przez śledzenie: po zwykłym uruchomieniu audio.wav jest dowiązaniem
+    # do wpisu cache ekstrakcji, do którego nie wolno dopisywać
+    if punkty_kontrolne and not (
+        _wczytaj_json_lub_pusty(sciezka_kluczy_roboczych).get("audio.wav") == "sledzenie"
+        and os.path.exists(sciezka_pliku_audio) and os.stat(sciezka_pliku_audio).st_nlink == 1
+    ):
+        print("Ostrzeżenie: audio.wav nie pochodzi ze śledzenia, więc punkty kontrolne są pomijane i śledzenie zaczyna się od początku.")
+        for nazwa in punkty_kontrolne:
+            os.remove(os.path.join(folder_sledzenia, nazwa))
+        punkty_kontrolne = []
+
+    # Wynik jest sklejany przyrostowo: najnowsze okno jest wstępne i dołącza do sklejonego wyniku dopiero,
+    # gdy pojawi się następne, więc każde odświeżenie przetwarza tylko nowe okno
+    laczenie = LaczenieFragmentow(zakladka)
+    ostatni_fragment = None
+    liczba_punktow = 0
+    for nazwa in punkty_kontrolne:
+        if ostatni_fragment is not None:
+            laczenie.dodaj(ostatni_fragment["start"], ostatni_fragment["koniec"], False, ostatni_fragment)
+        with open(os.path.join(folder_sledzenia, nazwa), 'r', encoding='utf-8') as f:
+            ostatni_fragment = json.load(f)
+        liczba_punktow += 1
+    if ostatni_fragment is not None:
+        print(f"Wznawianie od {format_timestamp(ostatni_fragment['koniec'])} ({liczba_punktow} punktów kontrolnych).")
+    else:
+        # audio.wav z wcześniejszego uruchomienia może być dowiązaniem do cache, więc nie wolno do niego dopisywać
+        for sciezka in (sciezka_pliku_audio, sciezka_nowego_audio):
+            if os.path.exists(sciezka):
+                os.remove(sciezka)
+        shutil.rmtree(folder_klipow_audio, ignore_errors=True)
+    # Zwykłe uruchomienie po śledzeniu nie może uznać tych plików za aktualne
+    _zapisz_atomowo(sciezka_kluczy_roboczych, json.dumps({"audio.wav": "sledzenie", "wynik_kolumnowy": "sledzenie"}).encode('utf-8'))
+
+    device, compute_type = przygotuj_urzadzenie(compute_type, watki_cpu)
+    przetworz_fragment = przetwarzanie_fragmentu(
+        model_whisper, jezyk, batch_size, compute_type, asr_options, liczba_mowcow, device, watki_cpu if device == "cpu" else None
+    )
+
+    baza_glosow = wczytaj_baze_glosow(folder_cache)
+
+    def odswiez_wynik():
+        # Sklejanie zmienia etykiety mówców w miejscu, więc wstępne okno jest dołączane jako kopia
+        wynik = laczenie.wynik(ostatni_fragment["start"], ostatni_fragment["koniec"], copy.deepcopy(ostatni_fragment))
+        embeddingi_mowcow = wynik.pop("embeddingi")
+        tabela = tabela_wyniku(wynik)
+        if baza_glosow:
+            # Nazwy trafiają tylko do tabeli mówców: sklejone segmenty zachowują etykiety potrzebne kolejnym oknom
+            mapa = nazwij_mowcow({"segments": []}, embeddingi_mowcow, baza_glosow, prog_glosu)
+            tabela["mowcy"] = [mapa.get(mowca, mowca) for mowca in tabela["mowcy"]]
+        # Wynik kolumnowy jest aktualny po każdym oknie, więc przerwane śledzenie zostawia wynik
+        zapisz_wynik_kolumnowy(wynik, folder_wyniku, tabela)
+        segmenty = agreguj_wypowiedzi(tabela, podzial_na_slowa, max_przerwa, max_dlugosc_wypowiedzi)
+        sciezki_klipow, sciezka_wspolna = None, None
+        if tryb_audio == "klipy":
+            os.makedirs(folder_klipow_audio, exist_ok=True)
+            sciezki_klipow = [
+                os.path.join("audio_clips", os.path.basename(p)) if p else None
+                for p in aktualizuj_klipy_audio(sciezka_pliku_audio, segmenty, folder_klipow_audio, "sledzenie")
+            ]
         else:
-            if current_segment:
-                aggregated_segments.append(current_segment)
-            current_segment = {
-                "speaker": speaker,
-                "text": text,
-                "start": start,
-                "end": end
+            sciezka_wspolna = os.path.basename(przygotuj_wspolna_sciezke_audio(sciezka_pliku_audio, tryb_audio))
+        generate_html_output(segmenty, sciezki_klipow, os.path.basename(sciezka_pliku_wideo), output_html_path,
+                             otworz_w_przegladarce and liczba_punktow == 1, sciezka_wspolna, format_danych_html)
+        return len(segmenty)
+
+    ostatni_przyrost = time.monotonic()
+    try:
+        while True:
+            audio_s = czas_trwania_wav(sciezka_pliku_audio) if os.path.exists(sciezka_pliku_audio) else 0.0
+            try:
+                wyodrebnij_audio(sciezka_pliku_wideo, sciezka_nowego_audio, start=audio_s)
+                przyrost = czas_trwania_wav(sciezka_nowego_audio)
+            except (RuntimeError, ValueError) as e:
+                # Końcówka pliku może być w trakcie zapisu; spróbujemy przy następnym odczycie
+                print(f"Ostrzeżenie: Nie udało się odczytać nowego audio: {e}")
+                przyrost = 0.0
+            if przyrost > 0:
+                dopisz_wav(sciezka_pliku_audio, sciezka_nowego_audio)
+                audio_s += przyrost
+                ostatni_przyrost = time.monotonic()
+            koniec_nagrania = time.monotonic() - ostatni_przyrost >= koniec_po_s
+
+            przetworzone_s = ostatni_fragment["koniec"] if ostatni_fragment else 0.0
+            if audio_s - przetworzone_s >= krok_s or (koniec_nagrania and audio_s - przetworzone_s > 0.5):
+                start_okna = max(0.0, przetworzone_s - zakladka) if ostatni_fragment else 0.0
+                # Zaległe audio (np. po wznowieniu) jest przetwarzane w oknach po krok_s, żeby okno nie rosło
+                koniec_okna = min(audio_s, przetworzone_s + krok_s)
+                start_pracy = time.perf_counter()
+                wynik = przesun_czasy_fragmentu(
+                    przetworz_fragment(wczytaj_fragment_audio(sciezka_pliku_audio, start_okna, koniec_okna - start_okna)), start_okna
+                )
+                fragment = {"start": start_okna, "koniec": koniec_okna, **wynik}
+                _zapisz_atomowo(os.path.join(folder_sledzenia, f"fragment_{liczba_punktow:04d}.json"),
+                                json.dumps(fragment, ensure_ascii=False).encode('utf-8'))
+                if ostatni_fragment is not None:
+                    laczenie.dodaj(ostatni_fragment["start"], ostatni_fragment["koniec"], False, ostatni_fragment)
+                ostatni_fragment = fragment
+                liczba_punktow += 1
+                liczba_wypowiedzi = odswiez_wynik()
+                print(f"Transkrypcja do {format_timestamp(koniec_okna)}: {liczba_wypowiedzi} wypowiedzi, "
+                      f"okno przetworzone w {time.perf_counter() - start_pracy:.1f} s.")
+            elif koniec_nagrania:
+                break
+            else:
+                time.sleep(interwal_s)
+    except KeyboardInterrupt:
+        print("\nPrzerwano śledzenie; ponowne uruchomienie wznowi pracę od ostatniego punktu kontrolnego.")
+        return output_html_path
+    finally:
+        if os.path.exists(sciezka_nowego_audio):
+            os.remove(sciezka_nowego_audio)
+    print(f"Plik nie rośnie od {koniec_po_s:.0f} s, kończę śledzenie. Wynik: {output_html_path}")
+    return output_html_path
+
+def czas_trwania_pliku(sciezka):
+    """Returns a media file's duration in seconds from ffprobe (container header only), or None when unknown."""
+    try:
+        wynik = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", sciezka],
+            capture_output=True, text=True, check=True
+        )
+        return float(wynik.stdout.strip())
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+def klucz_profilu_sprzetu(model_whisper):
+    return f"{platform.node()}|{model_whisper}"
+
+def wczytaj_profil_sprzetu(folder_cache, model_whisper):
+    """Returns the tuned ASR settings saved by --autotune for this host and model, or None."""
+    profile = _wczytaj_json_lub_pusty(os.path.join(folder_cache, PLIK_PROFILU_SPRZETU))
+    return profile.get(klucz_profilu_sprzetu(model_whisper))
+
+def przygotuj_probke_kalibracji(sciezka_wideo, folder_cache, dlugosc_s):
+    """
+    Returns a WAV sample for calibration: dlugosc_s seconds from the middle of the given input,
+    or the synthetic multi-speaker recording of benchmark.py when there is no input.
+    """
+    if sciezka_wideo is None:
+        import benchmark
+        return benchmark.syntetyczne_audio(dlugosc_s, 2)
+    czas_trwania = czas_trwania_pliku(sciezka_wideo)
+    start = max(0.0, (czas_trwania - dlugosc_s) / 2) if czas_trwania else 0.0
+    sciezka_probki = os.path.join(folder_cache, "autotune", "probka.wav")
+    os.makedirs(os.path.dirname(sciezka_probki), exist_ok=True)
+    wyodrebnij_audio(sciezka_wideo, sciezka_probki, start, start + dlugosc_s)
+    return sciezka_probki
+
+def siatka_autotune(device, watki_max, beam_size):
+    """
+    Candidate ASR settings, reference first: the most exact compute type, all threads, the requested beam.
+    Settings sharing a model (compute type, threads, beam) are adjacent, so each model is loaded once.
+    """
+    typy = ("float16", "int8_float16") if device == "cuda" else ("float32", "int8")
+    watki = [None] if device == "cuda" else sorted({max(1, watki_max // dzielnik) for dzielnik in (1, 2, 4)}, reverse=True)
+    rozmiary = (32, 16, 8) if device == "cuda" else (16, 4)
+    return [
+        {"compute_type": typ, "cpu_threads": liczba_watkow, "beam_size": beam, "batch_size": rozmiar}
+        for typ in typy for liczba_watkow in watki for beam in sorted({beam_size, 1}, reverse=True) for rozmiar in rozmiary
+    ]
+
+def kalibruj_sprzet(sciezka_probki, model_whisper, jezyk, folder_cache, beam_size=5, watki_max=None):
+    """
+    Calibrates transcription settings (--autotune): measures the RTF of transcribing a sample for a grid of
+    compute_type, CPU threads, beam_size and batch_size, and saves the fastest in the host's profile for the model.
+    The first setting of the grid is the reference; settings whose text agrees with it on fewer than
+    MIN_ZGODNOSC_AUTOTUNE of the words are rejected, so speed is not bought with accuracy.
+    """
+    import difflib
+    import torch
+    import whisperx
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    watki_max = watki_max or os.cpu_count()
+    audio = whisperx.load_audio(sciezka_probki)
+    dlugosc_s = len(audio) / CZESTOTLIWOSC_MODELI
+    siatka = siatka_autotune(device, watki_max, beam_size)
+    print(f"Kalibracja: model {model_whisper} na {device}, próbka {dlugosc_s:.0f} s, {len(siatka)} ustawień...")
+
+    wyniki = []
+    slowa_referencyjne = None
+    model, klucz_modelu = None, None
+    for ustawienia in siatka:
+        klucz = (ustawienia["compute_type"], ustawienia["cpu_threads"], ustawienia["beam_size"])
+        if klucz != klucz_modelu:
+            model = None
+            opcje_modelu = {}
+            if ustawienia["cpu_threads"]:
+                torch.set_num_threads(ustawienia["cpu_threads"])
+                opcje_modelu["threads"] = ustawienia["cpu_threads"]
+            try:
+                model = whisperx.load_model(model_whisper, device, compute_type=ustawienia["compute_type"],
+                                            asr_options={"beam_size": ustawienia["beam_size"]}, **opcje_modelu)
+            except ValueError as e:
+                # Nie każde urządzenie obsługuje każdy typ obliczeń
+                print(f"  {ustawienia['compute_type']}: pominięto ({e})")
+                klucz_modelu = klucz
+                continue
+            klucz_modelu = klucz
+            # Rozgrzewka: pierwsze wywołanie po załadowaniu zawiera jednorazową inicjalizację
+            model.transcribe(audio[:10 * CZESTOTLIWOSC_MODELI], batch_size=ustawienia["batch_size"], language=jezyk)
+        if model is None:
+            continue
+
+        start = time.perf_counter()
+        wynik = model.transcribe(audio, batch_size=ustawienia["batch_size"], language=jezyk)
+        rtf = (time.perf_counter() - start) / dlugosc_s
+        slowa = " ".join(segment["text"] for segment in wynik["segments"]).split()
+        if slowa_referencyjne is None:
+            slowa_referencyjne = slowa
+        zgodnosc = difflib.SequenceMatcher(None, slowa_referencyjne, slowa).ratio() if slowa_referencyjne or slowa else 1.0
+        wyniki.append(dict(ustawienia, rtf=round(rtf, 4), zgodnosc=round(zgodnosc, 4)))
+        print(f"  {ustawienia['compute_type']:<13} wątki {ustawienia['cpu_threads'] or '-':>3}  beam {ustawienia['beam_size']}  "
+              f"batch {ustawienia['batch_size']:>2}:  RTF {rtf:.3f}  zgodność {zgodnosc:.1%}")
+    model = None
+    torch.set_num_threads(watki_max)
+
+    zgodne = [wynik for wynik in wyniki if wynik["zgodnosc"] >= MIN_ZGODNOSC_AUTOTUNE]
+    if not zgodne:
+        sys.exit("BŁĄD: Kalibracja nie dała żadnego wyniku.")
+    najlepsze = min(zgodne, key=lambda wynik: wynik["rtf"])
+    profil = {nazwa: najlepsze[nazwa] for nazwa in DOMYSLNE_USTAWIENIA_ASR}
+    profil.update({
+        "rtf": najlepsze["rtf"], "urzadzenie": device, "probka_s": round(dlugosc_s, 1),
+        "znacznik_czasu": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "wyniki": wyniki,
+    })
+    sciezka_profili = os.path.join(folder_cache, PLIK_PROFILU_SPRZETU)
+    profile = _wczytaj_json_lub_pusty(sciezka_profili)
+    profile[klucz_profilu_sprzetu(model_whisper)] = profil
+    _zapisz_atomowo(sciezka_profili, json.dumps(profile, ensure_ascii=False, indent=4).encode('utf-8'))
+    print(f"Najlepsze ustawienia: compute_type {profil['compute_type']}, wątki {profil['cpu_threads'] or '-'}, "
+          f"beam {profil['beam_size']}, batch {profil['batch_size']} (RTF {profil['rtf']:.3f}; referencyjne {wyniki[0]['rtf']:.3f}).")
+    print(f"Profil zapisany w: {sciezka_profili}")
+    return profil
+
+def _przetworz_plik(sciezka, parametry):
+    """Runs the pipeline for one batch file and returns its report entry; errors are recorded, not raised."""
+    wpis = {"plik": sciezka, "status": "ok", "html": None, "segmenty": None, "czas_s": None, "blad": None}
+    start = time.perf_counter()
+    try:
+        wynik = transkrybuj_i_generuj_html(sciezka, otworz_w_przegladarce=False, **parametry)
+        wpis.update(wynik)
+    except SystemExit as e:
+        wpis["status"] = "blad"
+        wpis["blad"] = str(e.code)
+    except Exception as e:
+        wpis["status"] = "blad"
+        wpis["blad"] = f"{type(e).__name__}: {e}"
+    wpis["czas_s"] = round(time.perf_counter() - start, 2)
+    if wpis["status"] != "ok":
+        print(f"BŁĄD podczas przetwarzania pliku '{sciezka}': {wpis['blad']}")
+    return wpis
+
+def _inicjalizuj_proces_roboczy(watki):
+    """Caps the thread pools of a batch worker process before torch or CTranslate2 are imported in it."""
+    for zmienna in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[zmienna] = str(watki)
+
+def przetworz_wsadowo(pliki_wideo, sciezka_raportu, sciezka_prometheus=None, procesy=1, **parametry):
+    """
+    Przetwarza wiele plików wideo, współdzieląc załadowane modele w obrębie procesu.
+    Przy procesy > 1 pliki trafiają do puli procesów, a wątki CPU (--cpu_threads) są dzielone po równo
+    między procesy; najdłuższe nagrania są przetwarzane najpierw, żeby nie kończyć pracy na jednym długim pliku.
+    Po każdym pliku zapisuje raport JSON z wynikiem, czasem i ewentualnym błędem,
+    a plik Prometheusa (jeśli podany) z metrykami wszystkich dotąd przetworzonych plików.
+    """
+    print(f"=== Tryb wsadowy: {len(pliki_wideo)} plików ===")
+    start_calosci = time.perf_counter()
+    raport = []
+
+    def zapisz_raport(wpis):
+        raport.append(wpis)
+        with open(sciezka_raportu, 'w', encoding='utf-8') as f:
+            json.dump(raport, f, ensure_ascii=False, indent=4)
+        if sciezka_prometheus:
+            zapisz_metryki_prometheus([wpis["metryki"] for wpis in raport if wpis.get("metryki")], sciezka_prometheus)
+
+    if procesy <= 1:
+        for numer, sciezka in enumerate(pliki_wideo, start=1):
+            print(f"\n=== Plik {numer}/{len(pliki_wideo)}: {sciezka} ===")
+            zapisz_raport(_przetworz_plik(sciezka, parametry))
+    else:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        czasy_trwania = {sciezka: czas_trwania_pliku(sciezka) for sciezka in pliki_wideo}
+        kolejnosc = sorted(pliki_wideo, key=lambda sciezka: (czasy_trwania[sciezka] or 0, os.path.getsize(sciezka)), reverse=True)
+        procesy = min(procesy, len(pliki_wideo))
+        watki = max(1, (parametry.get("watki_cpu") or os.cpu_count()) // procesy)
+        parametry = {**parametry, "watki_cpu": watki}
+        print(f"=== {procesy} procesów po {watki} wątków CPU, najdłuższe pliki najpierw ===")
+        # spawn: procesy robocze nie dziedziczą stanu CUDA ani wątków procesu głównego
+        with ProcessPoolExecutor(max_workers=procesy, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_inicjalizuj_proces_roboczy, initargs=(watki,)) as wykonawca:
+            przyszle = {wykonawca.submit(_przetworz_plik, sciezka, parametry): sciezka for sciezka in kolejnosc}
+            for numer, przyszly in enumerate(as_completed(przyszle), start=1):
+                wpis = przyszly.result()
+                print(f"\n=== Ukończono {numer}/{len(pliki_wideo)}: {przyszle[przyszly]} ({wpis['status']}) ===")
+                zapisz_raport(wpis)
+
+    udane = sum(1 for wpis in raport if wpis["status"] == "ok")
+    print(f"\n=== Zakończono tryb wsadowy: {udane}/{len(raport)} plików poprawnie. Raport: {sciezka_raportu} ===")
+    godziny_audio = sum((wpis.get("metryki") or {}).get("audio_s") or 0 for wpis in raport) / 3600
+    godziny_pracy = (time.perf_counter() - start_calosci) / 3600
+    if godziny_audio:
+        print(f"Przepustowość: {godziny_audio:.2f} h audio w {godziny_pracy * 60:.1f} min, "
+              f"{godziny_audio / godziny_pracy:.1f} h audio na godzinę.")
+    return raport
+
+class AnulowanieZadania(Exception):
+    """Raised from the progress callback to stop a running job that was cancelled."""
+
+
+STATUSY_KONCOWE = ("zakonczone", "blad", "anulowane")
+
+class KolejkaZadan:
+    """
+    Runs transkrybuj_i_generuj_html jobs on a thread pool that shares the process model registry,
+    tracks the status and progress of every job and supports cancellation (queued jobs immediately,
+    running ones at the next stage boundary). Jobs whose files share a work folder run one after another.
+    """
+
+    def __init__(self, parametry, max_zadan=1, folder_statusow=None):
+        import inspect
+        self.parametry = dict(parametry)
+        self.sciezka_prometheus = self.parametry.pop("sciezka_prometheus", None)
+        self.dozwolone = set(inspect.signature(transkrybuj_i_generuj_html).parameters) - {"sciezka_pliku_wideo", "otworz_w_przegladarce", "postep"}
+        self.folder_statusow = folder_statusow
+        self.wykonawca = ThreadPoolExecutor(max_workers=max_zadan)
+        self.blokada = threading.Lock()
+        # Zadanie czeka, dopóki inne zadanie używa jego folderu roboczego (ten sam plik albo ta sama nazwa)
+        self.zwolnienie_folderu = threading.Condition(self.blokada)
+        self.zajete_foldery = set()
+        self.zadania = {}
+        self.przyszle = {}
+        self.anulowane = set()
+
+    def dodaj(self, zlecenie, id_zadania=None):
+        """Queues a job: 'sciezka_wideo' plus optional overrides of the daemon's default pipeline parameters."""
+        import uuid
+        if not isinstance(zlecenie, dict) or not zlecenie.get("sciezka_wideo"):
+            raise ValueError("zlecenie musi być obiektem JSON z polem 'sciezka_wideo'")
+        nieznane = set(zlecenie) - self.dozwolone - {"sciezka_wideo"}
+        if nieznane:
+            raise ValueError(f"nieznane parametry: {', '.join(sorted(nieznane))}")
+        parametry = {**self.parametry, **{k: v for k, v in zlecenie.items() if k != "sciezka_wideo"}}
+
+        id_zadania = id_zadania or uuid.uuid4().hex[:12]
+        with self.blokada:
+            if id_zadania in self.zadania:
+                raise ValueError(f"zadanie '{id_zadania}' już istnieje")
+            self.zadania[id_zadania] = {
+                "id": id_zadania, "sciezka_wideo": zlecenie["sciezka_wideo"], "status": "w_kolejce",
+                "krok": 0, "opis": None, "postep": 0.0, "wynik": None, "blad": None,
+                "utworzono": time.time(), "rozpoczeto": None, "zakonczono": None
             }
-    if current_segment:
-        aggregated_segments.append(current_segment)
+            self.przyszle[id_zadania] = self.wykonawca.submit(self._wykonaj, id_zadania, zlecenie["sciezka_wideo"], parametry)
+        self._zapisz_status(id_zadania)
+        print(f"Demon: przyjęto zadanie {id_zadania}: {zlecenie['sciezka_wideo']}")
+        return self.status(id_zadania)
 
-    # Cięcie i zapisywanie klipów
-    for segment in aggregated_segments:
-        clip_filename = f"clip_{clip_counter:04d}.wav"
-        clip_path_abs = os.path.join(folder_klipow_audio, clip_filename)
-        
+    def odrzuc(self, id_zadania, blad):
+        """
+        Records a job that could not be accepted, so its submitter can see why. A rejected duplicate
+        of an existing job leaves that job's record alone and is reported in <id>.odrzucone.json.
+        """
+        odrzucenie = {"id": id_zadania, "status": "blad", "blad": blad, "zakonczono": time.time()}
+        with self.blokada:
+            istnieje = id_zadania in self.zadania
+            if not istnieje:
+                self.zadania[id_zadania] = odrzucenie
+        if not istnieje:
+            self._zapisz_status(id_zadania)
+        elif self.folder_statusow:
+            _zapisz_atomowo(
+                os.path.join(self.folder_statusow, f"{id_zadania}.odrzucone.json"),
+                json.dumps(odrzucenie, ensure_ascii=False, indent=4).encode('utf-8')
+            )
+        print(f"BŁĄD: Demon odrzucił zadanie {id_zadania}: {blad}")
+
+    def anuluj(self, id_zadania):
+        """Cancels a job; returns False when it does not exist or has already finished."""
+        with self.blokada:
+            zadanie = self.zadania.get(id_zadania)
+            if zadanie is None or zadanie["status"] in STATUSY_KONCOWE:
+                return False
+            if self.przyszle[id_zadania].cancel():
+                zadanie.update(status="anulowane", zakonczono=time.time())
+            else:
+                self.anulowane.add(id_zadania)
+                zadanie["status"] = "anulowanie"
+        self._zapisz_status(id_zadania)
+        return True
+
+    def status(self, id_zadania):
+        """Returns a copy of the job's status, or None for an unknown job."""
+        with self.blokada:
+            zadanie = self.zadania.get(id_zadania)
+            return dict(zadanie) if zadanie is not None else None
+
+    def lista(self):
+        """Returns copies of the statuses of all jobs, in submission order."""
+        with self.blokada:
+            return [dict(zadanie) for zadanie in self.zadania.values()]
+
+    def zamknij(self):
+        """Cancels queued jobs, asks running ones to stop and waits for them."""
+        for id_zadania in list(self.zadania):
+            self.anuluj(id_zadania)
+        self.wykonawca.shutdown(wait=True)
+
+    def _aktualizuj(self, id_zadania, **zmiany):
+        with self.blokada:
+            self.zadania[id_zadania].update(zmiany)
+        self._zapisz_status(id_zadania)
+
+    def _zapisz_status(self, id_zadania):
+        if self.folder_statusow:
+            _zapisz_atomowo(
+                os.path.join(self.folder_statusow, f"{id_zadania}.json"),
+                json.dumps(self.status(id_zadania), ensure_ascii=False, indent=4).encode('utf-8')
+            )
+
+    def _wykonaj(self, id_zadania, sciezka_wideo, parametry):
+        def postep(krok, opis):
+            if id_zadania in self.anulowane:
+                raise AnulowanieZadania()
+            self._aktualizuj(id_zadania, krok=krok, opis=opis, postep=round((krok - 1) / 5, 2))
+
+        folder_roboczy = os.path.abspath(folder_roboczy_pliku(sciezka_wideo))
+        with self.blokada:
+            while folder_roboczy in self.zajete_foldery and id_zadania not in self.anulowane:
+                if self.zadania[id_zadania]["opis"] is None:
+                    self.zadania[id_zadania]["opis"] = f"oczekiwanie na folder roboczy {folder_roboczy}"
+                    print(f"Demon: zadanie {id_zadania} czeka, aż inne zadanie zwolni {folder_roboczy}.")
+                self.zwolnienie_folderu.wait(timeout=1.0)
+            zajmuje_folder = id_zadania not in self.anulowane
+            if zajmuje_folder:
+                self.zajete_foldery.add(folder_roboczy)
+        self._aktualizuj(id_zadania, status="w_toku", rozpoczeto=time.time(), opis=None)
         try:
-            subclip = glowny_klip_audio.subclip(segment["start"], segment["end"])
-            subclip.write_audiofile(clip_path_abs, codec='pcm_s16le', logger=None)
-            audio_clips_paths_abs.append(clip_path_abs)
-            clip_counter += 1
+            if not zajmuje_folder:
+                raise AnulowanieZadania()
+            wynik = transkrybuj_i_generuj_html(sciezka_wideo, otworz_w_przegladarce=False, postep=postep, **parametry)
+            self._aktualizuj(id_zadania, status="zakonczone", postep=1.0, opis=None, wynik=wynik)
+        except AnulowanieZadania:
+            self._aktualizuj(id_zadania, status="anulowane")
+        except SystemExit as e:
+            self._aktualizuj(id_zadania, status="blad", blad=str(e.code))
         except Exception as e:
-            print(f"Ostrzeżenie: Nie udało się wyciąć klipu dla segmentu {segment['start']}-{segment['end']}: {e}")
-            audio_clips_paths_abs.append(None)
-    
-    # ZMIANA: Tworzenie ścieżek względnych dla pliku HTML
-    audio_clips_relative_paths = [os.path.join("audio_clips", os.path.basename(p)) if p else None for p in audio_clips_paths_abs]
+            self._aktualizuj(id_zadania, status="blad", blad=f"{type(e).__name__}: {e}")
+        finally:
+            with self.blokada:
+                if zajmuje_folder:
+                    self.zajete_foldery.discard(folder_roboczy)
+                    self.zwolnienie_folderu.notify_all()
+            self.anulowane.discard(id_zadania)
+            self._aktualizuj(id_zadania, zakonczono=time.time())
+        zadanie = self.status(id_zadania)
+        print(f"Demon: zadanie {id_zadania} -> {zadanie['status']}" + (f" ({zadanie['blad']})" if zadanie["blad"] else ""))
+        if self.sciezka_prometheus:
+            raporty = [z["wynik"]["metryki"] for z in self.lista() if z.get("wynik")]
+            zapisz_metryki_prometheus(raporty, self.sciezka_prometheus)
 
-    # Przypisanie ścieżek do zagregowanych segmentów (opcjonalne, bo nieużywane dalej)
-    for i, segment in enumerate(aggregated_segments):
-        segment["speaker"] = segment["speaker"].replace("SPEAKER_", "Mówca ")
+def obserwuj_folder_kolejki(kolejka, folder_kolejki, zatrzymaj, interwal=1.0):
+    """
+    Polls the spool directory: every <id>.json is claimed by renaming it into przyjete/ and queued,
+    every <id>.anuluj cancels that job. Status files are kept in status/<id>.json.
+    """
+    folder_przyjetych = os.path.join(folder_kolejki, "przyjete")
+    while not zatrzymaj.is_set():
+        for sciezka in sorted(glob.glob(os.path.join(folder_kolejki, "*.json"))):
+            id_zadania = os.path.splitext(os.path.basename(sciezka))[0]
+            sciezka_przyjeta = os.path.join(folder_przyjetych, os.path.basename(sciezka))
+            try:
+                os.replace(sciezka, sciezka_przyjeta)
+            except OSError:
+                continue
+            try:
+                with open(sciezka_przyjeta, 'r', encoding='utf-8') as f:
+                    kolejka.dodaj(json.load(f), id_zadania)
+            except (OSError, ValueError) as e:
+                kolejka.odrzuc(id_zadania, str(e))
+        for sciezka in glob.glob(os.path.join(folder_kolejki, "*.anuluj")):
+            kolejka.anuluj(os.path.splitext(os.path.basename(sciezka))[0])
+            os.remove(sciezka)
+        zatrzymaj.wait(interwal)
 
-    print("Krok 5/5: Generowanie finalnego pliku HTML...")
-    # ZMIANA: Użycie ścieżek względnych i nowej ścieżki wyjściowej HTML
-    generate_html_output(aggregated_segments, audio_clips_relative_paths, os.path.basename(sciezka_pliku_wideo), output_html_path)
+def uruchom_demona(parametry, folder_kolejki=None, port=None, max_zadan=1):
+    """
+    Tryb demona: modele pozostają załadowane między zadaniami, a zadania przychodzą z folderu kolejki
+    i/lub z API HTTP na localhost. Działa do przerwania (Ctrl+C).
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-    print("\n--- Zakończono pomyślnie! ---")
+    kolejka = KolejkaZadan(parametry, max_zadan, os.path.join(folder_kolejki, "status") if folder_kolejki else None)
+    zatrzymaj = threading.Event()
+    serwer = None
+
+    if folder_kolejki:
+        os.makedirs(os.path.join(folder_kolejki, "przyjete"), exist_ok=True)
+        os.makedirs(os.path.join(folder_kolejki, "status"), exist_ok=True)
+        threading.Thread(target=obserwuj_folder_kolejki, args=(kolejka, folder_kolejki, zatrzymaj), daemon=True).start()
+        print(f"Demon: obserwuję folder kolejki {folder_kolejki}")
+
+    if port:
+        class ObslugaZadan(BaseHTTPRequestHandler):
+            def _odpowiedz(self, kod, dane):
+                tresc = json.dumps(dane, ensure_ascii=False).encode('utf-8')
+                self.send_response(kod)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(tresc)))
+                self.end_headers()
+                self.wfile.write(tresc)
+
+            def _id_zadania(self):
+                czesci = self.path.strip("/").split("/")
+                return czesci[1] if len(czesci) == 2 and czesci[0] == "zadania" else None
+
+            def do_GET(self):
+                if self.path.rstrip("/") == "/zadania":
+                    return self._odpowiedz(200, kolejka.lista())
+                zadanie = kolejka.status(self._id_zadania())
+                if zadanie is None:
+                    return self._odpowiedz(404, {"blad": "nie ma takiego zadania"})
+                self._odpowiedz(200, zadanie)
+
+            def do_POST(self):
+                if self.path.rstrip("/") != "/zadania":
+                    return self._odpowiedz(404, {"blad": "nieznany adres"})
+                try:
+                    zlecenie = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"null")
+                    self._odpowiedz(201, kolejka.dodaj(zlecenie))
+                except ValueError as e:
+                    self._odpowiedz(400, {"blad": str(e)})
+
+            def do_DELETE(self):
+                id_zadania = self._id_zadania()
+                if kolejka.status(id_zadania) is None:
+                    return self._odpowiedz(404, {"blad": "nie ma takiego zadania"})
+                self._odpowiedz(200, {"anulowano": kolejka.anuluj(id_zadania)})
+
+            def log_message(self, format, *args):
+                pass
+
+        # Tylko localhost: API nie ma uwierzytelniania
+        serwer = ThreadingHTTPServer(("127.0.0.1", port), ObslugaZadan)
+        threading.Thread(target=serwer.serve_forever, daemon=True).start()
+        print(f"Demon: API HTTP na http://127.0.0.1:{port}/zadania")
+
+    print(f"Demon gotowy (maksymalnie {max_zadan} zadań jednocześnie). Ctrl+C kończy pracę.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\nZatrzymywanie demona...")
+    finally:
+        zatrzymaj.set()
+        if serwer is not None:
+            serwer.shutdown()
+        kolejka.zamknij()
+
+
+def _otworz_indeks(sciezka_indeksu):
+    """Opens (creating if needed) the SQLite inverted index: one row per token occurrence, clustered by token."""
+    os.makedirs(os.path.dirname(os.path.abspath(sciezka_indeksu)), exist_ok=True)
+    polaczenie = sqlite3.connect(sciezka_indeksu)
+    polaczenie.executescript("""
+        PRAGMA journal_mode = WAL;
+        CREATE TABLE IF NOT EXISTS zrodla (
+            id INTEGER PRIMARY KEY, folder TEXT UNIQUE, plik TEXT, sygnatura TEXT, liczba_tokenow INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS tokeny (id INTEGER PRIMARY KEY, token TEXT UNIQUE);
+        CREATE TABLE IF NOT EXISTS wystapienia (
+            token_id INTEGER, zrodlo_id INTEGER, pozycja INTEGER,
+            start_ms INTEGER, end_ms INTEGER, mowca TEXT, slowo TEXT,
+            PRIMARY KEY (token_id, zrodlo_id, pozycja)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS wystapienia_pozycje ON wystapienia (zrodlo_id, pozycja);
+    """)
+    return polaczenie
+
+def _wynik_folderu_roboczego(folder_roboczy):
+    """Returns (kind, path) of the result a work folder holds, preferring the columnar one, or None."""
+    meta = os.path.join(folder_roboczy, "wynik_kolumnowy", "meta.json")
+    if os.path.exists(meta):
+        return "kolumnowy", meta
+    sciezka_json = os.path.join(folder_roboczy, "wynik_finalny.json")
+    if os.path.exists(sciezka_json):
+        return "json", sciezka_json
+    return None
+
+def znajdz_foldery_robocze(sciezki):
+    """Finds <name>_work folders with a result under the given paths (a path may also be a work folder itself)."""
+    foldery = []
+    for sciezka in sciezki:
+        for folder, podfoldery, _ in os.walk(os.path.abspath(sciezka)):
+            if folder.endswith("_work") and _wynik_folderu_roboczego(folder):
+                foldery.append(folder)
+                podfoldery.clear()
+    return sorted(set(foldery))
+
+def _tokeny_wyniku(folder_roboczy, rodzaj, sciezka):
+    """Yields (token, word, start_ms, end_ms, speaker) for every word token of a work folder's result, in order."""
+    import math
+    if rodzaj == "kolumnowy":
+        tabela = wczytaj_wynik_kolumnowy(os.path.dirname(sciezka))
+    else:
+        with open(sciezka, 'r', encoding='utf-8') as f:
+            tabela = tabela_wyniku(json.load(f))
+    start, koniec, mowca = czasy_i_mowcy_slow(tabela)
+    slowa = _teksty_jednostek(tabela["slowa_tekst"], tabela["slowa_tekst_od"], range(len(start)))
+
+    def ms(wartosc):
+        return None if math.isnan(wartosc) else int(round(wartosc * 1000))
+
+    for i, slowo in enumerate(slowa):
+        etykieta = tabela["mowcy"][mowca[i]] if mowca[i] >= 0 else None
+        for token in WZORZEC_TOKENU.findall(slowo):
+            yield token.casefold(), token, ms(start[i]), ms(koniec[i]), etykieta
+
+def indeksuj_foldery(sciezki, sciezka_indeksu=DOMYSLNY_PLIK_INDEKSU):
+    """
+    Dodaje do indeksu pełnotekstowego wyniki z folderów roboczych znalezionych pod podanymi ścieżkami.
+    Indeksowane są tylko foldery nowe lub zmienione od ostatniego razu (czas modyfikacji i rozmiar pliku wyniku);
+    foldery, których już nie ma, są usuwane z indeksu.
+    """
+    polaczenie = _otworz_indeks(sciezka_indeksu)
+    znane = {folder: (id_zrodla, sygnatura) for id_zrodla, folder, sygnatura in polaczenie.execute("SELECT id, folder, sygnatura FROM zrodla")}
+    id_tokenow = dict(polaczenie.execute("SELECT token, id FROM tokeny"))
+    foldery = znajdz_foldery_robocze(sciezki)
+    zaindeksowane = pominiete = 0
+
+    for folder in foldery:
+        rodzaj, sciezka = _wynik_folderu_roboczego(folder)
+        stat = os.stat(sciezka)
+        sygnatura = f"{rodzaj}:{stat.st_mtime_ns}:{stat.st_size}"
+        if folder in znane and znane[folder][1] == sygnatura:
+            pominiete += 1
+            continue
+        try:
+            tokeny = list(_tokeny_wyniku(folder, rodzaj, sciezka))
+        except Exception as e:
+            print(f"Ostrzeżenie: Pominięto {folder}: {e}")
+            continue
+        metryki_folderu = _wczytaj_json_lub_pusty(os.path.join(folder, PLIK_METRYK))
+        plik = metryki_folderu.get("plik") or os.path.basename(folder)[:-len("_work")]
+
+        # Jedna transakcja na folder: przerwane indeksowanie nie zostawia folderu w połowie
+        with polaczenie:
+            if folder in znane:
+                id_zrodla = znane[folder][0]
+                polaczenie.execute("DELETE FROM wystapienia WHERE zrodlo_id = ?", (id_zrodla,))
+                polaczenie.execute("UPDATE zrodla SET plik = ?, sygnatura = ?, liczba_tokenow = ? WHERE id = ?",
+                                   (plik, sygnatura, len(tokeny), id_zrodla))
+            else:
+                id_zrodla = polaczenie.execute("INSERT INTO zrodla (folder, plik, sygnatura, liczba_tokenow) VALUES (?, ?, ?, ?)",
+                                               (folder, plik, sygnatura, len(tokeny))).lastrowid
+            for token, *_ in tokeny:
+                if token not in id_tokenow:
+                    id_tokenow[token] = polaczenie.execute("INSERT INTO tokeny (token) VALUES (?)", (token,)).lastrowid
+            polaczenie.executemany(
+                "INSERT INTO wystapienia VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((id_tokenow[token], id_zrodla, pozycja, start_ms, end_ms, mowca, slowo)
+                 for pozycja, (token, slowo, start_ms, end_ms, mowca) in enumerate(tokeny))
+            )
+        zaindeksowane += 1
+        print(f"Zaindeksowano: {folder} ({len(tokeny)} słów)")
+
+    korzenie = [os.path.join(os.path.abspath(sciezka), "") for sciezka in sciezki]
+    usuniete = [(id_zrodla,) for folder, (id_zrodla, _) in znane.items()
+                if folder not in foldery and any(os.path.join(folder, "").startswith(korzen) for korzen in korzenie)]
+    with polaczenie:
+        polaczenie.executemany("DELETE FROM wystapienia WHERE zrodlo_id = ?", usuniete)
+        polaczenie.executemany("DELETE FROM zrodla WHERE id = ?", usuniete)
+    polaczenie.close()
+    print(f"Indeks {sciezka_indeksu}: {zaindeksowane} zaindeksowanych, {pominiete} bez zmian, {len(usuniete)} usuniętych.")
+
+def szukaj_w_indeksie(fraza, sciezka_indeksu=DOMYSLNY_PLIK_INDEKSU, mowca=None, limit=50, kontekst=8):
+    """
+    Finds a word or phrase (consecutive tokens, case-insensitive) in the index. Returns hits with the source file,
+    work folder, start/end in milliseconds, speaker and the surrounding words; mowca restricts hits to one speaker.
+    """
+    tokeny = [token.casefold() for token in WZORZEC_TOKENU.findall(fraza)]
+    if not tokeny:
+        return []
+    polaczenie = _otworz_indeks(sciezka_indeksu)
+    id_tokenow = []
+    for token in tokeny:
+        wiersz = polaczenie.execute("SELECT id FROM tokeny WHERE token = ?", (token,)).fetchone()
+        if wiersz is None:
+            polaczenie.close()
+            return []
+        id_tokenow.append(wiersz[0])
+
+    # Fraza: kolejne tokeny na kolejnych pozycjach tego samego źródła
+    zlaczenia = "".join(
+        f" JOIN wystapienia w{i} ON w{i}.zrodlo_id = w0.zrodlo_id AND w{i}.pozycja = w0.pozycja + {i} AND w{i}.token_id = ?"
+        for i in range(1, len(id_tokenow))
+    )
+    warunek_mowcy = " AND w0.mowca = ?" if mowca else ""
+    ostatni = len(id_tokenow) - 1
+    zapytanie = (
+        f"SELECT z.plik, z.folder, w0.zrodlo_id, w0.pozycja, w0.start_ms, w{ostatni}.end_ms, w0.mowca"
+        f" FROM wystapienia w0{zlaczenia} JOIN zrodla z ON z.id = w0.zrodlo_id"
+        f" WHERE w0.token_id = ?{warunek_mowcy} ORDER BY z.plik, w0.pozycja LIMIT ?"
+    )
+    argumenty = id_tokenow[1:] + [id_tokenow[0]] + ([mowca.replace("Mówca ", "SPEAKER_")] if mowca else []) + [limit]
+    trafienia = []
+    for plik, folder, id_zrodla, pozycja, start_ms, end_ms, mowca_trafienia in polaczenie.execute(zapytanie, argumenty).fetchall():
+        slowa = [slowo for (slowo,) in polaczenie.execute(
+            "SELECT slowo FROM wystapienia WHERE zrodlo_id = ? AND pozycja BETWEEN ? AND ? ORDER BY pozycja",
+            (id_zrodla, pozycja - kontekst, pozycja + ostatni + kontekst)
+        )]
+        trafienia.append({
+            "plik": plik,
+            "folder": folder,
+            "start_ms": start_ms,
+            "end_ms": end_ms,
+            "mowca": mowca_trafienia.replace("SPEAKER_", "Mówca ") if mowca_trafienia else None,
+            "kontekst": " ".join(slowa),
+        })
+    polaczenie.close()
+    return trafienia
 
 
 if __name__ == "__main__":
     load_dotenv()
-    default_compute_type = "float16" if torch.cuda.is_available() else "int8"
     parser = argparse.ArgumentParser(
         description="Generuje interaktywną stronę HTML z transkrypcją wideo.",
         formatter_class=argparse.RawTextHelpFormatter
     )
-    parser.add_argument("sciezka_wideo", type=str, help="Ścieżka do pliku wideo.")
-    parser.add_argument("--liczba_mowcow", type=int, default=os.getenv("DEFAULT_SPEAKERS", None), help="Liczba mówców (wymagane).")
+    parser.add_argument("sciezka_wideo", type=str, nargs="?",
+                        help="Ścieżka do pliku wideo, folderu, wzorca glob (np. 'nagrania/*.mp4')\nlub pliku manifestu (.txt, jedna ścieżka w linii).")
+    parser.add_argument("--liczba_mowcow", type=int, default=os.getenv("DEFAULT_SPEAKERS", None), help="Liczba mówców. Domyślnie wyznaczana przez diarization.")
     parser.add_argument("--model", type=str, default=os.getenv("DEFAULT_MODEL", "large-v2"),
                         choices=["tiny", "base", "small", "medium", "large-v1", "large-v2", "large-v3"],
                         help="Model Whisper do użycia.")
     parser.add_argument("--jezyk", type=str, default=os.getenv("DEFAULT_LANGUAGE", "pl"), help="Kod języka (np. 'pl', 'en').")
-    parser.add_argument("--batch_size", type=int, default=16, help="Liczba segmentów przetwarzanych równolegle.")
-    parser.add_argument("--cpu_threads", type=int, default=os.cpu_count(), help="Liczba wątków CPU do użycia.")
-    parser.add_argument("--compute_type", type=str, default=default_compute_type,
-                        choices=["float16", "float32", "int8", "int8_float16"],
-                        help=f"Typ obliczeń. Domyślnie: '{default_compute_type}'.")
-    parser.add_argument("--beam_size", type=int, default=5, help="Liczba 'promieni' w beam search.")
+    parser.add_argument("--batch_size", type=int, default=None,
+                        help="Liczba segmentów przetwarzanych równolegle. Domyślnie z profilu --autotune albo 16.")
+    parser.add_argument("--cpu_threads", type=int, default=None,
+                        help="Liczba wątków CPU do użycia. Domyślnie z profilu --autotune albo wszystkie.")
+    parser.add_argument("--compute_type", type=str, default=None,
+                        choices=["auto", "float16", "float32", "int8", "int8_float16"],
+                        help="Typ obliczeń. Domyślnie z profilu --autotune albo 'auto': 'float16' na GPU, 'int8' na CPU.")
+    parser.add_argument("--beam_size", type=int, default=None,
+                        help="Liczba 'promieni' w beam search. Domyślnie z profilu --autotune albo 5.")
+    parser.add_argument("--autotune", action="store_true",
+                        help="Kalibruje --batch_size, --compute_type, --cpu_threads i --beam_size na próbce wejścia\n"
+                             "(albo syntetycznym nagraniu, gdy nie podano pliku) i zapisuje najlepsze w profilu hosta\n"
+                             "dla modelu; kolejne uruchomienia używają go dla argumentów niepodanych jawnie.")
+    parser.add_argument("--autotune_dlugosc", type=float, default=60.0,
+                        help="(--autotune) Długość próbki kalibracyjnej w sekundach.")
+    parser.add_argument("--tryb_audio", type=str, default="klipy", choices=TRYBY_AUDIO_HTML,
+                        help="Odtwarzanie w HTML: 'klipy' (osobny plik WAV na segment) lub jedna ścieżka\n"
+                             "'wav', 'opus' albo 'mp3' przewijana do początku segmentu (bez cięcia klipów).")
+    parser.add_argument("--format_danych", type=str, default="js", choices=FORMATY_DANYCH_HTML,
+                        help="Format pliku z segmentami wczytywanego przez stronę HTML: 'js' (działa z file://)\n"
+                             "lub 'ndjson'/'ndjson.gz' (wczytywany strumieniowo, wymaga serwera HTTP).")
+    parser.add_argument("--cache_dir", type=str, default=DOMYSLNY_FOLDER_CACHE,
+                        help="Folder cache wyników etapów (ekstrakcja, ASR, wyrównanie, diarization).")
+    parser.add_argument("--cache_limit_gb", type=float, default=20.0,
+                        help="Maksymalny rozmiar cache w GB; najdawniej używane wpisy są usuwane.")
+    parser.add_argument("--eksport_json", action="store_true",
+                        help="Dodatkowo zapisuje wynik w formacie wynik_finalny.json (zgodność z innymi narzędziami).")
+    parser.add_argument("--podzial_na_slowa", action="store_true",
+                        help="Dzieli wypowiedzi na poziomie słów, także przy zmianie mówcy wewnątrz segmentu.")
+    parser.add_argument("--max_przerwa", type=float, default=None,
+                        help="Nowa wypowiedź po przerwie dłuższej niż podana (w sekundach), nawet dla tego samego mówcy.")
+    parser.add_argument("--max_wypowiedz", type=float, default=None,
+                        help="Maksymalna długość wypowiedzi w sekundach; dłuższe są dzielone.")
+    parser.add_argument("--korekta", action="store_true",
+                        help="Poprawia gramatykę i pisownię wypowiedzi lokalnym LanguageTool (wymaga Javy);\n"
+                             "pierwotny tekst jest podświetlany w HTML jako zmiana.")
+    parser.add_argument("--serwery_korekty", type=int, default=2,
+                        help="(--korekta) Liczba lokalnych serwerów LanguageTool sprawdzających paczki zdań równolegle.")
+    parser.add_argument("--no-vad", dest="vad", action="store_false",
+                        help="Wyłącza wstępny VAD: transkrypcja i diarization dostają całe nagranie, łącznie z ciszą.")
+    parser.add_argument("--rownolegla_diaryzacja", action="store_true",
+                        help="Uruchamia diarization równolegle z transkrypcją i wyrównaniem.")
+    parser.add_argument("--watki_diaryzacji", type=int, default=None,
+                        help="(Tylko CPU) Wątki torch dla diarization/wyrównania w trybie równoległym.\n"
+                             "Pozostałe z --cpu_threads dostaje ASR. Domyślnie połowa.")
+    parser.add_argument("--dlugosc_fragmentu", type=float, default=None,
+                        help="Przetwarza nagranie w oknach o tej długości (w sekundach) z punktami kontrolnymi,\n"
+                             "przy stałym zużyciu pamięci (np. 600 dla nagrań wielogodzinnych).")
+    parser.add_argument("--zakladka", type=float, default=30.0,
+                        help="Zakładka między oknami w trybie fragmentów (w sekundach).")
+    parser.add_argument("--start", type=float, default=None,
+                        help="Początek przetwarzanego fragmentu wideo (w sekundach).")
+    parser.add_argument("--end", type=float, default=None,
+                        help="Koniec przetwarzanego fragmentu wideo (w sekundach).")
+    parser.add_argument("--raport", type=str, default="raport_wsadowy.json", help="Ścieżka raportu JSON w trybie wsadowym.")
+    parser.add_argument("--procesy", type=int, default=1,
+                        help="(Tryb wsadowy) Liczba procesów przetwarzających pliki równolegle;\n"
+                             "--cpu_threads jest dzielone po równo między procesy.")
+    parser.add_argument("--demon", action="store_true",
+                        help="Tryb demona: modele zostają w pamięci, a zadania przychodzą z --kolejka i/lub --port.\n"
+                             "Pozostałe argumenty są domyślnymi parametrami zadań.")
+    parser.add_argument("--kolejka", type=str, default=None,
+                        help="(Demon) Folder kolejki: pliki <id>.json ze zleceniami, <id>.anuluj anuluje zadanie.")
+    parser.add_argument("--port", type=int, default=None, help="(Demon) Port API HTTP na 127.0.0.1.")
+    parser.add_argument("--max_zadan", type=int, default=1, help="(Demon) Liczba zadań przetwarzanych jednocześnie. Transkrypcja i diarization\n"
+                             "zadań wykonują się po kolei; równolegle działają pozostałe etapy.")
+    parser.add_argument("--prometheus", type=str, default=None,
+                        help="Zapisuje metryki etapów (czas, CPU, szczytowe RSS procesu, RTF) do pliku tekstowego Prometheusa,\n"
+                             "np. w katalogu kolektora textfile node_exportera.")
+    parser.add_argument("--sledz", action="store_true",
+                        help="Śledzi rosnący plik nagrania: transkrybuje tylko nowo dopisane audio, a po każdym oknie\n"
+                             "zapisuje od nowa wynik kolumnowy i stronę HTML (klipy tylko dla nowych wypowiedzi).")
+    parser.add_argument("--sledz_krok", type=float, default=30.0,
+                        help="(--sledz) Ile sekund nowego audio uruchamia transkrypcję kolejnego okna.")
+    parser.add_argument("--sledz_interwal", type=float, default=5.0,
+                        help="(--sledz) Co ile sekund sprawdzać, czy plik urósł.")
+    parser.add_argument("--sledz_koniec", type=float, default=60.0,
+                        help="(--sledz) Koniec śledzenia, gdy plik nie rośnie przez tyle sekund.")
+    parser.add_argument("--zapisz_glos", type=str, nargs=2, metavar=("NAZWA", "PLIK"), default=None,
+                        help="Dodaje do bazy głosów próbkę mówcy (plik audio/wideo, w którym mówi tylko on);\n"
+                             "rozpoznani mówcy dostają w transkrypcji tę nazwę zamiast 'Mówca NN'.")
+    parser.add_argument("--prog_glosu", type=float, default=PROG_PODOBIENSTWA_GLOSU,
+                        help="Minimalne podobieństwo kosinusowe embeddingu mówcy do głosu z bazy (0-1).")
+    parser.add_argument("--indeksuj", type=str, nargs="+", metavar="FOLDER", default=None,
+                        help="Dodaje do indeksu pełnotekstowego wyniki folderów <nazwa>_work znalezionych pod podanymi\n"
+                             "folderami; indeksowane są tylko foldery nowe lub zmienione.")
+    parser.add_argument("--szukaj", type=str, metavar="FRAZA", default=None,
+                        help="Wyszukuje słowo lub frazę w indeksie i wypisuje trafienia z czasem w milisekundach.")
+    parser.add_argument("--indeks", type=str, default=DOMYSLNY_PLIK_INDEKSU, help="Plik indeksu pełnotekstowego (SQLite).")
+    parser.add_argument("--mowca", type=str, default=None, help="(--szukaj) Tylko trafienia danego mówcy, np. 'Mówca 01'.")
+    parser.add_argument("--limit", type=int, default=50, help="(--szukaj) Maksymalna liczba trafień.")
 
     args = parser.parse_args()
-    if args.liczba_mowcow is None:
-        sys.exit("BŁĄD: Argument --liczba_mowcow jest wymagany.")
-    
-    if not torch.cuda.is_available():
-        print(f"Ustawiam liczbę wątków CPU na: {args.cpu_threads}")
-        torch.set_num_threads(args.cpu_threads)
+    if args.zapisz_glos:
+        zapisz_glos(*args.zapisz_glos, args.cache_dir)
+        sys.exit(0)
+    if args.indeksuj or args.szukaj:
+        if args.indeksuj:
+            indeksuj_foldery(args.indeksuj, args.indeks)
+        if args.szukaj:
+            trafienia = szukaj_w_indeksie(args.szukaj, args.indeks, args.mowca, args.limit)
+            for trafienie in trafienia:
+                czas = format_timestamp(trafienie["start_ms"] / 1000) if trafienie["start_ms"] is not None else "--:--:--"
+                print(f"{trafienie['plik']}\t{trafienie['start_ms']}-{trafienie['end_ms']} ms [{czas}]\t"
+                      f"{trafienie['mowca'] or '?'}: {trafienie['kontekst']}")
+            print(f"Trafień: {len(trafienia)}" + (f" (limit {args.limit})" if len(trafienia) == args.limit else ""))
+        sys.exit(0)
+    if args.demon:
+        if not args.kolejka and not args.port:
+            sys.exit("BŁĄD: Tryb --demon wymaga --kolejka lub --port.")
+    elif args.sciezka_wideo is None:
+        if not args.autotune:
+            sys.exit("BŁĄD: Podaj ścieżkę do pliku wideo (albo użyj --demon).")
+
+    if args.procesy < 1:
+        sys.exit("BŁĄD: --procesy musi być co najmniej 1.")
+    if args.start is not None and args.end is not None and args.end <= args.start:
+        sys.exit("BŁĄD: --end musi być większy niż --start.")
+    if args.dlugosc_fragmentu is not None and args.dlugosc_fragmentu <= args.zakladka:
+        sys.exit("BŁĄD: --dlugosc_fragmentu musi być większa niż --zakladka.")
+    if args.sledz:
+        nieobslugiwane = [opcja for opcja, wartosc in (
+            ("--demon", args.demon), ("--korekta", args.korekta), ("--eksport_json", args.eksport_json),
+            ("--prometheus", args.prometheus), ("--start", args.start), ("--end", args.end),
+            ("--dlugosc_fragmentu", args.dlugosc_fragmentu), ("--rownolegla_diaryzacja", args.rownolegla_diaryzacja),
+        ) if wartosc not in (None, False)]
+        if nieobslugiwane:
+            sys.exit(f"BŁĄD: --sledz nie obsługuje opcji: {', '.join(nieobslugiwane)}.")
+
+    if args.autotune:
+        pliki_probki = zbierz_pliki_wejsciowe(args.sciezka_wideo) if args.sciezka_wideo else []
+        sciezka_probki = przygotuj_probke_kalibracji(pliki_probki[0] if pliki_probki else None, args.cache_dir, args.autotune_dlugosc)
+        kalibruj_sprzet(sciezka_probki, args.model, args.jezyk, args.cache_dir,
+                        args.beam_size or DOMYSLNE_USTAWIENIA_ASR["beam_size"], args.cpu_threads)
+        if args.sciezka_wideo is None and not args.demon:
+            sys.exit(0)
+    # Argumenty niepodane jawnie: z profilu sprzętowego, a bez niego wartości domyślne
+    profil_sprzetu = wczytaj_profil_sprzetu(args.cache_dir, args.model) or {}
+    for nazwa, domyslna in DOMYSLNE_USTAWIENIA_ASR.items():
+        if getattr(args, nazwa) is None:
+            setattr(args, nazwa, profil_sprzetu.get(nazwa) or domyslna)
+    if profil_sprzetu:
+        print(f"Profil sprzętowy ({klucz_profilu_sprzetu(args.model)}): batch_size {args.batch_size}, "
+              f"compute_type {args.compute_type}, cpu_threads {args.cpu_threads}, beam_size {args.beam_size}.")
 
     asr_options = {"beam_size": args.beam_size}
-    
-    transkrybuj_i_generuj_html(
-        args.sciezka_wideo,
-        int(args.liczba_mowcow),
-        args.model,
-        args.jezyk,
-        args.batch_size,
-        args.compute_type,
-        asr_options
+
+    parametry = dict(
+        liczba_mowcow=int(args.liczba_mowcow) if args.liczba_mowcow is not None else None,
+        model_whisper=args.model,
+        jezyk=args.jezyk,
+        batch_size=args.batch_size,
+        compute_type=args.compute_type,
+        asr_options=asr_options,
+        tryb_audio=args.tryb_audio,
+        format_danych_html=args.format_danych,
+        folder_cache=args.cache_dir,
+        limit_cache_gb=args.cache_limit_gb,
+        eksport_json=args.eksport_json,
+        podzial_na_slowa=args.podzial_na_slowa,
+        max_przerwa=args.max_przerwa,
+        max_dlugosc_wypowiedzi=args.max_wypowiedz,
+        korekta=args.korekta,
+        serwery_korekty=args.serwery_korekty,
+        vad=args.vad,
+        prog_glosu=args.prog_glosu,
+        rownolegla_diaryzacja=args.rownolegla_diaryzacja,
+        watki_cpu=args.cpu_threads,
+        watki_diaryzacji=args.watki_diaryzacji,
+        dlugosc_fragmentu=args.dlugosc_fragmentu,
+        zakladka_fragmentow=args.zakladka,
+        start_s=args.start,
+        koniec_s=args.end,
+        sciezka_prometheus=args.prometheus
     )
+    if args.demon:
+        uruchom_demona(parametry, args.kolejka, args.port, args.max_zadan)
+        sys.exit(0)
+    if args.sledz:
+        sledz_nagranie(args.sciezka_wideo, krok_s=args.sledz_krok, interwal_s=args.sledz_interwal,
+                       koniec_po_s=args.sledz_koniec, **parametry)
+        sys.exit(0)
+
+    pliki_wideo = zbierz_pliki_wejsciowe(args.sciezka_wideo)
+    if not pliki_wideo:
+        sys.exit(f"BŁĄD: Nie znaleziono plików wideo dla '{args.sciezka_wideo}'.")
+    if pliki_wideo == [args.sciezka_wideo]:
+        transkrybuj_i_generuj_html(args.sciezka_wideo, **parametry)
+    else:
+        przetworz_wsadowo(pliki_wideo, args.raport, procesy=args.procesy, **parametry)
 
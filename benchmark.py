@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import argparse
+import io
+import itertools
+import json
+import random
+import shutil
+import subprocess
+import statistics
+import tempfile
+import time
+import wave
+
+SCIEZKA_SKRYPTU = os.path.join(os.path.dirname(os.path.abspath(__file__)), "avi2text.py")
+
+# Moduły, które mogą być ładowane wyłącznie przez etapy, które ich potrzebują
+CIEZKIE_MODULY = ("torch", "whisperx", "moviepy", "pyannote", "language_tool_python", "numpy", "pandas")
+
+CZESTOTLIWOSC = 16000
+# Syntetyczne audio jest generowane raz i przechowywane obok cache avi2text, więc kolejne uruchomienia mierzą to samo nagranie
+FOLDER_AUDIO_BENCHMARKU = os.path.join(
+    os.environ.get("AVI2TEXT_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "avi2text")), "benchmark"
+)
+GLOSY_ESPEAK = ("pl+m3", "pl+f2", "pl+m7", "pl+f4", "pl+m1", "pl+f1")
+ZDANIA = (
+    "Dzień dobry, zaczynamy dzisiejsze spotkanie od krótkiego podsumowania.",
+    "Wyniki za ostatni kwartał są lepsze, niż zakładaliśmy w planie.",
+    "Czy możemy wrócić do tematu budżetu na przyszły rok?",
+    "Moim zdaniem warto najpierw sprawdzić dane z działu sprzedaży.",
+    "Zgadzam się, ale potrzebujemy też opinii zespołu technicznego.",
+    "Proponuję, żebyśmy przygotowali raport do końca tygodnia.",
+    "Nagranie będzie dostępne dla wszystkich uczestników spotkania.",
+    "Dziękuję bardzo, to była bardzo owocna dyskusja.",
+)
+# Formanty (F1, F2) samogłosek dla zastępczej syntezy, gdy espeak-ng nie jest dostępny
+SAMOGLOSKI = ((730, 1090), (530, 1840), (270, 2290), (570, 840), (300, 870), (440, 1020))
+# Etapy pokazywane w tabeli benchmarku pipeline
+ETAPY_PIPELINE = ("ekstrakcja", "ladowanie_modeli", "asr", "wyrownanie", "diaryzacja", "klipy", "html", "calosc")
+
+def benchmark_importu(powtorzenia, limit_s):
+    """
+    Measures the cold import of avi2text and the `--help` path in fresh interpreters.
+    Fails when the median exceeds the limit or when any heavy dependency is imported eagerly.
+    """
+    folder_skryptu = os.path.dirname(SCIEZKA_SKRYPTU)
+    kod = (
+        "import sys, time; start = time.perf_counter(); import avi2text; "
+        "print(time.perf_counter() - start); "
+        f"print(','.join(m for m in {CIEZKIE_MODULY!r} if m in sys.modules))"
+    )
+    czasy_importu = []
+    zaladowane = set()
+    for _ in range(powtorzenia):
+        wynik = subprocess.run([sys.executable, "-c", kod], cwd=folder_skryptu, capture_output=True, text=True, check=True)
+        czas, moduly = wynik.stdout.splitlines()
+        czasy_importu.append(float(czas))
+        zaladowane.update(m for m in moduly.split(",") if m)
+
+    czasy_pomocy = []
+    for _ in range(powtorzenia):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, SCIEZKA_SKRYPTU, "--help"], capture_output=True, check=True)
+        czasy_pomocy.append(time.perf_counter() - start)
+
+    mediana_importu = statistics.median(czasy_importu)
+    mediana_pomocy = statistics.median(czasy_pomocy)
+    print(f"Import avi2text: mediana {mediana_importu * 1000:.1f} ms ({powtorzenia} prób)")
+    print(f"avi2text.py --help: mediana {mediana_pomocy * 1000:.1f} ms (cały proces)")
+
+    bledy = []
+    if zaladowane:
+        bledy.append(f"import ładuje ciężkie moduły: {', '.join(sorted(zaladowane))}")
+    if mediana_pomocy > limit_s:
+        bledy.append(f"--help trwa {mediana_pomocy:.2f} s, limit to {limit_s:.2f} s")
+    for blad in bledy:
+        print(f"BŁĄD: {blad}")
+    return not bledy
+
+def syntetyczny_wynik(liczba_segmentow, slow_na_segment=12):
+    """Builds a WhisperX-shaped result with word timestamps and speakers, for serialization benchmarks."""
+    losowe = random.Random(0)
+    segmenty = []
+    czas = 0.0
+    for i in range(liczba_segmentow):
+        mowca = f"SPEAKER_{losowe.randrange(4):02d}"
+        slowa = []
+        for _ in range(slow_na_segment):
+            dlugosc = losowe.uniform(0.1, 0.6)
+            slowa.append({"word": losowe.choice(("ala", "ma", "kota", "żółw", "dzień", "dobry")), "start": round(czas, 3),
+                          "end": round(czas + dlugosc, 3), "score": round(losowe.random(), 3), "speaker": mowca})
+            czas += dlugosc
+        segmenty.append({"start": slowa[0]["start"], "end": slowa[-1]["end"], "speaker": mowca,
+                         "text": " " + " ".join(s["word"] for s in slowa), "words": slowa})
+    return {"segments": segmenty, "language": "pl"}
+
+def rozmiar_sciezki(sciezka):
+    """Returns the size of a file, or the total size of a directory's files, in bytes."""
+    if os.path.isfile(sciezka):
+        return os.path.getsize(sciezka)
+    return sum(os.path.getsize(os.path.join(sciezka, nazwa)) for nazwa in os.listdir(sciezka))
+
+def benchmark_serializacji(liczba_segmentow, powtorzenia):
+    """
+    Compares the old `wynik_finalny.json` (indent=4) with the columnar result: save time,
+    load time for the per-speaker aggregation (segments only) and size on disk.
+    """
+    sys.path.insert(0, os.path.dirname(SCIEZKA_SKRYPTU))
+    import avi2text
+
+    wynik = syntetyczny_wynik(liczba_segmentow)
+    folder = tempfile.mkdtemp(prefix="avi2text_benchmark_")
+    sciezka_json = os.path.join(folder, "wynik_finalny.json")
+    folder_kolumnowy = os.path.join(folder, "wynik_kolumnowy")
+
+    def zapisz_json():
+        with open(sciezka_json, 'w', encoding='utf-8') as f:
+            json.dump(wynik, f, ensure_ascii=False, indent=4)
+
+    def wczytaj_json():
+        with open(sciezka_json, 'r', encoding='utf-8') as f:
+            return sum(1 for s in json.load(f)["segments"] if s.get("text"))
+
+    def wczytaj_kolumnowy():
+        return sum(1 for s in avi2text.iteruj_segmenty(avi2text.wczytaj_wynik_kolumnowy(folder_kolumnowy)) if s["text"])
+
+    def zmierz(funkcja):
+        czasy = []
+        for _ in range(powtorzenia):
+            start = time.perf_counter()
+            funkcja()
+            czasy.append(time.perf_counter() - start)
+        return statistics.median(czasy)
+
+    try:
+        pomiary = {
+            "JSON (indent=4)": (zmierz(zapisz_json), zmierz(wczytaj_json), rozmiar_sciezki(sciezka_json)),
+            "kolumnowy": (zmierz(lambda: avi2text.zapisz_wynik_kolumnowy(wynik, folder_kolumnowy)),
+                          zmierz(wczytaj_kolumnowy), rozmiar_sciezki(folder_kolumnowy)),
+        }
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    print(f"Wynik syntetyczny: {liczba_segmentow} segmentów, mediana z {powtorzenia} prób")
+    for nazwa, (zapis, odczyt, rozmiar) in pomiary.items():
+        print(f"  {nazwa:<16} zapis {zapis * 1000:8.1f} ms  odczyt segmentów {odczyt * 1000:8.1f} ms  rozmiar {rozmiar / 1024 ** 2:7.2f} MB")
+    return True
+
+def _mowa_espeak(tekst, glos, tempo):
+    """Synthesizes a sentence with espeak-ng and resamples it to 16 kHz float32."""
+    import numpy as np
+    wynik = subprocess.run(["espeak-ng", "-v", glos, "-s", str(tempo), "--stdout", tekst], capture_output=True, check=True)
+    with wave.open(io.BytesIO(wynik.stdout)) as plik:
+        czestotliwosc = plik.getframerate()
+        probki = np.frombuffer(plik.readframes(plik.getnframes()), dtype=np.int16).astype(np.float32) / 32768.0
+    czasy = np.arange(int(len(probki) * CZESTOTLIWOSC / czestotliwosc)) / CZESTOTLIWOSC
+    return np.interp(czasy, np.arange(len(probki)) / czestotliwosc, probki).astype(np.float32)
+
+def _mowa_formantowa(losowe, ton_podstawowy, dlugosc_s):
+    """Synthesizes a speech-like stream of vowel syllables at the speaker's pitch (no intelligible words)."""
+    import numpy as np
+    sylaby = []
+    for _ in range(max(1, int(dlugosc_s * 4))):
+        dlugosc_sylaby = losowe.uniform(0.15, 0.3)
+        t = np.arange(int(dlugosc_sylaby * CZESTOTLIWOSC)) / CZESTOTLIWOSC
+        f0 = ton_podstawowy * (1 + 0.05 * np.sin(2 * np.pi * losowe.uniform(2, 5) * t))
+        faza = 2 * np.pi * np.cumsum(f0) / CZESTOTLIWOSC
+        f1, f2 = losowe.choice(SAMOGLOSKI)
+        sygnal = np.zeros_like(t)
+        for harmoniczna in range(1, int(4000 / ton_podstawowy)):
+            czestotliwosc = harmoniczna * ton_podstawowy
+            amplituda = np.exp(-((czestotliwosc - f1) / 120) ** 2) + 0.6 * np.exp(-((czestotliwosc - f2) / 180) ** 2)
+            sygnal += amplituda * np.sin(harmoniczna * faza)
+        sylaby.append(sygnal * np.hanning(len(t)) * 0.3 / max(1e-6, np.abs(sygnal).max()))
+    return np.concatenate(sylaby).astype(np.float32)
+
+def syntetyczne_audio(dlugosc_s, liczba_mowcow, ziarno=0):
+    """
+    Returns the path of a reproducible 16 kHz mono WAV with alternating speaker turns and pauses.
+    Uses a distinct espeak-ng voice per speaker when available, so VAD and ASR do real work;
+    otherwise falls back to formant-synthesized syllables with a distinct pitch per speaker.
+    """
+    import numpy as np
+    zrodlo = "espeak" if shutil.which("espeak-ng") else "formanty"
+    sciezka = os.path.join(FOLDER_AUDIO_BENCHMARKU, f"syntetyczne_{zrodlo}_{dlugosc_s:g}s_{liczba_mowcow}m_{ziarno}.wav")
+    if os.path.exists(sciezka):
+        return sciezka
+
+    print(f"Generowanie syntetycznego audio ({dlugosc_s:g} s, {liczba_mowcow} mówców, źródło: {zrodlo})...")
+    losowe = random.Random(ziarno)
+    szum = np.random.default_rng(ziarno)
+    fragmenty = []
+    probki = 0
+    mowca = 0
+    while probki < dlugosc_s * CZESTOTLIWOSC:
+        for _ in range(losowe.randint(1, 3)):
+            if zrodlo == "espeak":
+                mowa = _mowa_espeak(losowe.choice(ZDANIA), GLOSY_ESPEAK[mowca % len(GLOSY_ESPEAK)], losowe.randint(140, 180))
+            else:
+                mowa = _mowa_formantowa(losowe, 100 + 110 * mowca / max(1, liczba_mowcow - 1), losowe.uniform(2, 5))
+            pauza = (szum.standard_normal(int(losowe.uniform(0.2, 1.0) * CZESTOTLIWOSC)) * 0.002).astype(np.float32)
+            fragmenty += [mowa, pauza]
+            probki += len(mowa) + len(pauza)
+        mowca = (mowca + losowe.randint(1, liczba_mowcow - 1)) % liczba_mowcow if liczba_mowcow > 1 else 0
+
+    audio = np.concatenate(fragmenty)[:int(dlugosc_s * CZESTOTLIWOSC)]
+    os.makedirs(FOLDER_AUDIO_BENCHMARKU, exist_ok=True)
+    sciezka_tymczasowa = f"{sciezka}.{os.getpid()}.tmp"
+    with wave.open(sciezka_tymczasowa, 'wb') as plik:
+        plik.setnchannels(1)
+        plik.setsampwidth(2)
+        plik.setframerate(CZESTOTLIWOSC)
+        plik.writeframes((np.clip(audio, -1, 1) * 32767).astype(np.int16).tobytes())
+    os.replace(sciezka_tymczasowa, sciezka)
+    return sciezka
+
+def benchmark_pipeline(sciezka_audio, liczba_mowcow, siatka, jezyk, sciezka_wyniku):
+    """
+    Runs the full pipeline with the `tiny` model on CPU once per configuration of the grid,
+    each in a fresh work folder and cache, and reports the realtime factor of every stage.
+    """
+    # Wymuszenie CPU przed pierwszym importem torch, żeby wyniki były porównywalne między maszynami
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    sys.path.insert(0, os.path.dirname(SCIEZKA_SKRYPTU))
+    import avi2text
+    avi2text.load_dotenv()
+
+    sciezka_audio = os.path.abspath(sciezka_audio)
+    raporty = []
+    for batch_size, compute_type, watki_cpu, beam_size in siatka:
+        konfiguracja = {"batch_size": batch_size, "compute_type": compute_type, "cpu_threads": watki_cpu, "beam_size": beam_size}
+        print(f"\n=== Konfiguracja: {konfiguracja} ===")
+        folder = tempfile.mkdtemp(prefix="avi2text_benchmark_")
+        folder_poprzedni = os.getcwd()
+        os.chdir(folder)
+        try:
+            wynik = avi2text.transkrybuj_i_generuj_html(
+                sciezka_audio, liczba_mowcow, "tiny", jezyk, batch_size, compute_type, {"beam_size": beam_size},
+                otworz_w_przegladarce=False, folder_cache=os.path.join(folder, "cache"), watki_cpu=watki_cpu
+            )
+            raporty.append({"konfiguracja": konfiguracja, "metryki": wynik["metryki"], "blad": None})
+        except SystemExit as e:
+            raporty.append({"konfiguracja": konfiguracja, "metryki": None, "blad": str(e.code)})
+        finally:
+            os.chdir(folder_poprzedni)
+            shutil.rmtree(folder, ignore_errors=True)
+
+    print(f"\nRTF etapów (czas etapu / długość audio), audio: {sciezka_audio}")
+    print(f"{'batch':>5} {'typ':>8} {'wątki':>5} {'beam':>4}  " + " ".join(f"{etap[:10]:>10}" for etap in ETAPY_PIPELINE))
+    for raport in raporty:
+        k = raport["konfiguracja"]
+        naglowek = f"{k['batch_size']:>5} {k['compute_type']:>8} {k['cpu_threads']:>5} {k['beam_size']:>4}  "
+        if raport["blad"]:
+            print(naglowek + f"BŁĄD: {raport['blad']}")
+            continue
+        etapy = raport["metryki"]["etapy"]
+        print(naglowek + " ".join(f"{etapy[etap]['rtf']:>10.4f}" if etap in etapy else f"{'-':>10}" for etap in ETAPY_PIPELINE))
+
+    if sciezka_wyniku:
+        with open(sciezka_wyniku, 'w', encoding='utf-8') as f:
+            json.dump(raporty, f, ensure_ascii=False, indent=4)
+        print(f"Wyniki zapisane w: {sciezka_wyniku}")
+    return all(raport["blad"] is None for raport in raporty)
+
+def benchmark_bez_ml(liczba_segmentow, powtorzenia, limit_rtf):
+    """
+    Times the stages that do not use models (per-speaker aggregation, clip slicing, HTML generation)
+    on a stub transcript with a matching silent recording, and fails when a stage exceeds the RTF limit.
+    """
+    import numpy as np
+    sys.path.insert(0, os.path.dirname(SCIEZKA_SKRYPTU))
+    import avi2text
+
+    wynik = syntetyczny_wynik(liczba_segmentow)
+    dlugosc_s = wynik["segments"][-1]["end"] + 1.0
+    folder = tempfile.mkdtemp(prefix="avi2text_benchmark_")
+    sciezka_audio = os.path.join(folder, "audio.wav")
+    szum = np.random.default_rng(0)
+    with wave.open(sciezka_audio, 'wb') as plik:
+        plik.setnchannels(1)
+        plik.setsampwidth(2)
+        plik.setframerate(CZESTOTLIWOSC)
+        for _ in range(0, int(dlugosc_s * CZESTOTLIWOSC), 60 * CZESTOTLIWOSC):
+            plik.writeframes((szum.standard_normal(60 * CZESTOTLIWOSC) * 30).astype(np.int16).tobytes())
+
+    def zmierz(funkcja, przygotuj=None):
+        czasy = []
+        for _ in range(powtorzenia):
+            if przygotuj:
+                przygotuj()
+            start = time.perf_counter()
+            funkcja()
+            czasy.append(time.perf_counter() - start)
+        return statistics.median(czasy)
+
+    folder_klipow = os.path.join(folder, "audio_clips")
+
+    def wyczysc_klipy():
+        shutil.rmtree(folder_klipow, ignore_errors=True)
+        os.makedirs(folder_klipow)
+
+    try:
+        tabela = avi2text.tabela_wyniku(wynik)
+        zagregowane = avi2text.agreguj_wypowiedzi(tabela)
+        sciezki_klipow = [os.path.join("audio_clips", avi2text.nazwa_klipu(segment)) for segment in zagregowane]
+        pomiary = {
+            "agregacja": zmierz(lambda: avi2text.agreguj_wypowiedzi(tabela)),
+            "agregacja (słowa)": zmierz(lambda: avi2text.agreguj_wypowiedzi(tabela, podzial_na_slowa=True, max_przerwa=1.0, max_dlugosc=60.0)),
+            "klipy (wszystkie)": zmierz(lambda: avi2text.aktualizuj_klipy_audio(sciezka_audio, zagregowane, folder_klipow, "benchmark"), wyczysc_klipy),
+            "klipy (bez zmian)": zmierz(lambda: avi2text.aktualizuj_klipy_audio(sciezka_audio, zagregowane, folder_klipow, "benchmark")),
+            "html": zmierz(lambda: avi2text.generate_html_output(
+                zagregowane, sciezki_klipow, "benchmark.mp4", os.path.join(folder, "benchmark.html"), otworz_w_przegladarce=False
+            )),
+        }
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    print(f"\nTranskrypcja zastępcza: {liczba_segmentow} segmentów, {len(zagregowane)} wypowiedzi, "
+          f"{dlugosc_s / 3600:.2f} h audio, mediana z {powtorzenia} prób")
+    bledy = []
+    for etap, czas in pomiary.items():
+        rtf = czas / dlugosc_s
+        print(f"  {etap:<18} {czas * 1000:9.1f} ms  RTF {rtf:.6f}")
+        if limit_rtf is not None and rtf > limit_rtf:
+            bledy.append(f"{etap}: RTF {rtf:.6f} przekracza limit {limit_rtf:.6f}")
+    for blad in bledy:
+        print(f"BŁĄD: {blad}")
+    return not bledy
+
+def lista(typ):
+    """Returns an argparse type that parses a comma-separated list of values."""
+    return lambda tekst: [typ(wartosc) for wartosc in tekst.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarki skryptu avi2text.")
+    podkomendy = parser.add_subparsers(dest="benchmark", required=True)
+
+    parser_importu = podkomendy.add_parser("import", help="Czas importu i szybkiej ścieżki CLI.")
+    parser_importu.add_argument("--powtorzenia", type=int, default=5, help="Liczba pomiarów.")
+    parser_importu.add_argument("--limit", type=float, default=0.5, help="Maksymalny czas '--help' w sekundach.")
+
+    parser_serializacji = podkomendy.add_parser("serializacja", help="Zapis i odczyt wyniku: JSON a format kolumnowy.")
+    parser_serializacji.add_argument("--segmenty", type=int, default=20000, help="Liczba segmentów syntetycznego wyniku.")
+    parser_serializacji.add_argument("--powtorzenia", type=int, default=3, help="Liczba pomiarów.")
+
+    parser_pipeline = podkomendy.add_parser("pipeline", help="Pełny pipeline (model 'tiny', CPU) dla siatki konfiguracji.")
+    parser_pipeline.add_argument("--audio", type=str, default=None,
+                                 help="Własne nagranie zamiast syntetycznego (wtedy podaj też --mowcy).")
+    parser_pipeline.add_argument("--dlugosc", type=float, default=120.0, help="Długość syntetycznego audio w sekundach.")
+    parser_pipeline.add_argument("--mowcy", type=int, default=2, help="Liczba mówców.")
+    parser_pipeline.add_argument("--ziarno", type=int, default=0, help="Ziarno generatora syntetycznego audio.")
+    parser_pipeline.add_argument("--jezyk", type=str, default="pl", help="Kod języka.")
+    parser_pipeline.add_argument("--batch_size", type=lista(int), default=[16], help="Wartości oddzielone przecinkami, np. 4,16.")
+    parser_pipeline.add_argument("--compute_type", type=lista(str), default=["int8"], help="Np. int8,float32.")
+    parser_pipeline.add_argument("--cpu_threads", type=lista(int), default=[os.cpu_count()], help="Np. 2,4,8.")
+    parser_pipeline.add_argument("--beam_size", type=lista(int), default=[5], help="Np. 1,5.")
+    parser_pipeline.add_argument("--wynik", type=str, default=None, help="Zapisuje pełne metryki wszystkich konfiguracji do JSON.")
+
+    parser_bez_ml = podkomendy.add_parser("bez_ml", help="Agregacja, cięcie klipów i HTML na transkrypcji zastępczej.")
+    parser_bez_ml.add_argument("--segmenty", type=int, default=2000, help="Liczba segmentów transkrypcji zastępczej.")
+    parser_bez_ml.add_argument("--powtorzenia", type=int, default=3, help="Liczba pomiarów.")
+    parser_bez_ml.add_argument("--limit_rtf", type=float, default=None, help="Maksymalny RTF każdego etapu.")
+
+    args = parser.parse_args()
+    if args.benchmark == "import":
+        sys.exit(0 if benchmark_importu(args.powtorzenia, args.limit) else 1)
+    elif args.benchmark == "serializacja":
+        sys.exit(0 if benchmark_serializacji(args.segmenty, args.powtorzenia) else 1)
+    elif args.benchmark == "pipeline":
+        sciezka_audio = args.audio or syntetyczne_audio(args.dlugosc, args.mowcy, args.ziarno)
+        siatka = list(itertools.product(args.batch_size, args.compute_type, args.cpu_threads, args.beam_size))
+        sys.exit(0 if benchmark_pipeline(sciezka_audio, args.mowcy, siatka, args.jezyk, args.wynik) else 1)
+    elif args.benchmark == "bez_ml":
+        sys.exit(0 if benchmark_bez_ml(args.segmenty, args.powtorzenia, args.limit_rtf) else 1)
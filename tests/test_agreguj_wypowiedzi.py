@@ -0,0 +1,56 @@
+import os
+import random
+import sys
+
+import pytest
+
+pytest.importorskip("dotenv")
+pytest.importorskip("numpy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import avi2text  # noqa: E402
+
+
+def agreguj_petla(segmenty):
+    """The per-segment aggregation loop agreguj_wypowiedzi replaced."""
+    wypowiedzi = []
+    biezaca = None
+    for segment in segmenty:
+        if "speaker" not in segment or not segment.get("text", "").strip():
+            continue
+        if biezaca and biezaca["speaker"] == segment["speaker"]:
+            biezaca["text"] += " " + segment["text"].strip()
+            biezaca["end"] = segment["end"]
+        else:
+            if biezaca:
+                wypowiedzi.append(biezaca)
+            biezaca = {"speaker": segment["speaker"], "text": segment["text"].strip(),
+                       "start": segment["start"], "end": segment["end"]}
+    if biezaca:
+        wypowiedzi.append(biezaca)
+    return wypowiedzi
+
+
+def losowe_segmenty(los):
+    segmenty = []
+    czas = 0.0
+    for _ in range(los.randint(0, 30)):
+        # Segmenty mogą na siebie nachodzić, być bez mówcy albo bez tekstu
+        start = round(czas + los.uniform(-2.0, 2.0), 3)
+        segment = {"start": start, "end": round(start + los.uniform(0.1, 4.0), 3),
+                   "text": los.choice([" ala ma kota ", "zażółć gęślą jaźń", "", "  ", " raz"])}
+        if los.random() < 0.9:
+            segment["speaker"] = f"SPEAKER_0{los.randint(0, 2)}"
+        segmenty.append(segment)
+        czas = start + los.uniform(0.0, 3.0)
+    return segmenty
+
+
+def test_wypowiedzi_z_segmentow_jak_w_petli():
+    los = random.Random(0)
+    for _ in range(3000):
+        segmenty = losowe_segmenty(los)
+        oczekiwane = [
+            dict(w, speaker=w["speaker"].replace("SPEAKER_", "Mówca ")) for w in agreguj_petla(segmenty)
+        ]
+        tabela = avi2text.tabela_wyniku({"segments": segmenty})
+        assert avi2text.agreguj_wypowiedzi(tabela) == oczekiwane